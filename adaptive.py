@@ -0,0 +1,148 @@
+"""
+Per-viewer adaptation of the MJPEG streams. A viewer asks for a profile
+(output size, JPEG quality, fps); an AdaptiveRate watches how long its
+socket takes to accept each frame, how many frames it had to skip because
+the socket was still busy, and how long a frame takes to reach the viewer
+(its age plus the bytes still queued in the kernel at the measured rate),
+and steps down a ladder of cheaper profiles when the link can't keep up: lower
+JPEG quality first, then fewer frames. Once the link has had spare capacity
+for a while it steps back up. Quality steps are fixed values, so viewers on
+similar links end up sharing one encoded variant in the pipeline.
+"""
+import struct
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None # Not on Linux: no backlog measurement, skipped frames and send time still work
+
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+ADAPT_WINDOW = 1.0             # Seconds of sends judged at a time
+MAX_DELAY = 0.5                # Estimated seconds until a frame reaches the viewer; beyond it, step down at once
+BUSY_HIGH = 0.7                # Share of the window spent waiting for the socket: the link is full
+SKIP_HIGH = 0.1                # ... or this share of the frames skipped
+BUSY_LOW = 0.3                 # Below this, with nothing skipped, there is room for the next step up
+UPGRADE_AFTER = 10.0           # Seconds of spare capacity before stepping back up;
+UPGRADE_AFTER_MAX = 300.0      # doubled up to this each time the step up fills the link again
+ADAPT_QUALITIES = (60, 45, 30) # JPEG quality steps below the requested one
+MIN_FPS = 1.0                  # The fps cap is halved down to this
+SEND_BUFFER = 64 * 1024        # Kernel send buffer per viewer (2-3 frames), so a full link blocks the send
+
+# One encode per frame per variant, shared by every viewer that wants it
+Variant = namedtuple("Variant", "width height quality")
+# What one viewer gets: a variant, at `fps` frames a second at most (0 = every frame)
+StreamProfile = namedtuple("StreamProfile", "variant fps")
+
+
+def unsent_bytes(sock):
+    """
+    Bytes written to `sock` that the viewer hasn't acknowledged yet; 0 where unknown.
+    """
+    if fcntl is None or sock is None:
+        return 0
+    try:
+        return struct.unpack("i", fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b"\0\0\0\0"))[0]
+    except (OSError, ValueError):
+        return 0 # Closed, or not a socket this platform can ask
+
+
+def ladder(profile):
+    """
+    Profiles from `profile` down to the cheapest one.
+    """
+    variant, fps = profile
+    steps = [profile]
+    for quality in ADAPT_QUALITIES:
+        if quality < variant.quality:
+            variant = variant._replace(quality=quality)
+            steps.append(StreamProfile(variant, fps))
+    while fps and fps / 2 >= MIN_FPS:
+        fps /= 2
+        steps.append(StreamProfile(variant, fps))
+    return steps
+
+
+class AdaptiveRate:
+    """
+    One viewer's position on its ladder. The server calls sent() after each
+    frame it wrote and switches the viewer to `profile` when that returns
+    True. With adaptive=False the viewer stays on its requested profile and
+    a slow link only makes it skip frames.
+    """
+
+    def __init__(self, profile, adaptive=True):
+        self.steps = ladder(profile) if adaptive else [profile]
+        self.level = 0
+        self.busy = 0.0    # Share of the last window spent waiting for the socket
+        self.skipped = 0.0 # Share of the last window's frames skipped
+        self.kbytes_per_second = 0.0
+        self._window_start = time.monotonic()
+        self._waited = 0.0
+        self._bytes = 0
+        self._frames = 0
+        self._skipped = 0
+        self._hold_until = 0.0
+        self._spare_since = None
+        self._upgrade_after = UPGRADE_AFTER
+        self._upgraded_at = None
+
+    @property
+    def profile(self):
+        return self.steps[self.level]
+
+    def sent(self, size, seconds, age, skipped=0, backlog=0):
+        """
+        Records a frame of `size` bytes that took `seconds` to go onto the
+        socket and was `age` seconds old by then, after `skipped` frames the
+        viewer missed since the last one, with `backlog` bytes (unsent_bytes())
+        still queued ahead of its end. True when the profile changed.
+        """
+        now = time.monotonic()
+        self._waited += seconds
+        self._bytes += size
+        self._frames += 1
+        self._skipped += skipped
+        delay = age + (backlog / (self.kbytes_per_second * 1024) if self.kbytes_per_second else 0.0)
+        if delay > MAX_DELAY and now >= self._hold_until:
+            # What is queued already drains at the old rate; judge the new profile after that
+            return self._step(1, now, f"{delay * 1000:.0f} ms behind", settle=delay)
+
+        elapsed = now - self._window_start
+        if elapsed < ADAPT_WINDOW:
+            return False
+        self.busy = self._waited / elapsed
+        self.skipped = self._skipped / (self._frames + self._skipped)
+        self.kbytes_per_second = self._bytes / elapsed / 1024
+        self._window_start, self._waited, self._bytes, self._frames, self._skipped = now, 0.0, 0, 0, 0
+        if now < self._hold_until:
+            return False # The previous step is still settling
+        if self.busy > BUSY_HIGH or self.skipped > SKIP_HIGH:
+            return self._step(1, now, f"link full ({self.kbytes_per_second:.0f} kB/s, "
+                                      f"{self.skipped:.0%} of frames skipped)")
+        if self.busy >= BUSY_LOW or self.skipped:
+            self._spare_since = None
+        elif self._spare_since is None:
+            self._spare_since = now
+        elif now - self._spare_since >= self._upgrade_after:
+            return self._step(-1, now, f"link has room ({self.kbytes_per_second:.0f} kB/s)")
+        return False
+
+    def _step(self, direction, now, reason, settle=0.0):
+        level = min(max(self.level + direction, 0), len(self.steps) - 1)
+        self._hold_until = now + ADAPT_WINDOW + settle
+        self._spare_since = None
+        if level == self.level:
+            return False
+        if direction > 0 and self._upgraded_at is not None and now - self._upgraded_at < UPGRADE_AFTER:
+            self._upgrade_after = min(self._upgrade_after * 2, UPGRADE_AFTER_MAX) # Back to where it was too much
+        self._upgraded_at = now if direction < 0 else None
+        self.level = level
+        METRICS.incr("web_adapt_down" if direction > 0 else "web_adapt_up")
+        (width, height, quality), fps = self.profile
+        print(f"Viewer: {reason}, now {width}x{height} at quality {quality}, {fps:g} fps")
+        return True
@@ -0,0 +1,345 @@
+"""
+MJPEG server on a single asyncio event loop, for many viewers on a small Pi.
+
+Serves the same pages and streams as rtsp_stream_flask.py (/, /video_feed,
+/mosaic_feed, /mosaic, /next, /prev, /status, /health, /metrics, /wake) without a
+thread per viewer. Frames are still produced by the broadcaster's pipeline
+threads; each channel has one bridge into the loop per stream profile in
+use (?size=, ?quality=, ?fps=, see adaptive.py), and every viewer is a
+coroutine that sends the newest frame once its socket has taken the last
+one, so a slow viewer skips frames instead of queueing them, and moves to
+a cheaper profile's bridge if that is not enough. The H.264 passthrough
+(/live) stays with the Flask server.
+
+    python async_server.py --port 8080
+    python videopi.py --async-web
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+import rtsp_stream_flask as web
+from adaptive import SEND_BUFFER, AdaptiveRate, unsent_bytes
+from core import FrameRate
+from idle import IDLE
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+ASYNC_HOST = "0.0.0.0"
+ASYNC_PORT = 8080
+REQUEST_TIMEOUT = 10.0    # Seconds a client gets to send its request headers
+SEND_TIMEOUT = 15.0       # A viewer whose socket hasn't taken a frame for this long is dropped
+MAX_REQUEST_SIZE = 8192
+
+NO_CACHE = (("Cache-Control", "no-cache, no-store, must-revalidate"), ("Pragma", "no-cache"), ("Expires", "0"))
+STATUS_TEXT = {200: "OK", 302: "Found", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+# args: query parameters (first value of each); header names lower-cased
+Request = namedtuple("Request", "method path args headers")
+
+
+def response_head(status, content_type=None, length=None, headers=()):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", "Connection: close"]
+    if content_type:
+        lines.append(f"Content-Type: {content_type}")
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+def parse_request(head):
+    """
+    A Request from the raw request head.
+    """
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, _ = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    target = urlsplit(target)
+    args = {name: values[0] for name, values in parse_qs(target.query).items()}
+    return Request(method, target.path, args, headers)
+
+
+# --- CHANNEL BRIDGE ---
+
+class ChannelBridge:
+    """
+    The event loop's subscriber to a broadcaster channel for one stream
+    profile. put(), close() and due() are called from the pipeline thread;
+    put() hands the frame over to the loop, where viewers wait for a frame
+    newer than their last one.
+    """
+
+    def __init__(self, loop, channel, profile):
+        self.loop = loop
+        self.channel = channel
+        self.profile = profile
+        self.variant = profile.variant
+        self.rate = FrameRate(profile.fps)
+        self.frame = None
+        self.seq = 0
+        self.closed = False
+        self.viewers = 0
+        self.dropped = 0     # Subscriber interface; viewers skip frames instead
+        self.pipeline = None # Set by Broadcaster.subscribe()
+        self._changed = asyncio.Event()
+
+    # --- pipeline thread ---
+
+    def due(self, timestamp):
+        return self.rate.due(timestamp)
+
+    def put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self._publish, item)
+        except RuntimeError:
+            pass # Loop already closed (shutting down)
+
+    def close(self):
+        self.put(None)
+
+    # --- event loop ---
+
+    def _publish(self, item):
+        if item is None:
+            self.closed = True
+        else:
+            self.frame = item
+            self.seq += 1
+        # Wake everyone waiting on this generation; later waiters get a fresh event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def next_frame(self, last_seq):
+        """
+        The newest frame once it is newer than `last_seq`; None when the channel closed.
+        """
+        while self.seq == last_seq and not self.closed:
+            await self._changed.wait()
+        return None if self.closed else self.frame
+
+
+# --- SERVER ---
+
+class AsyncMJPEGServer:
+    """
+    Serves the web UI from one event loop: in the caller's loop with serve(),
+    or in a thread of its own with start() / shutdown() (as videopi.py does).
+    """
+
+    def __init__(self, host=ASYNC_HOST, port=ASYNC_PORT):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.channels = {} # (channel, profile) -> ChannelBridge
+        self.viewers = 0
+        self._server = None
+        self._thread = None
+        self._connections = {} # Task -> writer of every open connection
+        self._ready = threading.Event()
+        self.routes = {
+            "/": self._index,
+            "/mosaic": self._mosaic,
+            "/video_feed": lambda request, writer: self._stream(request, writer, web.LIVE_CHANNEL),
+            "/mosaic_feed": self._mosaic_feed,
+            "/next": lambda request, writer: self._cycle(request, writer, 'next'),
+            "/prev": lambda request, writer: self._cycle(request, writer, 'prev'),
+            "/status": lambda request, writer: self._json(writer, web.get_status()),
+            "/health": lambda request, writer: self._json(writer, {"feeds": web.HEALTH.table()}),
+            "/metrics": self._metrics,
+            "/wake": lambda request, writer: self._json(writer, IDLE.stats()),
+        }
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_REQUEST_SIZE)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Async web server on http://{self.host}:{self.port}/")
+        self._ready.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        # Let the dropped connections unwind before the loop goes away
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=1.0)
+
+    def start(self):
+        """
+        Runs serve() in a background thread; returns once the port is open.
+        """
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="web", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def shutdown(self, timeout=2.0):
+        """
+        Stops accepting, ends every stream, and waits for the loop thread.
+        """
+        if self.loop is None or self._server is None:
+            return
+        self.loop.call_soon_threadsafe(self._close)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _close(self):
+        self._server.close()
+        for writer in self._connections.values():
+            writer.transport.abort()
+
+    # --- connections ---
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            request = parse_request(head)
+            if request.path not in web.QUIET_PATHS:
+                IDLE.activity("http")
+            if request.method != "GET":
+                writer.write(response_head(405, length=0))
+            else:
+                route = self.routes.get(request.path)
+                if route is None:
+                    self._text(writer, 404, "Not Found")
+                else:
+                    await route(request, writer)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError, ValueError):
+            pass # Bad or abandoned request, or the viewer went away
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def _index(self, request, writer):
+        self._html(writer, web.index_html(passthrough=False))
+
+    async def _mosaic(self, request, writer):
+        try:
+            page = web.mosaic_page(request.args)
+        except ValueError as e:
+            self._text(writer, 400, f"Bad page: {e}")
+            return
+        self._html(writer, web.mosaic_html(page))
+
+    async def _mosaic_feed(self, request, writer):
+        try:
+            page = web.mosaic_page(request.args)
+        except ValueError as e:
+            self._text(writer, 400, f"Bad page: {e}")
+            return
+        await self._stream(request, writer, web.mosaic_channel(page))
+
+    def _text(self, writer, status, text):
+        body = text.encode()
+        writer.write(response_head(status, "text/plain", len(body)) + body)
+
+    def _html(self, writer, html):
+        body = html.encode()
+        writer.write(response_head(200, "text/html; charset=utf-8", len(body), NO_CACHE) + body)
+
+    async def _json(self, writer, payload):
+        body = json.dumps(payload).encode()
+        writer.write(response_head(200, "application/json", len(body)) + body)
+
+    async def _metrics(self, request, writer):
+        METRICS.set("async_web_viewers", self.viewers)
+        body = web.render_metrics().encode()
+        writer.write(response_head(200, "text/plain; version=0.0.4", len(body)) + body)
+
+    async def _cycle(self, request, writer, direction):
+        # Opening the next feed's reader may block briefly, keep it off the loop
+        await self.loop.run_in_executor(None, web.switch_feed, direction)
+        if "application/json" in request.headers.get("accept", ""):
+            await self._json(writer, web.get_status())
+        else:
+            writer.write(response_head(302, length=0, headers=(("Location", "/"),)))
+
+    async def _stream(self, request, writer, channel):
+        try:
+            pacer = AdaptiveRate(web.stream_profile(request.args), web.WEB_ADAPTIVE)
+        except ValueError as e:
+            self._text(writer, 400, f"Bad stream parameters: {e}")
+            return
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            # Beyond 2-3 frames in the kernel the viewer skips frames, and the pacer sees the send block
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        writer.transport.set_write_buffer_limits(high=0) # drain() waits until the frame is in the kernel
+        writer.write(response_head(200, web.MJPEG_MIMETYPE, headers=NO_CACHE))
+
+        bridge = self._join(channel, pacer.profile)
+        print(f"Viewer joined ({channel}, {self.viewers} watching)")
+        last_seq = 0
+        skipped = 0
+        try:
+            while True:
+                encoded = await bridge.next_frame(last_seq)
+                if encoded is None:
+                    break # Pipeline could not open or was shut down
+                missed = bridge.seq - last_seq - 1 if last_seq else 0
+                skipped += missed
+                last_seq = bridge.seq
+                start = time.monotonic()
+                writer.write(web.mjpeg_part(encoded))
+                await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+                now = time.monotonic()
+                if pacer.sent(len(encoded.data), now - start, now - encoded.timestamp, missed, unsent_bytes(sock)):
+                    # Over to the new profile's bridge (joined first, so the pipeline never idles)
+                    previous, bridge = bridge, self._join(channel, pacer.profile)
+                    self._leave(previous)
+                    last_seq = 0
+        finally:
+            self._leave(bridge)
+            print(f"Viewer left (skipped {skipped} frames)")
+
+    def _join(self, channel, profile):
+        key = (channel, profile)
+        bridge = self.channels.get(key)
+        if bridge is None or bridge.closed:
+            bridge = self.channels[key] = ChannelBridge(self.loop, channel, profile)
+            url, name, capture = web.channel_source(channel)
+            web.BROADCASTER.subscribe(channel, url, name, bridge, capture)
+        bridge.viewers += 1
+        self.viewers += 1
+        METRICS.set("async_web_viewers", self.viewers)
+        return bridge
+
+    def _leave(self, bridge):
+        bridge.viewers -= 1
+        self.viewers -= 1
+        METRICS.set("async_web_viewers", self.viewers)
+        if bridge.viewers == 0:
+            # The pipeline outlives its last subscriber by the broadcaster's grace period
+            if not bridge.closed:
+                web.BROADCASTER.unsubscribe(bridge)
+            key = (bridge.channel, bridge.profile)
+            if self.channels.get(key) is bridge:
+                del self.channels[key]
+
+
+def start_async_web(host=ASYNC_HOST, port=ASYNC_PORT):
+    return AsyncMJPEGServer(host, port).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MJPEG web server on one asyncio event loop.")
+    parser.add_argument("--host", default=ASYNC_HOST)
+    parser.add_argument("--port", type=int, default=ASYNC_PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(AsyncMJPEGServer(args.host, args.port).serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,834 @@
+"""
+Off-device benchmark for the doorbell LCD loop and the MJPEG web server.
+
+Drives the real run_doorbell() / generate_frames() pipelines from a local
+video file or an animated test image, with a null LCD, simulated buttons
+and a local MJPEG client, and prints the results as JSON:
+
+    python bench.py lcd --source synthetic --seconds 20
+    python bench.py web --source clip.mp4 --clients 3
+    python bench.py viewers --server async
+    python bench.py connect --source feeds.json --connects 5
+    python bench.py idle --source clip.mp4
+    python bench.py adapt --server async --link 100
+    python bench.py all --output results.json
+
+Each scenario in "all" runs in its own process so CPU time and peak RSS
+are not mixed up.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+from decoder import BACKENDS, create_decoder
+
+# --- CONFIGURATION ---
+BENCH_IMAGE = "testimage.jpeg"
+BENCH_FEEDS = 3
+SYNTHETIC_URL = "synthetic:"
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+VIEWER_STEPS = (1, 5, 10, 20) # Concurrent viewers for the viewers scenario
+CONNECT_TIMEOUT = 15.0        # Seconds the connect scenario waits for a feed's first frame
+CONNECT_SAMPLE = 2.0          # Seconds of frames read per connect for the decoder latency
+SLOW_RECEIVE_BUFFER = 32 * 1024 # Receive buffer of the adapt scenario's slow client, like a small Wi-Fi window
+
+
+# --- SOURCES ---
+
+class SyntheticDecoder:
+    """
+    Decoder backend that animates a still image at a fixed frame rate, so the
+    pipeline downstream of decode can be measured without any video file.
+    """
+    name = "synthetic"
+    supports_standby = True
+
+    def __init__(self, url, fps=25, size=(1280, 720), image=BENCH_IMAGE, standby=False, **_):
+        self.url = url
+        self.fps = fps
+        self.size = tuple(size)
+        self.image = image
+        self.standby = standby
+        self._base = None
+        self._next = 0.0
+        self._index = 0
+
+    def open(self):
+        image = cv2.imread(self.image)
+        if image is None:
+            image = np.full((self.size[1], self.size[0], 3), 96, np.uint8)
+        self._base = cv2.resize(image, self.size, interpolation=cv2.INTER_LINEAR)
+        self._next = time.monotonic()
+        return True
+
+    def read(self):
+        if self._base is None:
+            return False, None
+        # Standby only produces a frame per second, like a keyframe-only stream
+        self._next += 1.0 if self.standby else 1.0 / self.fps
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._index += 1
+        return True, np.roll(self._base, self._index * 4, axis=1)
+
+    def set_keyframes_only(self, enabled):
+        self.standby = enabled
+
+    def set_standby(self, enabled):
+        self.standby = enabled
+        self._next = time.monotonic()
+
+    def release(self):
+        self._base = None
+
+
+class PacedDecoder:
+    """
+    Wraps a real backend and plays a local file at `fps` (0 = as fast as it
+    decodes), looping at the end. URLs may carry a "#n" suffix so several
+    feeds can point at the same file.
+
+    PyAV sources are paced per demuxed packet, like a camera delivers them,
+    so keyframe-only and standby reads also run in real time. The packet
+    tap is passed through for the clip recorder.
+    """
+    name = "paced"
+    supports_standby = True # Replaced per instance by the wrapped backend's
+
+    def __init__(self, url, fps=25, inner=None, **options):
+        self.url = url
+        self.fps = fps
+        self.decoder = create_decoder(url.split("#")[0], inner, **options)
+        self.supports_standby = self.decoder.supports_standby
+        self._per_packet = hasattr(self.decoder, "packet_tap")
+        if self._per_packet:
+            self.packet_tap = None
+            self.decoder.packet_tap = self._on_packet
+        self._next = 0.0
+
+    def open(self):
+        self._next = time.monotonic()
+        return self.decoder.open()
+
+    def read(self):
+        ret, frame = self.decoder.read()
+        if not ret:
+            self.decoder.release()
+            if not self.decoder.open():
+                return False, None
+            ret, frame = self.decoder.read()
+        if not self._per_packet:
+            self._pace()
+        return ret, frame
+
+    def _on_packet(self, packet, stream):
+        self._pace()
+        tap = self.packet_tap
+        if tap is not None:
+            tap(packet, stream)
+
+    def _pace(self):
+        if not self.fps:
+            return
+        self._next += 1.0 / self.fps
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next = time.monotonic() # Fell behind, don't burst to catch up
+
+    @property
+    def frame_latency(self):
+        return self.decoder.frame_latency
+
+    def set_keyframes_only(self, enabled):
+        self.decoder.set_keyframes_only(enabled)
+
+    def set_standby(self, enabled):
+        self.decoder.set_standby(enabled)
+
+    def release(self):
+        self.decoder.release()
+
+
+BACKENDS[SyntheticDecoder.name] = SyntheticDecoder
+BACKENDS[PacedDecoder.name] = PacedDecoder
+
+
+def decoder_settings(args):
+    """
+    Returns (backend, options) for the benchmark source.
+    """
+    if args.source == "synthetic":
+        width, height = (int(v) for v in args.size.split("x"))
+        return SyntheticDecoder.name, {"fps": args.fps, "size": (width, height)}
+    return PacedDecoder.name, {"fps": args.fps, "inner": args.backend, "skip_nonref": args.backend == "pyav"}
+
+
+def write_feeds(args):
+    """
+    Writes a temporary feeds.json with --feeds entries for the source (with
+    the --capture settings) and points both entry points at it. A feeds.json
+    given as the source is used as it is; returns None then.
+    """
+    if args.source.endswith(".json"):
+        os.environ["VIDEOPI_FEEDS"] = os.path.abspath(args.source)
+        return None
+    base = SYNTHETIC_URL if args.source == "synthetic" else os.path.abspath(args.source)
+    feeds = [{"name": f"Bench {i}", "url": f"{base}#{i}", "motion": args.motion} for i in range(args.feeds)]
+    if args.capture:
+        for feed in feeds:
+            feed["capture"] = json.loads(args.capture)
+    handle, path = tempfile.mkstemp(prefix="videopi-bench-", suffix=".json")
+    with os.fdopen(handle, "w") as f:
+        json.dump(feeds, f)
+    os.environ["VIDEOPI_FEEDS"] = path
+    return path
+
+
+# --- MEASUREMENT ---
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {f"p{p}": None for p in LATENCY_PERCENTILES}
+    return {
+        f"p{p}": round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000, 2)
+        for p in LATENCY_PERCENTILES
+    }
+
+
+def stage_report():
+    """
+    Median and p95 per instrumented stage, in milliseconds.
+    """
+    report = {}
+    with metrics.METRICS._lock:
+        timers = dict(metrics.METRICS.stages)
+    for name, timer in sorted(timers.items()):
+        p50, p95 = timer.percentile(0.5), timer.percentile(0.95)
+        report[name] = {
+            "count": timer.count,
+            "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 3) if p95 is not None else None,
+        }
+    return report
+
+
+class Measurement:
+    """
+    CPU time and wall time over the measured window; peak RSS for the process.
+    """
+
+    def __init__(self):
+        self.wall = time.monotonic()
+        self.cpu = self._cpu()
+
+    @staticmethod
+    def _cpu():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def result(self):
+        wall = time.monotonic() - self.wall
+        cpu = self._cpu() - self.cpu
+        return {
+            "seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(cpu / wall * 100, 1) if wall else None,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def process_status():
+    """
+    Current RSS (MB) and thread count of this process, from /proc/self/status.
+    """
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "Threads"):
+                status[key] = int(value.split()[0])
+    return {"rss_mb": round(status.get("VmRSS", 0) / 1024, 1), "threads": status.get("Threads", 0)}
+
+
+def press_periodically(press, interval, stop):
+    if not interval:
+        return
+    while not stop.wait(interval):
+        press()
+
+
+# --- SCENARIOS ---
+
+def start_lcd(args):
+    """
+    Starts run_doorbell() on the bench source with a null LCD and simulated buttons.
+    """
+    from buttons import SimulatedButtonInput
+    from lcd_sink import NullDevice, RGB565Display
+    import doorbell
+
+    backend, options = decoder_settings(args)
+    doorbell.DECODER_BACKEND = backend
+    doorbell.DECODER_OPTIONS = options
+    doorbell.STANDBY_BUDGET = args.standby
+    doorbell.MOSAIC_ON_START = args.mosaic
+    doorbell.preconnect() # As videopi.py does: the first feed connects while the display is set up
+    doorbell.buttons = SimulatedButtonInput()
+    device = NullDevice(bus_speed_hz=args.bus_hz)
+    doorbell.device = RGB565Display(device, dirty_rows=doorbell.DISPLAY_DIRTY_ROWS) if doorbell.DISPLAY_FAST_PATH else device
+
+    loop = threading.Thread(target=doorbell.run_doorbell, name="bench-lcd", daemon=True)
+    loop.start()
+    return doorbell, loop
+
+
+def start_web(args):
+    """
+    Serves the web app (--server flask or async) on a free local port;
+    returns (server module, httpd, port).
+    """
+    import rtsp_stream_flask as server
+
+    backend, options = decoder_settings(args)
+    server.BROADCASTER.backend = backend
+    server.BROADCASTER.decoder_options = options
+    if args.web_fps is not None:
+        server.BROADCASTER.max_fps = args.web_fps
+
+    if args.server == "async":
+        from async_server import AsyncMJPEGServer
+        httpd = AsyncMJPEGServer("127.0.0.1", 0).start()
+        return server, httpd, httpd.port
+
+    from werkzeug.serving import make_server
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="bench-server", daemon=True).start()
+    return server, httpd, httpd.server_port
+
+
+def client_report(clients, seconds):
+    return [
+        {"frames": c.frames, "fps": round(c.frames / seconds, 2),
+         "kbytes_per_second": round(c.bytes / seconds / 1024, 1), "error": c.error}
+        for c in clients
+    ]
+
+
+def bench_lcd(args):
+    """
+    run_doorbell() against a null LCD with simulated buttons.
+    """
+    from buttons import ACTION_NEXT
+
+    doorbell, loop = start_lcd(args)
+    time.sleep(args.warmup)
+    metrics.METRICS.reset()
+
+    stop = threading.Event()
+    presser = threading.Thread(target=press_periodically, daemon=True,
+                               args=(lambda: doorbell.buttons.press(ACTION_NEXT), args.switch_every, stop))
+    presser.start()
+    measurement = Measurement()
+    time.sleep(args.seconds)
+    result = measurement.result()
+    stop.set()
+    doorbell.stop_doorbell()
+    loop.join(5.0)
+
+    latency = metrics.METRICS.stages.get("lcd_latency")
+    switch = metrics.METRICS.stages.get("switch")
+    frames = latency.count if latency else 0
+    result.update({
+        "scenario": "lcd",
+        "mosaic": args.mosaic,
+        "frames": frames,
+        "fps": round(frames / result["seconds"], 2),
+        "latency_ms": percentiles(latency.recent if latency else []),
+        "switch_ms": percentiles(switch.recent if switch else []),
+        "transform_allocations": metrics.METRICS.counters.get("transform_allocations", 0),
+        "stages": stage_report(),
+        "counters": dict(metrics.METRICS.counters),
+    })
+    return result
+
+
+def bench_startup(args):
+    """
+    Time from process start to the first LCD frame, split into milestones.
+    Run on its own (or from "all"), so the interpreter start-up and imports
+    are part of it; a null display stands in for the LCD init.
+    """
+    doorbell, loop = start_lcd(args)
+    deadline = time.monotonic() + args.warmup + args.seconds
+    while "first_frame" not in doorbell.STARTUP and time.monotonic() < deadline:
+        time.sleep(0.01)
+    doorbell.stop_doorbell()
+    loop.join(5.0)
+
+    first_frame = doorbell.STARTUP.get("first_frame")
+    target = doorbell.STARTUP_TARGET if args.startup_target is None else args.startup_target
+    return {
+        "scenario": "startup",
+        "milestones_s": {stage: round(seconds, 3) for stage, seconds in doorbell.STARTUP.items()},
+        "time_to_first_frame_s": round(first_frame, 3) if first_frame is not None else None,
+        "target_s": target,
+        "within_target": first_frame is not None and first_frame <= target,
+    }
+
+
+class MJPEGClient(threading.Thread):
+    """
+    Reads /video_feed like a browser would and records, per frame, the time
+    since the frame was decoded (from the X-Timestamp part header). With
+    `rate` (bytes a second) it reads no faster than a link of that speed.
+    """
+
+    def __init__(self, port, path="/video_feed", rate=0):
+        super().__init__(name="bench-client", daemon=True)
+        self.port = port
+        self.path = path
+        self.rate = rate
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.recording = False
+        self.error = None
+        self._stop = threading.Event()
+
+    def run(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        try:
+            if self.rate:
+                connection.sock = socket.socket()
+                connection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SLOW_RECEIVE_BUFFER)
+                connection.sock.settimeout(10)
+                connection.sock.connect(("127.0.0.1", self.port))
+            connection.request("GET", self.path)
+            response = connection.getresponse()
+            started, total = time.monotonic(), 0
+            while not self._stop.is_set():
+                headers = self._read_part_headers(response)
+                if headers is None:
+                    break
+                data = response.read(int(headers["content-length"]))
+                received = time.monotonic()
+                if self.rate:
+                    total += len(data)
+                    time.sleep(max(0.0, started + total / self.rate - received))
+                if self.recording:
+                    self.frames += 1
+                    self.bytes += len(data)
+                    if "x-timestamp" in headers:
+                        self.latencies.append(received - float(headers["x-timestamp"]))
+        except Exception as e:
+            if not self._stop.is_set():
+                self.error = str(e)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _read_part_headers(response):
+        headers = {}
+        while True:
+            line = response.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                if headers:
+                    return headers
+                continue
+            if b":" in line:
+                key, value = line.split(b":", 1)
+                headers[key.decode().lower()] = value.decode().strip()
+
+    def stop(self):
+        self._stop.set()
+
+
+def bench_web(args):
+    """
+    The Flask server on a local port with --clients MJPEG clients.
+    """
+    _, httpd, port = start_web(args)
+
+    clients = [MJPEGClient(port) for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    time.sleep(args.warmup)
+    metrics.METRICS.reset()
+
+    def switch():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        connection.request("GET", "/next", headers={"Accept": "application/json"})
+        connection.getresponse().read()
+        connection.close()
+
+    stop = threading.Event()
+    threading.Thread(target=press_periodically, args=(switch, args.switch_every, stop), daemon=True).start()
+    for client in clients:
+        client.recording = True
+    measurement = Measurement()
+    time.sleep(args.seconds)
+    for client in clients:
+        client.recording = False
+    result = measurement.result()
+    stop.set()
+    for client in clients:
+        client.stop()
+    httpd.shutdown()
+
+    seconds = result["seconds"]
+    latencies = [latency for client in clients for latency in client.latencies]
+    result.update({
+        "scenario": "web",
+        "server": args.server,
+        "clients": client_report(clients, seconds),
+        "fps": round(sum(c.frames for c in clients) / seconds / max(1, len(clients)), 2),
+        "encoded_fps": round(metrics.METRICS.stages["encode"].count / seconds, 2) if "encode" in metrics.METRICS.stages else 0.0,
+        "latency_ms": percentiles(latencies),
+        "transform_allocations": metrics.METRICS.counters.get("transform_allocations", 0),
+        "stages": stage_report(),
+        "counters": dict(metrics.METRICS.counters),
+    })
+    return result
+
+
+def bench_combined(args):
+    """
+    The LCD loop and the web server in one process, as videopi.py runs them:
+    both watch the first feed, which should be decoded once.
+    """
+    doorbell, loop = start_lcd(args)
+    _, httpd, port = start_web(args)
+    clients = [MJPEGClient(port) for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    time.sleep(args.warmup)
+    metrics.METRICS.reset()
+
+    for client in clients:
+        client.recording = True
+    measurement = Measurement()
+    time.sleep(args.seconds)
+    for client in clients:
+        client.recording = False
+    result = measurement.result()
+    from core import HUB
+    shared = HUB.readers()
+    for client in clients:
+        client.stop()
+    doorbell.stop_doorbell()
+    loop.join(5.0)
+    httpd.shutdown()
+
+    seconds = result["seconds"]
+    lcd = metrics.METRICS.stages.get("lcd_latency")
+    result.update({
+        "scenario": "combined",
+        "decoded_fps": round(metrics.METRICS.counters.get("frames_decoded", 0) / seconds, 2),
+        "lcd_fps": round((lcd.count if lcd else 0) / seconds, 2),
+        "web_fps": round(sum(c.frames for c in clients) / seconds / max(1, len(clients)), 2),
+        "clients": client_report(clients, seconds),
+        "shared_readers": shared, # {url: taps}
+        "stages": stage_report(),
+        "counters": dict(metrics.METRICS.counters),
+    })
+    return result
+
+
+def bench_viewers(args):
+    """
+    Cost per viewer: the web server (--server) with VIEWER_STEPS concurrent
+    MJPEG clients, measuring CPU, RSS and threads at each step. The clients
+    run in this process too, so compare the per-viewer slopes of the two
+    servers rather than the absolute numbers.
+    """
+    _, httpd, port = start_web(args)
+    clients = []
+    steps = []
+    for count in VIEWER_STEPS:
+        while len(clients) < count:
+            clients.append(MJPEGClient(port))
+            clients[-1].start()
+        time.sleep(args.warmup)
+        for client in clients:
+            client.frames = 0
+            client.recording = True
+        measurement = Measurement()
+        time.sleep(args.seconds)
+        for client in clients:
+            client.recording = False
+        result = measurement.result()
+        seconds = result["seconds"]
+        fps = [client.frames / seconds for client in clients]
+        result.update(process_status())
+        result.update({
+            "viewers": count,
+            "threads": result["threads"] - count, # Without the client threads
+            "fps_min": round(min(fps), 2),
+            "fps_mean": round(sum(fps) / count, 2),
+            "errors": sum(1 for client in clients if client.error),
+        })
+        del result["peak_rss_mb"]
+        steps.append(result)
+    for client in clients:
+        client.stop()
+    httpd.shutdown()
+
+    first, last = steps[0], steps[-1]
+    extra = last["viewers"] - first["viewers"]
+    return {
+        "scenario": "viewers",
+        "server": args.server,
+        "steps": steps,
+        "per_viewer": {
+            "cpu_percent": round((last["cpu_percent"] - first["cpu_percent"]) / extra, 2),
+            "rss_mb": round((last["rss_mb"] - first["rss_mb"]) / extra, 3),
+            "threads": round((last["threads"] - first["threads"]) / extra, 2),
+        },
+    }
+
+
+def bench_connect(args):
+    """
+    Per feed, --connects times: time to open the stream, time to the first
+    frame and the decoder's per-frame latency, with the feed's "capture"
+    settings. With --source feeds.json this measures the real cameras, to
+    tune each one's settings.
+    """
+    import core
+
+    feeds = core.parse_feeds(os.environ["VIDEOPI_FEEDS"])
+    backend, options = (None, None) if args.source.endswith(".json") else decoder_settings(args)
+    report = []
+    for feed in feeds:
+        opens, first_frames, latencies, failures = [], [], [], 0
+        for _ in range(args.connects):
+            tap = core.HUB.acquire(feed['url'], feed['name'], backend, options, capture=feed.get('capture'))
+            _, frame, _ = tap.buffer.get(0, timeout=CONNECT_TIMEOUT)
+            if frame is None:
+                failures += 1
+            else:
+                time.sleep(CONNECT_SAMPLE)
+                opens.append(tap.open_latency)
+                first_frames.append(tap.first_frame_latency)
+                latencies.extend(tap.reader.latencies)
+            tap.stop()
+            tap.reader.stop(timeout=2.0) # The next connect must be a fresh one
+        report.append({
+            "name": feed['name'],
+            "capture": feed.get('capture'),
+            "open_ms": percentiles(opens),
+            "first_frame_ms": percentiles(first_frames),
+            "latency_ms": percentiles(latencies),
+            "failures": failures,
+        })
+    return {"scenario": "connect", "connects": args.connects, "feeds": report}
+
+
+def bench_idle(args):
+    """
+    The LCD loop's CPU in each idle state (--seconds each), and the time from
+    a wake-up to the next frame on the LCD, from 'idle' and from 'off'.
+    """
+    import idle
+
+    doorbell, loop = start_lcd(args)
+    time.sleep(args.warmup)
+
+    def lcd_frames():
+        timer = metrics.METRICS.stages.get("lcd_latency")
+        return timer.count if timer else 0
+
+    def hold(state):
+        # Push the last activity back far enough that the loop falls asleep by itself
+        idle.IDLE.last_activity = time.monotonic() - (idle.IDLE.off_after if state == idle.STATE_OFF else idle.IDLE.idle_after)
+        deadline = time.monotonic() + args.warmup + 5.0
+        while idle.IDLE.state != state and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(1.0) # Let the decoder settle into keyframe-only reads
+        measurement = Measurement()
+        frames = lcd_frames()
+        time.sleep(args.seconds)
+        result = measurement.result()
+        result["lcd_frames"] = lcd_frames() - frames
+        return result
+
+    def wake():
+        frames = lcd_frames()
+        woken = time.monotonic()
+        idle.IDLE.activity("bench")
+        deadline = woken + 15.0
+        while lcd_frames() == frames and time.monotonic() < deadline:
+            time.sleep(0.002)
+        return round((time.monotonic() - woken) * 1000, 1) if lcd_frames() > frames else None
+
+    measurement = Measurement()
+    frames = lcd_frames()
+    time.sleep(args.seconds)
+    states = {idle.STATE_ACTIVE: dict(measurement.result(), lcd_frames=lcd_frames() - frames)}
+    idle.IDLE.idle_after, idle.IDLE.off_after = 3600.0, 0.0
+    states[idle.STATE_IDLE] = hold(idle.STATE_IDLE)
+    wake_from_idle = wake()
+    time.sleep(args.warmup)
+    idle.IDLE.off_after = 7200.0
+    states[idle.STATE_OFF] = hold(idle.STATE_OFF)
+    wake_from_off = wake()
+    stats = idle.IDLE.stats()
+    doorbell.stop_doorbell()
+    loop.join(5.0)
+
+    return {
+        "scenario": "idle",
+        "states": {state: {"cpu_percent": result["cpu_percent"], "lcd_frames": result["lcd_frames"]}
+                   for state, result in states.items()},
+        "wake_to_frame_ms": {idle.STATE_IDLE: wake_from_idle, idle.STATE_OFF: wake_from_off},
+        "idle": stats,
+    }
+
+
+def bench_adapt(args):
+    """
+    One viewer on a --link kB/s link next to one on loopback, first with
+    every viewer kept at its requested profile, then adapting. Reports each
+    viewer's fps, bandwidth and frame delay, and how many variants were
+    encoded per source frame.
+    """
+    import rtsp_stream_flask as web
+
+    server, httpd, port = start_web(args)
+    modes = {}
+    for adaptive in (False, True):
+        web.WEB_ADAPTIVE = adaptive
+        clients = [MJPEGClient(port), MJPEGClient(port, rate=args.link * 1024)]
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup) # Long enough for the slow viewer to settle (a step a second at most)
+        metrics.METRICS.reset()
+        with server.BROADCASTER.lock:
+            pipeline = server.BROADCASTER.pipelines.get(server.LIVE_CHANNEL)
+        frames = pipeline.frames
+        for client in clients:
+            client.recording = True
+        measurement = Measurement()
+        time.sleep(args.seconds)
+        for client in clients:
+            client.recording = False
+        result = measurement.result()
+        for client in clients:
+            client.stop()
+        seconds = result["seconds"]
+        encodes = metrics.METRICS.stages["encode"].count if "encode" in metrics.METRICS.stages else 0
+        modes["adaptive" if adaptive else "fixed"] = {
+            "cpu_percent": result["cpu_percent"],
+            "clients": [dict(report, latency_ms=percentiles(client.latencies))
+                        for report, client in zip(client_report(clients, seconds), clients)],
+            "encodes_per_frame": round(encodes / max(1, pipeline.frames - frames), 2),
+            "adapted": {name: metrics.METRICS.counters.get(name, 0) for name in ("web_adapt_down", "web_adapt_up")},
+        }
+        time.sleep(1.0) # Let the clients close and the servers notice
+    httpd.shutdown()
+    return {"scenario": "adapt", "server": args.server, "link_kbytes_per_second": args.link, "modes": modes}
+
+
+SCENARIOS = {"lcd": bench_lcd, "web": bench_web, "combined": bench_combined, "startup": bench_startup,
+             "viewers": bench_viewers, "connect": bench_connect, "idle": bench_idle, "adapt": bench_adapt}
+
+
+def strip_option(argv, option):
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        elif not arg.startswith(option + "="):
+            stripped.append(arg)
+    return stripped
+
+
+def run_all(args, argv):
+    """
+    Runs every scenario in a fresh interpreter and merges the JSON results.
+    """
+    results = {}
+    passthrough = [a for a in argv if a != "all"]
+    for name in SCENARIOS:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), name] + passthrough,
+                                stdout=subprocess.PIPE, check=True).stdout
+        results[name] = json.loads(output)
+    return results
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description="Benchmark the doorbell LCD loop and the MJPEG server off-device.")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS) + ["all"])
+    parser.add_argument("--source", default="synthetic", help="'synthetic' (animated test image) or a local video file")
+    parser.add_argument("--backend", default="pyav", help="Decoder backend for file sources")
+    parser.add_argument("--fps", type=float, default=25, help="Source frame rate (0 = as fast as it decodes)")
+    parser.add_argument("--size", default="1280x720", help="Synthetic source resolution")
+    parser.add_argument("--feeds", type=int, default=BENCH_FEEDS)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--switch-every", type=float, default=0, help="Press NEXT every N seconds (0 = never)")
+    parser.add_argument("--standby", type=int, default=0, help="Warm standby budget for the LCD loop")
+    parser.add_argument("--bus-hz", type=int, default=None, help="Simulate SPI wire time at this bus speed")
+    parser.add_argument("--clients", type=int, default=1, help="MJPEG clients for the web scenario")
+    parser.add_argument("--motion", action="store_true", help="Enable motion detection on the bench feeds")
+    parser.add_argument("--mosaic", action="store_true", help="Run the LCD loop in mosaic mode")
+    parser.add_argument("--server", choices=("flask", "async"), default="flask",
+                        help="Web server for the web and viewers scenarios")
+    parser.add_argument("--capture", help='"capture" settings for the bench feeds, as JSON')
+    parser.add_argument("--connects", type=int, default=3, help="Connects per feed for the connect scenario")
+    parser.add_argument("--link", type=float, default=100, help="Slow viewer's link in kB/s for the adapt scenario")
+    parser.add_argument("--web-fps", type=float, default=None, help="Web sink frame cap (default: WEB_MAX_FPS)")
+    parser.add_argument("--startup-target", type=float, default=None,
+                        help="Time-to-first-frame target for the startup scenario (default: STARTUP_TARGET)")
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # Keep every sample of the measured window for the percentiles
+    metrics.WINDOW = 1 << 20
+
+    if args.scenario == "all":
+        result = run_all(args, strip_option(argv, "--output"))
+    else:
+        feeds_path = write_feeds(args)
+        try:
+            # The pipelines print progress; keep stdout clean for the JSON
+            with contextlib.redirect_stdout(sys.stderr):
+                result = SCENARIOS[args.scenario](args)
+        finally:
+            if feeds_path:
+                os.unlink(feeds_path)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
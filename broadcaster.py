@@ -0,0 +1,312 @@
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+from core import HUB, FrameRate
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+SUBSCRIBER_QUEUE_SIZE = 2     # Frames buffered per viewer before the oldest is dropped
+PIPELINE_GRACE_PERIOD = 5.0   # Seconds a pipeline outlives its last viewer (page reloads)
+OPEN_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+SWITCH_HISTORY = 32
+
+# data: encoded bytes, timestamp: monotonic time the source frame was decoded
+EncodedFrame = namedtuple("EncodedFrame", "data timestamp seq")
+
+
+# --- SUBSCRIBER ---
+
+class Subscriber:
+    """
+    One viewer's bounded queue. A slow client loses its oldest frames
+    instead of slowing down the pipeline or the other viewers.
+
+    `variant` is handed to the pipeline's process() (None: its default
+    output); frames come at `fps` a second at most (0 = all). Both can be
+    changed while subscribed with set_profile().
+    """
+
+    def __init__(self, variant=None, fps=0, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize)
+        self.variant = variant
+        self.rate = FrameRate(fps)
+        self.dropped = 0
+        self.closed = False
+        self.pipeline = None
+
+    def set_profile(self, variant, fps):
+        self.variant = variant
+        self.rate = FrameRate(fps)
+
+    def due(self, timestamp):
+        """
+        Called by the pipeline before encoding; False skips this frame for this viewer.
+        """
+        return self.rate.due(timestamp)
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """
+        Returns the next item, or None on timeout or once the pipeline closed.
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self.put(None)
+
+
+# --- PIPELINE ---
+
+class StreamPipeline:
+    """
+    Capture -> process -> encode for one channel, shared by all its viewers.
+    `process(frame, name, variant)` returns the encoded bytes or None to skip
+    a frame; it runs once per frame for each variant the viewers due for
+    that frame ask for.
+
+    The source can be switched in place with switch(): the new feed is opened
+    in the background and replaces the old one as soon as its first frame is
+    decoded, so viewers keep their connection.
+    """
+
+    def __init__(self, broadcaster, channel, url, name, capture=None):
+        self.broadcaster = broadcaster
+        self.channel = channel
+        self.url = url
+        self.name = name
+        self.capture = capture # The feed's "capture" settings from feeds.json
+        self.subscribers = []
+        self.frames = 0
+        self.idle_since = None
+        self.switch_latencies = deque(maxlen=SWITCH_HISTORY)
+        self._candidate = None # (reader, requested_at, capture) while a switch is pending
+        self._switch_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{channel}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def switch(self, url, name, restart=False, capture=None):
+        """
+        Starts opening `url`; returns immediately. A newer switch replaces a
+        pending one; switching back to the current source just cancels it
+        (and takes the new name), unless `restart` asks for a fresh reader.
+        """
+        if url == self.url and not restart:
+            self.name = name
+        reader = self._new_reader(url, name, capture) if url != self.url or restart else None
+        with self._switch_lock:
+            previous = self._candidate
+            self._candidate = (reader, time.monotonic(), capture) if reader else None
+        if previous is not None:
+            previous[0].stop(timeout=0)
+        if reader:
+            print(f"Pipeline: switching {self.channel} to {name}")
+
+    @property
+    def last_switch_latency(self):
+        return self.switch_latencies[-1] if self.switch_latencies else None
+
+    def _new_reader(self, url, name, capture):
+        return self.broadcaster.open_reader(url, name, capture)
+
+    def _publish(self, frame, timestamp):
+        with self.broadcaster.lock:
+            subscribers = [subscriber for subscriber in self.subscribers if subscriber.due(timestamp)]
+        if not subscribers:
+            return
+        self.frames += 1
+        encoded = {} # variant -> EncodedFrame, or None if process() skipped it
+        for subscriber in subscribers:
+            variant = subscriber.variant
+            if variant not in encoded:
+                data = self.broadcaster.process(frame, self.name, variant)
+                encoded[variant] = EncodedFrame(data, timestamp, self.frames) if data is not None else None
+            if encoded[variant] is not None:
+                subscriber.put(encoded[variant])
+
+    def _take_candidate(self, active):
+        """
+        Returns the reader to use from now on: the pending one once it has a
+        frame, otherwise the current one.
+        """
+        with self._switch_lock:
+            if self._candidate is None:
+                return active
+            reader, requested_at, capture = self._candidate
+            if reader.buffer.seq == 0 and not reader.done:
+                return active
+            self._candidate = None
+
+        if reader.buffer.seq == 0:
+            print(f"Pipeline: could not open {reader.name}, staying on {self.name}")
+            reader.stop(timeout=0)
+            return active
+
+        latency = time.monotonic() - requested_at
+        self.switch_latencies.append(latency)
+        METRICS.observe_value("switch", latency)
+        print(f"Pipeline: switched {self.channel} to {reader.name} in {latency * 1000:.0f} ms")
+        active.stop(timeout=0)
+        self.url, self.name, self.capture = reader.url, reader.name, capture
+        return reader
+
+    def _run(self):
+        reader = self._new_reader(self.url, self.name, self.capture)
+        rate = FrameRate(self.broadcaster.max_fps)
+        failures = 0
+        last_seq = 0
+        try:
+            while not self.broadcaster.retire_if_idle(self):
+                candidate = self._take_candidate(reader)
+                if candidate is not reader:
+                    reader, last_seq, failures = candidate, 0, 0
+
+                # Poll briefly while a switch is pending so the swap happens right away
+                pending = self._candidate is not None
+                seq, frame, timestamp = reader.buffer.get(last_seq, timeout=0.02 if pending else 0.5)
+
+                if frame is None:
+                    if reader.done:
+                        failures = 0 if reader.buffer.seq else failures + 1
+                        if failures >= OPEN_ATTEMPTS:
+                            print(f"Pipeline: could not open video source after {OPEN_ATTEMPTS} attempts: {self.url}")
+                            return
+                        print(f"Pipeline: failed to read frame from {self.name}. Reconnecting...")
+                        METRICS.incr("reconnects")
+                        time.sleep(RETRY_DELAY)
+                        reader, last_seq = self._new_reader(self.url, self.name, self.capture), 0
+                    continue
+                last_seq = seq
+                if not rate.due(timestamp):
+                    continue # The decoder runs faster than this sink wants (e.g. shared with the LCD)
+
+                self._publish(frame, timestamp)
+        finally:
+            reader.stop(timeout=0)
+            with self._switch_lock:
+                if self._candidate is not None:
+                    self._candidate[0].stop(timeout=0)
+                    self._candidate = None
+            self.broadcaster.retire(self)
+            print(f"Pipeline: stream resources released for {self.channel}")
+
+
+# --- BROADCASTER ---
+
+class Broadcaster:
+    """
+    Runs at most one pipeline per channel. The pipeline starts with the
+    first subscriber and stops once the last one has been gone for
+    PIPELINE_GRACE_PERIOD seconds.
+
+    `sources` maps URL prefixes to factories `(url, name) -> started reader`
+    for channels that are not a plain feed (e.g. the mosaic). Feed readers
+    come from the shared hub, so a feed the LCD is showing is not decoded
+    twice, and are handed to `health` (a HealthMonitor), if given. Each
+    pipeline processes at most `max_fps` frames a second (0 = all).
+    """
+
+    def __init__(self, process, backend=None, decoder_options=None, grace_period=PIPELINE_GRACE_PERIOD,
+                 sources=None, health=None, max_fps=0):
+        self.process = process
+        self.backend = backend
+        self.decoder_options = decoder_options or {}
+        self.grace_period = grace_period
+        self.sources = dict(sources or {})
+        self.health = health
+        self.max_fps = max_fps
+        self.lock = threading.Lock()
+        self.pipelines = {}
+
+    def open_reader(self, url, name, capture=None):
+        for prefix, factory in self.sources.items():
+            if url.startswith(prefix):
+                return factory(url, name)
+        reader = HUB.acquire(url, name, self.backend, self.decoder_options, capture=capture)
+        if self.health is not None:
+            self.health.track(reader)
+        return reader
+
+    def subscribe(self, channel, url, name, subscriber=None, capture=None):
+        """
+        Joins `channel`, starting its pipeline on `url` (with the feed's
+        `capture` settings) if it is not running. `subscriber` can be anything
+        with put(item), close(), due(timestamp) and a `variant`, e.g. a bridge
+        to an event loop; by default it is a bounded Subscriber queue.
+        """
+        subscriber = subscriber or Subscriber()
+        with self.lock:
+            pipeline = self.pipelines.get(channel)
+            new = pipeline is None
+            if new:
+                pipeline = StreamPipeline(self, channel, url, name, capture)
+                self.pipelines[channel] = pipeline
+            pipeline.subscribers.append(subscriber)
+            pipeline.idle_since = None
+            subscriber.pipeline = pipeline
+        if new:
+            pipeline.start()
+        return subscriber
+
+    def switch(self, channel, url, name, restart=False, capture=None):
+        """
+        Points a running channel at a new source. Returns the pipeline, or
+        None if nobody is watching (the next subscribe opens `url` directly).
+        """
+        with self.lock:
+            pipeline = self.pipelines.get(channel)
+        if pipeline is not None:
+            pipeline.switch(url, name, restart, capture)
+        return pipeline
+
+    def unsubscribe(self, subscriber):
+        pipeline = subscriber.pipeline
+        with self.lock:
+            if subscriber in pipeline.subscribers:
+                pipeline.subscribers.remove(subscriber)
+            if not pipeline.subscribers:
+                pipeline.idle_since = time.monotonic()
+
+    def retire_if_idle(self, pipeline):
+        """
+        Called by the pipeline thread every frame; True means it should stop.
+        """
+        with self.lock:
+            if pipeline.subscribers or pipeline.idle_since is None:
+                return False
+            if time.monotonic() - pipeline.idle_since < self.grace_period:
+                return False
+            self._remove(pipeline)
+            return True
+
+    def retire(self, pipeline):
+        with self.lock:
+            self._remove(pipeline)
+            subscribers = list(pipeline.subscribers)
+            pipeline.subscribers.clear()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def _remove(self, pipeline):
+        if self.pipelines.get(pipeline.channel) is pipeline:
+            del self.pipelines[pipeline.channel]
@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+# --- ACTIONS ---
+ACTION_NEXT = 'next'
+ACTION_PREV = 'prev'
+ACTION_SNAPSHOT = 'snapshot'
+ACTION_MOSAIC = 'mosaic'
+
+BUTTON_DEBOUNCE_TIME = 0.3 # Seconds between accepted presses (any button)
+
+# timestamp is time.monotonic() at the edge, so consumers can measure press-to-action latency
+ButtonEvent = namedtuple("ButtonEvent", "action timestamp")
+
+
+# --- INPUT INTERFACE ---
+
+class ButtonInput:
+    """
+    Base class for button inputs. Subclasses call _emit() from whatever thread
+    detects a press; consumers take events from a thread-safe queue with get().
+    Listeners are called after each queued event, e.g. to wake a render loop.
+    """
+
+    def __init__(self, debounce=BUTTON_DEBOUNCE_TIME):
+        self.debounce = debounce
+        self._events = queue.Queue()
+        self._listeners = []
+        self._last_accepted = 0.0
+        self._lock = threading.Lock()
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def get(self, timeout=0):
+        """
+        Returns the next ButtonEvent, waiting up to `timeout` seconds (0 = don't wait).
+        """
+        try:
+            if timeout:
+                return self._events.get(timeout=timeout)
+            return self._events.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _emit(self, action):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_accepted < self.debounce:
+                return
+            self._last_accepted = now
+        self._events.put(ButtonEvent(action, now))
+        for callback in self._listeners:
+            callback()
+
+
+class GPIOButtonInput(ButtonInput):
+    """
+    Buttons wired to GPIO pins (active low), detected with edge callbacks
+    instead of polling. `pins` maps BCM pin numbers to actions.
+    """
+
+    def __init__(self, pins, debounce=BUTTON_DEBOUNCE_TIME):
+        super().__init__(debounce)
+        self.pins = dict(pins)
+
+    def start(self):
+        import RPi.GPIO as GPIO
+
+        bouncetime = max(1, int(self.debounce * 1000))
+        for pin, action in self.pins.items():
+            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(pin, GPIO.FALLING,
+                                  callback=lambda channel, action=action: self._emit(action),
+                                  bouncetime=bouncetime)
+        return self
+
+    def stop(self):
+        import RPi.GPIO as GPIO
+
+        for pin in self.pins:
+            try:
+                GPIO.remove_event_detect(pin)
+            except Exception:
+                pass
+
+
+class SimulatedButtonInput(ButtonInput):
+    """
+    Button input driven from code, for running the doorbell without a Pi.
+    """
+
+    def press(self, action):
+        self._emit(action)
@@ -0,0 +1,223 @@
+import time
+import threading
+from collections import deque
+
+from decoder import create_decoder
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+LATENCY_WINDOW = 64 # Recent per-frame decoder latencies kept per reader
+
+# --- LATEST-FRAME BUFFER ---
+
+class LatestFrame:
+    """
+    Single-slot frame buffer. The producer overwrites the slot on every
+    frame, the consumer always gets the newest one. Frames that are replaced
+    before anybody took them are counted in `dropped`.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._timestamp = 0.0
+        self._taken_seq = 0
+        self._interrupted = False
+        self.seq = 0
+        self.dropped = 0
+        self.closed = False
+
+    def publish(self, frame, timestamp=None):
+        with self._cond:
+            # Only count once somebody reads this slot (a shared reader's own slot may never be read)
+            if self._frame is not None and self._taken_seq and self._taken_seq != self.seq:
+                self.dropped += 1
+                METRICS.incr("frames_dropped")
+            self._frame = frame
+            self._timestamp = time.monotonic() if timestamp is None else timestamp
+            self.seq += 1
+            self._cond.notify_all()
+
+    def peek(self):
+        """
+        Returns (frame, timestamp) of the newest frame without taking it; frame is None before the first.
+        """
+        with self._cond:
+            return self._frame, self._timestamp
+
+    @property
+    def timestamp(self):
+        """
+        Monotonic time of the newest frame, 0.0 before the first one.
+        """
+        return self._timestamp
+
+    def close(self):
+        """
+        Marks the buffer as finished (stream ended or failed) and wakes waiters.
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def interrupt(self):
+        """
+        Wakes a consumer blocked in get() without publishing a frame (e.g. on a
+        button press). Sticky: if nobody is waiting, the next get() returns at once.
+        """
+        with self._cond:
+            self._interrupted = True
+            self._cond.notify_all()
+
+    def get(self, last_seq=0, timeout=None):
+        """
+        Waits until a frame newer than `last_seq` is available.
+        Returns (seq, frame, timestamp); frame is None on timeout, close or interrupt.
+        """
+        with self._cond:
+            woken = lambda: self.seq > last_seq or self.closed or self._interrupted
+            ready = self._cond.wait_for(woken, timeout)
+            self._interrupted = False
+            if not ready:
+                return last_seq, None, 0.0
+            if self.seq <= last_seq:
+                return last_seq, None, 0.0
+            self._taken_seq = self.seq
+            return self.seq, self._frame, self._timestamp
+
+
+# --- CAPTURE THREAD ---
+
+class FeedReader:
+    """
+    Opens one feed in a dedicated thread and keeps draining it, so the
+    decoder never builds up a backlog. Consumers read from `buffer`.
+
+    A reader started with standby=True stays connected at minimal cost
+    (keyframes only) until promote() is called.
+
+    Extra consumers can get their own slot with add_buffer(); every frame
+    is published to all of them (see FeedHub in core.py).
+    """
+
+    def __init__(self, url, name=None, backend=None, standby=False, **decoder_options):
+        self.url = url
+        self.name = name or url
+        self.decoder = create_decoder(url, backend, standby=standby, **decoder_options)
+        self.standby = standby
+        self.buffer = LatestFrame()
+        self.opened = threading.Event()
+        self.failed = False
+        self.open_latency = None        # Seconds from start() until the stream was open
+        self.first_frame_latency = None # Seconds from start() until the first frame
+        self.latencies = deque(maxlen=LATENCY_WINDOW) # Decoder frame_latency samples
+        self._outputs = () # Extra LatestFrame slots, replaced as a whole so _run can read it without the lock
+        self._outputs_lock = threading.Lock()
+        self._finished = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"reader-{self.name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        """
+        Asks the reader to stop. A read blocked on a stalled stream cannot be
+        interrupted, so we only wait `timeout` seconds; the thread is a daemon
+        and releases the capture as soon as the read returns.
+        """
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def promote(self):
+        """
+        Switches a standby reader to full-rate decoding.
+        """
+        self.standby = False
+        self.decoder.set_standby(False)
+
+    def demote(self):
+        self.standby = True
+        self.decoder.set_standby(True)
+
+    def add_buffer(self, buffer):
+        """
+        Publishes to `buffer` as well, starting with the newest frame if there
+        is one. A buffer added after the stream ended is closed at once.
+        """
+        frame, timestamp = self.buffer.peek()
+        if frame is not None:
+            buffer.publish(frame, timestamp)
+        with self._outputs_lock:
+            if not self._finished:
+                self._outputs += (buffer,)
+                return
+        buffer.close()
+
+    def remove_buffer(self, buffer):
+        with self._outputs_lock:
+            self._outputs = tuple(output for output in self._outputs if output is not buffer)
+
+    @property
+    def done(self):
+        return self.buffer.closed
+
+    @property
+    def frame_latency(self):
+        """
+        Median of the recent decoder latencies, None if the backend can't tell.
+        """
+        samples = sorted(self.latencies)
+        return samples[len(samples) // 2] if samples else None
+
+    def wait_opened(self, timeout):
+        """
+        Returns True once the stream is open, False if it failed or timed out.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.opened.is_set() and not self.failed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.opened.wait(min(remaining, 0.05))
+        return self.opened.is_set()
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            if not self.decoder.open():
+                print(f"Reader: could not open {self.name}")
+                self.failed = True
+                return
+
+            self.open_latency = time.monotonic() - started
+            self.opened.set()
+            while not self._stop.is_set():
+                start = METRICS.now()
+                ret, frame = self.decoder.read()
+                METRICS.observe("read", start)
+                if not ret:
+                    print(f"Reader: stream ended or dropped ({self.name})")
+                    self.failed = True
+                    break
+                METRICS.incr("frames_decoded")
+                latency = getattr(self.decoder, "frame_latency", None)
+                if latency is not None:
+                    self.latencies.append(latency)
+                if self.first_frame_latency is None:
+                    self.first_frame_latency = time.monotonic() - started
+                    print(f"Reader: {self.name} opened in {self.open_latency * 1000:.0f} ms, "
+                          f"first frame after {self.first_frame_latency * 1000:.0f} ms")
+                self.buffer.publish(frame)
+                for output in self._outputs:
+                    output.publish(frame)
+        finally:
+            self.decoder.release()
+            with self._outputs_lock:
+                self._finished = True
+                outputs = self._outputs
+            self.buffer.close()
+            for output in outputs:
+                output.close()
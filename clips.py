@@ -0,0 +1,359 @@
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# --- CONFIGURATION ---
+CLIP_PREROLL = 5.0     # Seconds kept from before the trigger
+CLIP_POSTROLL = 5.0    # Seconds recorded after it
+# Hard ceiling for the pre-event buffer (compressed packets or JPEGs). The
+# clip itself is streamed to a file in CLIP_DIR, so this is the whole
+# in-memory cost; 8 MB holds ~5 s of a 10 Mbit/s main stream.
+CLIP_MEMORY_LIMIT = 8 * 1024 * 1024
+CLIP_DIR = tempfile.gettempdir()
+
+# Fallback when the decoder exposes no packets (OpenCV backend): small JPEGs of the displayed frames
+CLIP_JPEG_FPS = 5
+CLIP_JPEG_WIDTH = 480
+CLIP_JPEG_QUALITY = 50
+CLIP_WRITE_QUEUE = 2 * CLIP_JPEG_FPS  # Post-roll frames waiting for the fallback writer
+CLIP_WRITE_POLL = 0.2                 # Seconds the writer waits for a frame before checking for the end
+
+MOVFLAGS = "faststart"  # moov up front so the clip plays while downloading
+
+
+# --- RING BUFFERS ---
+
+class PacketRing:
+    """
+    Compressed packets of the last `preroll` seconds, kept as whole GOPs so
+    the buffer always starts on a keyframe. Never exceeds `limit` bytes; a
+    single GOP larger than that is discarded until the next keyframe.
+    """
+
+    def __init__(self, preroll, limit):
+        self.preroll = preroll
+        self.limit = limit
+        self.bytes = 0
+        self._gops = deque() # [arrival time of the keyframe, bytes, packets]
+
+    def add(self, packet, now):
+        if packet.is_keyframe:
+            self._gops.append([now, 0, []])
+        elif not self._gops:
+            return # Waiting for the first keyframe
+        gop = self._gops[-1]
+        gop[1] += packet.size
+        gop[2].append(packet)
+        self.bytes += packet.size
+
+        # Drop the oldest GOP once the next one alone covers the pre-roll, or when over the limit
+        while len(self._gops) > 1 and (self._gops[1][0] <= now - self.preroll or self.bytes > self.limit):
+            self.bytes -= self._gops.popleft()[1]
+        if self.bytes > self.limit:
+            self.clear()
+
+    def packets(self):
+        return [packet for gop in self._gops for packet in gop[2]]
+
+    def clear(self):
+        self._gops.clear()
+        self.bytes = 0
+
+
+class FrameRing:
+    """
+    JPEG-compressed frames of the last `preroll` seconds, at most `limit` bytes.
+    """
+
+    def __init__(self, preroll, limit):
+        self.preroll = preroll
+        self.limit = limit
+        self.bytes = 0
+        self._frames = deque() # (arrival time, jpeg bytes)
+
+    def add(self, jpeg, now):
+        self._frames.append((now, jpeg))
+        self.bytes += len(jpeg)
+        while self._frames and (self._frames[0][0] < now - self.preroll or self.bytes > self.limit):
+            self.bytes -= len(self._frames.popleft()[1])
+
+    def frames(self):
+        return [jpeg for _, jpeg in self._frames]
+
+    def clear(self):
+        self._frames.clear()
+        self.bytes = 0
+
+
+# --- RECORDER ---
+
+class ClipRecorder:
+    """
+    Keeps a pre-event buffer of the current feed and, on trigger(), writes
+    it plus `postroll` seconds as an MP4 clip in `clip_dir`, then hands the
+    file to `deliver(path, caption)`, which deletes it once it is sent.
+
+    With a PyAV reader the camera's own packets are buffered and remuxed
+    (no decode or encode). Otherwise the render loop feeds displayed frames
+    through offer_frame() and they are kept as small JPEGs.
+    """
+
+    def __init__(self, deliver, preroll=CLIP_PREROLL, postroll=CLIP_POSTROLL,
+                 memory_limit=CLIP_MEMORY_LIMIT, clip_dir=CLIP_DIR):
+        self.deliver = deliver
+        self.preroll = preroll
+        self.postroll = postroll
+        self.memory_limit = memory_limit
+        self.clip_dir = clip_dir
+        self.mode = None
+        self.clips = 0
+        self._packets = PacketRing(preroll, memory_limit)
+        self._frames = FrameRing(preroll, memory_limit)
+        self._decoder = None
+        self._next_frame_at = 0.0
+        self._request = None   # Caption of a trigger waiting for the next packet
+        self._output = None    # (container, stream, path, caption, ends_at) while remuxing
+        self._writer = None    # (queue, ends_at, stop, done) while the JPEG fallback writes
+        self._lock = threading.Lock()
+
+    @property
+    def recording(self):
+        return self._request is not None or self._output is not None or self._writer is not None
+
+    def attach(self, reader):
+        """
+        Starts buffering `reader`, the feed currently on screen.
+        """
+        self.detach()
+        decoder = reader.decoder
+        with self._lock:
+            self._packets.clear()
+            self._frames.clear()
+            if av is not None and hasattr(decoder, "packet_tap"):
+                self.mode = "packets"
+                self._decoder = decoder
+                decoder.packet_tap = self._on_packet
+            else:
+                self.mode = "jpeg"
+
+    def detach(self):
+        """
+        Stops buffering; a clip in progress is finished with what it has.
+        Doesn't wait for that clip to be written.
+        """
+        with self._lock:
+            if self._decoder is not None:
+                self._decoder.packet_tap = None
+                self._decoder = None
+            self._request = None
+            self._finish_output()
+            self._finish_writer()
+            self._packets.clear()
+            self._frames.clear()
+            self.mode = None
+
+    def trigger(self, caption):
+        """
+        Records a clip around now. Returns False if one is already being recorded.
+        """
+        with self._lock:
+            if self.mode is None or self.recording:
+                return False
+            if self.mode == "packets":
+                self._request = caption # Started by the reader thread, which owns the input stream
+            else:
+                self._start_writer(caption)
+            METRICS.incr("clips_triggered")
+            return True
+
+    # --- compressed path (reader thread) ---
+
+    def _on_packet(self, packet, stream):
+        if packet.dts is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            try:
+                self._packets.add(packet, now)
+                if self._request is not None:
+                    caption, self._request = self._request, None
+                    self._start_output(stream, caption, now)
+                elif self._output is not None:
+                    self._mux(packet)
+                    if now >= self._output[4]:
+                        self._finish_output()
+            except Exception as e:
+                print(f"Clip: recording failed: {e}")
+                if self._output is not None:
+                    _remove(self._output[2])
+                    self._output = None
+            METRICS.set("clip_buffer_bytes", self._packets.bytes)
+
+    def _start_output(self, stream, caption, now):
+        path = self._clip_path()
+        container = av.open(path, "w", format="mp4", options={"movflags": MOVFLAGS})
+        if hasattr(container, "add_stream_from_template"):
+            out_stream = container.add_stream_from_template(stream)
+        else:
+            out_stream = container.add_stream(template=stream)
+        self._output = (container, out_stream, path, caption, now + self.postroll)
+        for packet in self._packets.packets(): # Includes the current packet
+            self._mux(packet)
+
+    def _mux(self, packet):
+        # Muxing takes ownership of a packet's data, so mux a copy and keep the original in the ring
+        container, out_stream = self._output[:2]
+        copy = av.Packet(bytes(packet))
+        copy.pts, copy.dts, copy.time_base = packet.pts, packet.dts, packet.time_base
+        copy.is_keyframe = packet.is_keyframe
+        copy.stream = out_stream
+        container.mux(copy)
+
+    def _finish_output(self):
+        """
+        Closes the clip on its own thread: writing the index and moving it up
+        front (faststart) rereads the whole file, which the reader can't wait for.
+        """
+        if self._output is None:
+            return
+        container, _, path, caption, _ = self._output
+        self._output = None
+        threading.Thread(target=self._close_output, args=(container, path, caption),
+                         name="clip-finish", daemon=True).start()
+
+    def _close_output(self, container, path, caption):
+        try:
+            container.close()
+        except Exception as e:
+            print(f"Clip: could not finish {path}: {e}")
+            _remove(path)
+            return
+        self._hand_over(path, caption)
+
+    # --- JPEG fallback (render thread) ---
+
+    def offer_frame(self, frame):
+        """
+        Called by the render loop with each displayed frame; used only when
+        the reader has no packets to offer. Samples CLIP_JPEG_FPS frames a second.
+        """
+        if self.mode != "jpeg":
+            return
+        now = time.monotonic()
+        if now < self._next_frame_at:
+            return
+        self._next_frame_at = now + 1.0 / CLIP_JPEG_FPS
+
+        height = int(frame.shape[0] * CLIP_JPEG_WIDTH / frame.shape[1]) & ~1
+        small = cv2.resize(frame, (CLIP_JPEG_WIDTH, height), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", small, [int(cv2.IMWRITE_JPEG_QUALITY), CLIP_JPEG_QUALITY])
+        if not ok:
+            return
+        jpeg = encoded.tobytes()
+
+        with self._lock:
+            self._frames.add(jpeg, now)
+            METRICS.set("clip_buffer_bytes", self._frames.bytes)
+            if self._writer is not None:
+                frames, ends_at, _, done = self._writer
+                try:
+                    frames.put_nowait(jpeg)
+                except queue.Full:
+                    pass # The writer is behind; the clip skips a frame
+                if now >= ends_at or done.is_set():
+                    self._finish_writer()
+
+    def _start_writer(self, caption):
+        frames = queue.Queue(CLIP_WRITE_QUEUE)
+        stop, done = threading.Event(), threading.Event()
+        self._writer = (frames, time.monotonic() + self.postroll, stop, done)
+        preroll = self._frames.frames()
+        threading.Thread(target=self._write_jpegs, args=(preroll, frames, stop, done, caption),
+                         name="clip-writer", daemon=True).start()
+
+    def _finish_writer(self):
+        """
+        Tells the writer to end the clip once its queue is empty. Never waits
+        for it, so a stuck or dead writer can't hold up the render loop.
+        """
+        if self._writer is None:
+            return
+        self._writer[2].set()
+        self._writer = None
+
+    def _write_jpegs(self, preroll, frames, stop, done, caption):
+        path = None
+        writer = None
+        written = 0
+        try:
+            path = self._clip_path()
+
+            def write(jpeg):
+                nonlocal writer, written
+                image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    return # Corrupt JPEG; the clip skips a frame
+                if writer is None:
+                    size = (image.shape[1], image.shape[0])
+                    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), CLIP_JPEG_FPS, size)
+                writer.write(image)
+                written += 1
+
+            for jpeg in preroll:
+                write(jpeg)
+            del preroll
+            while True:
+                try:
+                    jpeg = frames.get(timeout=CLIP_WRITE_POLL)
+                except queue.Empty:
+                    if stop.is_set():
+                        break
+                    continue
+                write(jpeg)
+        except Exception as e:
+            print(f"Clip: recording failed: {e}")
+            written = 0
+        finally:
+            done.set()
+            if writer is not None:
+                writer.release()
+        if not written:
+            if path is not None:
+                _remove(path) # Failed, or nothing was buffered yet
+            return
+        self._hand_over(path, caption)
+
+    # --- delivery ---
+
+    def _clip_path(self):
+        handle, path = tempfile.mkstemp(prefix="videopi-clip-", suffix=".mp4", dir=self.clip_dir)
+        os.close(handle)
+        return path
+
+    def _hand_over(self, path, caption):
+        """
+        Passes the finished file on; from here `deliver` owns it.
+        """
+        self.clips += 1
+        print(f"Clip: {os.path.getsize(path) // 1024} KiB queued for delivery")
+        METRICS.incr("clips_written")
+        self.deliver(path, caption)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
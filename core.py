@@ -0,0 +1,528 @@
+"""
+Shared core of the LCD doorbell (doorbell.py) and the web server
+(rtsp_stream_flask.py): configuration, feed loading, and one decoder per
+feed for every sink in the process. videopi.py runs both sinks together.
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None # feeds.json changes are found by polling its mtime
+
+from capture import FeedReader, LatestFrame
+from decoder import BACKENDS
+from health import HealthMonitor
+from metrics import METRICS
+from motion import motion_config
+
+# --- CONFIGURATION ---
+FEEDS_FILE = os.getenv("VIDEOPI_FEEDS", "feeds.json")
+
+# Decoder: "pyav" drops work before decode, "opencv" is the plain cv2.VideoCapture path
+DECODER_BACKEND = "pyav"
+DECODER_OPTIONS = {
+    "skip_nonref": True, # Let the codec skip non-reference frames
+    "every_nth": 1,      # Convert only every Nth decoded frame
+}
+
+FEEDS_POLL_INTERVAL = 2.0 # Seconds between mtime checks when inotify is not available
+FEEDS_SETTLE = 0.2        # Seconds to let an editor finish writing before feeds.json is parsed
+# Feed keys that reach the stream; changing any other key (name, motion) keeps the connection
+FEED_STREAM_KEYS = ("url", "capture")
+
+# Per-feed "capture" settings in feeds.json, all optional:
+#   transport        RTSP transport: "tcp", "udp", "udp_multicast" or "http"
+#   probesize        Bytes FFmpeg reads to identify the stream (FFmpeg default 5000000)
+#   analyzeduration  Seconds FFmpeg analyses the stream before it opens (FFmpeg default 5)
+#   timeout          Seconds to connect, and without data before a read fails
+#   low_delay        true: the decoder outputs frames without reordering delay
+#   nobuffer         true: no demuxer buffering; the packets read while probing are lost,
+#                    so the first frame may wait for the next keyframe (see bench.py connect)
+#   decoder          "pyav" or "opencv" for this feed instead of DECODER_BACKEND
+#   options          Any other FFmpeg options, e.g. {"max_delay": "0"}
+CAPTURE_KEYS = ("transport", "probesize", "analyzeduration", "timeout", "low_delay", "nobuffer", "decoder", "options")
+RTSP_TRANSPORTS = ("tcp", "udp", "udp_multicast", "http")
+
+
+# --- FEEDS ---
+
+class FeedsError(ValueError):
+    pass
+
+def parse_feeds(path=None):
+    """
+    Reads and validates the feed list from `path` (default FEEDS_FILE).
+    Raises FeedsError with a readable reason.
+    """
+    path = path or FEEDS_FILE
+    try:
+        with open(path, 'r') as f:
+            feeds = json.load(f)
+    except FileNotFoundError:
+        raise FeedsError(f"the configuration file '{path}' was not found")
+    except json.JSONDecodeError as e:
+        raise FeedsError(f"error decoding JSON from '{path}': {e}")
+    if not isinstance(feeds, list) or not all(isinstance(feed, dict) and isinstance(feed.get('url'), str)
+                                              and isinstance(feed.get('name'), str) for feed in feeds):
+        raise FeedsError(f"'{path}' must be a list of objects with \"name\" and \"url\"")
+    if not feeds:
+        raise FeedsError(f"'{path}' has no feeds")
+    for feed in feeds:
+        if not isinstance(feed.get('snapshot_url', ""), str):
+            raise FeedsError(f"'{path}': \"snapshot_url\" of {feed['name']} must be a string")
+        try:
+            capture_settings(feed.get('capture'))
+        except (TypeError, ValueError) as e:
+            raise FeedsError(f"'{path}': bad \"capture\" for {feed['name']}: {e}")
+        try:
+            motion_config(feed)
+        except ValueError as e:
+            raise FeedsError(f"'{path}': bad \"motion\" for {feed['name']}: {e}")
+    return feeds
+
+def load_feeds(path=None):
+    """
+    Returns the feed list from `path` (default FEEDS_FILE), or [] with the
+    reason printed if the file is missing or invalid.
+    """
+    try:
+        return parse_feeds(path)
+    except FeedsError as e:
+        print(f"Feeds: {e}.")
+        return []
+
+def stream_config(feed):
+    """
+    The part of a feed that its connection depends on.
+    """
+    return tuple(feed.get(key) for key in FEED_STREAM_KEYS)
+
+def capture_settings(capture, backend=None, decoder_options=None):
+    """
+    (backend, decoder options) for a feed: `backend` and `decoder_options`
+    (default DECODER_BACKEND / DECODER_OPTIONS) with the feed's "capture"
+    settings applied. Raises ValueError on a setting it doesn't know.
+    """
+    backend = backend or DECODER_BACKEND
+    options = dict(DECODER_OPTIONS if decoder_options is None else decoder_options)
+    if not capture:
+        return backend, options
+    if not isinstance(capture, dict):
+        raise ValueError("must be an object")
+    unknown = set(capture) - set(CAPTURE_KEYS)
+    if unknown:
+        raise ValueError(f"unknown settings {sorted(unknown)}")
+
+    ffmpeg = dict(options.get("options") or {})
+    if "transport" in capture:
+        if capture["transport"] not in RTSP_TRANSPORTS:
+            raise ValueError(f"transport must be one of {RTSP_TRANSPORTS}")
+        ffmpeg["rtsp_transport"] = capture["transport"]
+    if "probesize" in capture:
+        ffmpeg["probesize"] = str(max(32, int(capture["probesize"])))
+    if "analyzeduration" in capture:
+        ffmpeg["analyzeduration"] = str(int(float(capture["analyzeduration"]) * 1000000))
+    if capture.get("nobuffer"):
+        ffmpeg["fflags"] = "nobuffer"
+    if capture.get("low_delay"):
+        options["low_delay"] = True
+    ffmpeg.update((str(key), str(value)) for key, value in (capture.get("options") or {}).items())
+    if ffmpeg:
+        options["options"] = ffmpeg
+    if "timeout" in capture:
+        options["open_timeout"] = options["read_timeout"] = float(capture["timeout"])
+    if "decoder" in capture:
+        if capture["decoder"] not in BACKENDS:
+            raise ValueError(f"decoder must be one of {sorted(BACKENDS)}")
+        backend = capture["decoder"]
+    return backend, options
+
+def match_feeds(old, new):
+    """
+    Pairs up the feeds of two configurations: {old index: new index}. A feed
+    is followed through a rename (same url) and through a new url (same name).
+    """
+    matches = {}
+    for key in ('url', 'name'):
+        taken = set(matches.values())
+        for i, feed in enumerate(old):
+            if i in matches or not feed[key]:
+                continue
+            for j, candidate in enumerate(new):
+                if j not in taken and candidate[key] == feed[key]:
+                    matches[i] = j
+                    taken.add(j)
+                    break
+    return matches
+
+def remap_index(old, new, index):
+    """
+    Where the feed at `index` of `old` is in `new`; a removed feed's
+    position is kept (clamped) so the user lands on a neighbour.
+    """
+    if not new:
+        return 0
+    return match_feeds(old, new).get(index, min(index, len(new) - 1))
+
+# Names of the feeds per kind of change, for logging
+FeedsDiff = namedtuple("FeedsDiff", "added removed changed renamed")
+
+def diff_feeds(old, new):
+    matches = match_feeds(old, new)
+    matched = set(matches.values())
+    return FeedsDiff(
+        added=[feed['name'] for j, feed in enumerate(new) if j not in matched],
+        removed=[feed['name'] for i, feed in enumerate(old) if i not in matches],
+        changed=[new[j]['name'] for i, j in matches.items() if stream_config(old[i]) != stream_config(new[j])],
+        renamed=[new[j]['name'] for i, j in matches.items() if old[i]['name'] != new[j]['name']],
+    )
+
+
+class FeedsWatcher:
+    """
+    Re-reads feeds.json when it changes (inotify, or mtime polling without
+    inotify_simple) and calls every listener with the new feed list. An
+    invalid file is reported and ignored, so the last good list stays in
+    effect; each sink then restarts only what diff_feeds() says changed.
+    """
+
+    def __init__(self, path=None, feeds=(), interval=FEEDS_POLL_INTERVAL):
+        self.path = os.path.abspath(path or FEEDS_FILE)
+        self.feeds = list(feeds)
+        self.interval = interval
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="feeds-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def add_listener(self, listener):
+        """
+        `listener(feeds)` runs in the watcher thread after every accepted change.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def check(self):
+        """
+        Re-reads the file now. Returns True if a new feed list was applied.
+        """
+        with self._lock:
+            try:
+                feeds = parse_feeds(self.path)
+            except FeedsError as e:
+                METRICS.incr("feed_reload_errors")
+                print(f"Feeds: {e}; keeping the last good configuration.")
+                return False
+            if feeds == self.feeds:
+                return False
+            diff = diff_feeds(self.feeds, feeds)
+            self.feeds = feeds
+        METRICS.incr("feed_reloads")
+        print(f"Feeds: reloaded {len(feeds)} feeds "
+              f"(added {diff.added}, removed {diff.removed}, changed {diff.changed}, renamed {diff.renamed})")
+        for listener in list(self._listeners):
+            listener(feeds)
+        return True
+
+    def _run(self):
+        if INotify is not None:
+            try:
+                self._watch_inotify()
+                return
+            except OSError as e:
+                print(f"Feeds: inotify unavailable ({e}), polling {self.path}")
+        self._watch_mtime()
+
+    def _watch_inotify(self):
+        # Editors often write a new file and rename it over the old one, so the directory is watched
+        inotify = INotify()
+        try:
+            inotify.add_watch(os.path.dirname(self.path), inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+            name = os.path.basename(self.path)
+            while not self._stop.is_set():
+                events = inotify.read(timeout=1000, read_delay=int(FEEDS_SETTLE * 1000))
+                if any(event.name == name for event in events):
+                    self.check()
+        finally:
+            inotify.close()
+
+    def _watch_mtime(self):
+        last = self._stat()
+        while not self._stop.wait(self.interval):
+            current = self._stat()
+            if current != last:
+                last = current
+                self._stop.wait(FEEDS_SETTLE)
+                self.check()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+_health = None
+_watcher = None
+_shared_lock = threading.Lock()
+
+def shared_health(feeds):
+    """
+    The process-wide HealthMonitor, started on first use, so the sinks of
+    a combined runtime share one prober.
+    """
+    global _health
+    with _shared_lock:
+        if _health is None:
+            _health = HealthMonitor(feeds).start()
+        return _health
+
+def shared_watcher(feeds, path=None):
+    """
+    The process-wide FeedsWatcher on `path` (default FEEDS_FILE), started on
+    first use with the feeds the caller loaded. Keeps the shared health
+    monitor's feed list current.
+    """
+    global _watcher
+    with _shared_lock:
+        if _watcher is None:
+            _watcher = FeedsWatcher(path, feeds)
+            _watcher.add_listener(_update_health)
+            _watcher.start()
+        return _watcher
+
+def _update_health(feeds):
+    if _health is not None:
+        _health.set_feeds(feeds)
+
+
+# --- RATE LIMITING ---
+
+class FrameRate:
+    """
+    Thins a sink's frames down to at most `fps` a second (0 = all of them),
+    keeping an even cadence on average.
+    """
+
+    def __init__(self, fps=0):
+        self.interval = 1.0 / fps if fps else 0.0
+        self._next = 0.0
+
+    def due(self, timestamp):
+        if not self.interval:
+            return True
+        if timestamp < self._next:
+            return False
+        # Keep the cadence, but after a stall start over instead of catching up
+        self._next = max(self._next + self.interval, timestamp)
+        return True
+
+
+# --- SHARED DECODERS ---
+
+class FeedTap:
+    """
+    One consumer's view of a shared FeedReader, with its own frame slot.
+    Looks like a FeedReader to the code using it (`buffer`, `opened`,
+    `done`, `promote()`, ...); stop() hands it back to the hub.
+    """
+
+    def __init__(self, hub, shared, name, standby, capture=None):
+        self.hub = hub
+        self.reader = shared.reader
+        self.url = shared.reader.url
+        self.name = name or self.url
+        self.capture = capture
+        self.standby = standby
+        self.buffer = LatestFrame()
+        self._shared = shared
+
+    @property
+    def decoder(self):
+        return self.reader.decoder
+
+    @property
+    def opened(self):
+        return self.reader.opened
+
+    @property
+    def failed(self):
+        return self.reader.failed
+
+    @property
+    def open_latency(self):
+        return self.reader.open_latency
+
+    @property
+    def first_frame_latency(self):
+        return self.reader.first_frame_latency
+
+    @property
+    def frame_latency(self):
+        return self.reader.frame_latency
+
+    @property
+    def done(self):
+        return self.buffer.closed
+
+    def wait_opened(self, timeout):
+        return self.reader.wait_opened(timeout)
+
+    def promote(self):
+        self.standby = False
+        self.hub._apply_mode(self._shared)
+
+    def demote(self):
+        self.standby = True
+        self.hub._apply_mode(self._shared)
+
+    def stop(self, timeout=1.0):
+        self.hub.release(self)
+
+
+class _SharedReader:
+    def __init__(self, key, reader):
+        self.key = key
+        self.reader = reader
+        self.taps = []
+
+
+class FeedHub:
+    """
+    One FeedReader per (url, backend, decoder options), shared by every sink
+    that asks for it; a feed's "capture" settings are part of its options.
+    The reader runs at full rate while any tap wants it, in keyframe-only
+    standby when all taps are standby, and stops with its last tap. Each
+    sink reads its own slot at its own pace and resolution.
+    """
+
+    def __init__(self):
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url, name=None, backend=None, decoder_options=None, standby=False, capture=None):
+        """
+        Returns a started tap on `url`; backend and options default to the
+        core configuration, with the feed's `capture` settings applied.
+        """
+        backend, options = capture_settings(capture, backend, decoder_options)
+        key = (url, backend, tuple(sorted((k, repr(v)) for k, v in options.items())))
+        with self._lock:
+            shared = self._shared.get(key)
+            new = shared is None or shared.reader.done
+            if new:
+                shared = self._shared[key] = _SharedReader(key, FeedReader(url, name, backend, standby=standby, **options))
+            tap = FeedTap(self, shared, name, standby, capture)
+            shared.taps.append(tap)
+            self._update_mode(shared)
+            METRICS.set("shared_readers", len(self._shared))
+        if new:
+            shared.reader.start()
+        shared.reader.add_buffer(tap.buffer)
+        return tap
+
+    def release(self, tap):
+        shared = tap._shared
+        with self._lock:
+            if tap not in shared.taps:
+                return
+            shared.taps.remove(tap)
+            last = not shared.taps
+            if last and self._shared.get(shared.key) is shared:
+                del self._shared[shared.key]
+            if not last:
+                self._update_mode(shared)
+            METRICS.set("shared_readers", len(self._shared))
+        shared.reader.remove_buffer(tap.buffer)
+        tap.buffer.close()
+        if last:
+            shared.reader.stop(timeout=0)
+
+    def readers(self):
+        """
+        {url: number of taps}, for status pages.
+        """
+        with self._lock:
+            return {shared.reader.url: len(shared.taps) for shared in self._shared.values()}
+
+    def _apply_mode(self, shared):
+        with self._lock:
+            self._update_mode(shared)
+
+    def _update_mode(self, shared):
+        standby = all(tap.standby for tap in shared.taps)
+        if standby != shared.reader.standby:
+            if standby:
+                shared.reader.demote()
+            else:
+                shared.reader.promote()
+
+HUB = FeedHub()
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Check that feeds.json validation rejects bad motion blocks "
+                                                 "and that a bad edit keeps the last good list.")
+    parser.parse_args()
+
+    cases = [
+        (True, True),
+        (True, {"zones": [[0, 0.5, 1, 1], [0.25, 0, 0.75, 0.5]], "threshold": 30, "cooldown": 10}),
+        (True, {"zones": None, "mode": "diff", "warmup": 0}),
+        (False, {"zones": [[0, 0.5, 1]]}),            # Three corners
+        (False, {"zones": [[0, 0, 1.5, 1]]}),         # Beyond the frame
+        (False, {"zones": [[0.6, 0, 0.4, 1]]}),       # x0 > x1
+        (False, {"zones": [[0, 0.5, 1, 0.5]]}),       # Empty
+        (False, {"zones": [["0", 0, 1, 1]]}),
+        (False, {"zones": [0, 0, 1, 1]}),             # Not nested
+        (False, {"threshold": "25"}),
+        (False, {"threshold": 300}),
+        (False, {"threshold": True}),
+        (False, {"min_area": -0.1}),
+        (False, {"cooldown": None}),
+        (False, {"warmup": 2.5}),
+        (False, {"mode": "median"}),
+        (False, {"treshold": 25}),                    # Misspelt
+        (False, "yes"),
+    ]
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="videopi-feeds-") as directory:
+        path = os.path.join(directory, "feeds.json")
+        for valid, motion in cases:
+            with open(path, "w") as f:
+                json.dump([{"name": "Front", "url": "rtsp://camera/1", "motion": motion}], f)
+            try:
+                parse_feeds(path)
+                error = None
+            except FeedsError as e:
+                error = str(e)
+            ok = (error is None) == valid
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {json.dumps(motion)}: {error or 'accepted'}")
+
+        # A bad edit while running is reported and the last good list stays in use
+        good = [{"name": "Front", "url": "rtsp://camera/1", "motion": {"threshold": 30}}]
+        watcher = FeedsWatcher(path, good)
+        with open(path, "w") as f:
+            json.dump([{"name": "Front", "url": "rtsp://camera/1", "motion": {"zones": [[1, 1, 0, 0]]}}], f)
+        kept = not watcher.check() and watcher.feeds == good
+        failures += not kept
+        print(f"{'ok  ' if kept else 'FAIL'} bad edit while running: last good list kept")
+    raise SystemExit(f"{failures} check(s) failed" if failures else 0)
@@ -0,0 +1,310 @@
+import os
+import threading
+import time
+
+import cv2
+
+from metrics import METRICS
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# --- CONFIGURATION ---
+DEFAULT_BACKEND = "pyav"
+
+# Codecs whose FFmpeg decoders implement the "lowres" option (decode at 1/2, 1/4, 1/8 size)
+LOWRES_CODECS = {"mjpeg", "mpeg4", "h263", "mpeg1video", "mpeg2video"}
+
+# Standby keeps the packets since the last keyframe so a switch can catch up instantly
+STANDBY_GOP_BYTES = 512 * 1024
+
+# OpenCV reads its FFmpeg options from this variable when a capture opens
+OPENCV_OPTIONS_ENV = "OPENCV_FFMPEG_CAPTURE_OPTIONS"
+_opencv_env_lock = threading.Lock()
+
+
+# --- BACKENDS ---
+
+class OpenCVDecoder:
+    """
+    Decoder backed by cv2.VideoCapture. Frame skipping uses grab() so skipped
+    frames avoid the colour conversion; keyframe-only mode is not available.
+
+    FFmpeg `options` go through OPENCV_FFMPEG_CAPTURE_OPTIONS, which is
+    process-wide, so captures with options open one at a time.
+    """
+    name = "opencv"
+    supports_standby = False
+    frame_latency = None # Not measurable, demux and decode happen inside read()
+
+    def __init__(self, url, every_nth=1, output_size=None, options=None, open_timeout=None,
+                 read_timeout=None, low_delay=False, **_):
+        self.url = url
+        self.every_nth = max(1, int(every_nth))
+        self.output_size = output_size
+        self.options = dict(options or {})
+        if low_delay:
+            self.options["flags"] = "low_delay"
+        self.timeout = (open_timeout, read_timeout)
+        self.keyframes_only = False
+        self._cap = None
+
+    def open(self):
+        if not self.options and self.timeout == (None, None):
+            self._cap = cv2.VideoCapture(self.url)
+            return self._cap.isOpened()
+
+        params = []
+        for prop, seconds in zip((cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, cv2.CAP_PROP_READ_TIMEOUT_MSEC), self.timeout):
+            if seconds:
+                params += [prop, int(seconds * 1000)]
+        with _opencv_env_lock:
+            previous = os.environ.get(OPENCV_OPTIONS_ENV)
+            os.environ[OPENCV_OPTIONS_ENV] = "|".join(f"{key};{value}" for key, value in self.options.items())
+            try:
+                self._cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG, params)
+            finally:
+                if previous is None:
+                    del os.environ[OPENCV_OPTIONS_ENV]
+                else:
+                    os.environ[OPENCV_OPTIONS_ENV] = previous
+        return self._cap.isOpened()
+
+    def read(self):
+        if self._cap is None:
+            return False, None
+        start = METRICS.now()
+        for _ in range(self.every_nth - 1):
+            if not self._cap.grab():
+                return False, None
+        ret, frame = self._cap.read()
+        METRICS.observe("decode", start)
+        if ret and self.output_size and (frame.shape[1], frame.shape[0]) != tuple(self.output_size):
+            frame = cv2.resize(frame, tuple(self.output_size), interpolation=cv2.INTER_LINEAR)
+        return ret, frame
+
+    def set_keyframes_only(self, enabled):
+        if enabled:
+            print("Decoder: keyframe-only mode needs the pyav backend, ignoring.")
+
+    def set_standby(self, enabled):
+        if enabled:
+            print("Decoder: standby mode needs the pyav backend, ignoring.")
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class PyAVDecoder:
+    """
+    Decoder backed by PyAV, with frame dropping before decode:
+
+    * keyframes_only - non-key packets are discarded before they reach the decoder.
+    * skip_nonref    - the codec skips non-reference frames (AVDISCARD_NONREF).
+    * every_nth      - only every Nth decoded frame is converted to BGR.
+    * output_size    - (w, h) scaling done by swscale together with the colour conversion.
+    * lowres         - decode at 1/2^lowres size where the codec supports it.
+    * low_delay      - the codec outputs frames without reordering delay.
+
+    `options` are FFmpeg format options for av.open() (rtsp_transport,
+    probesize, ...). `frame_latency` is the time from the demuxer handing
+    over the newest frame's packet to its BGR image, so it includes any
+    reordering or frame-threading delay in the decoder.
+
+    In standby mode only keyframes are decoded; the packets since the last
+    keyframe are kept (up to max_gop_bytes) so that leaving standby can catch
+    up to the live position without waiting for the next keyframe.
+
+    `packet_tap(packet, stream)` (settable at any time) sees every demuxed
+    packet on the reader thread, e.g. for the pre-event clip buffer.
+    """
+    name = "pyav"
+    supports_standby = True
+
+    def __init__(self, url, every_nth=1, skip_nonref=False, keyframes_only=False,
+                 output_size=None, lowres=0, options=None, open_timeout=10.0, read_timeout=5.0,
+                 low_delay=False, standby=False, max_gop_bytes=STANDBY_GOP_BYTES):
+        self.url = url
+        self.every_nth = max(1, int(every_nth))
+        self.skip_nonref = skip_nonref
+        self.keyframes_only = keyframes_only
+        self.output_size = output_size
+        self.lowres = int(lowres)
+        self.options = dict(options or {})
+        self.timeout = (open_timeout or 10.0, read_timeout or 5.0)
+        self.low_delay = low_delay
+        self.standby = standby
+        self.max_gop_bytes = max_gop_bytes
+        self.skipped_packets = 0
+        self.frame_latency = None
+        self.packet_tap = None
+        self._container = None
+        self._stream = None
+        self._packets = None
+        self._pending = []
+        self._arrivals = {} # pts -> when that packet was demuxed
+        self._frame_count = 0
+        self._need_keyframe = False
+        self._gop = []
+        self._gop_bytes = 0
+        self._replay = []
+
+    def open(self):
+        try:
+            self._container = av.open(self.url, options=self.options, timeout=self.timeout)
+            self._stream = self._container.streams.video[0]
+        except Exception as e:
+            print(f"Decoder: failed to open {self.url}: {e}")
+            self.release()
+            return False
+
+        ctx = self._stream.codec_context
+        if self.skip_nonref:
+            ctx.skip_frame = "NONREF"
+        if self.low_delay:
+            ctx.flags |= av.codec.context.Flags.low_delay
+        if self.lowres:
+            if ctx.name in LOWRES_CODECS:
+                ctx.options = {"lowres": str(self.lowres)}
+            else:
+                print(f"Decoder: {ctx.name} does not support lowres decoding, ignoring.")
+
+        self._packets = self._container.demux(self._stream)
+        self._need_keyframe = True
+        return True
+
+    def read(self):
+        if self._packets is None:
+            return False, None
+        try:
+            while True:
+                while self._pending:
+                    frame = self._pending.pop(0)
+                    arrived = self._arrivals.pop(frame.pts, None)
+                    self._frame_count += 1
+                    if (self._frame_count - 1) % self.every_nth == 0:
+                        image = self._to_bgr(frame)
+                        if arrived is not None:
+                            self.frame_latency = time.monotonic() - arrived
+                        return True, image
+
+                if self._replay:
+                    # Catching up after standby: decode the buffered packets, convert only the newest
+                    self._arrivals.clear() # Buffered packets, their delay says nothing about the stream
+                    frames = self._decode(self._replay.pop(0))
+                    if not self._replay:
+                        self._pending = frames[-1:]
+                    continue
+
+                packet = next(self._packets)
+                if not packet.size:
+                    self._pending = self._decode(packet) # End of stream, flush the decoder
+                    continue
+                tap = self.packet_tap
+                if tap is not None:
+                    tap(packet, self._stream)
+                if packet.pts is not None and not self.standby:
+                    if len(self._arrivals) > 64:
+                        self._arrivals.clear() # Frames the codec skipped never come out
+                    self._arrivals[packet.pts] = time.monotonic()
+
+                if self.standby:
+                    self._buffer_gop(packet)
+                    if not packet.is_keyframe:
+                        continue
+                elif self._gop:
+                    gop, self._gop = self._gop, []
+                    if not packet.is_keyframe:
+                        self._replay = gop[1:] + [packet]
+                        continue
+
+                if (self.keyframes_only or self._need_keyframe) and not packet.is_keyframe:
+                    self.skipped_packets += 1
+                    continue
+                self._need_keyframe = False
+                self._pending = self._decode(packet)
+        except StopIteration:
+            return False, None
+        except Exception as e:
+            print(f"Decoder: read failed on {self.url}: {e}")
+            return False, None
+
+    def set_keyframes_only(self, enabled):
+        if self.keyframes_only and not enabled:
+            # The skipped packets were references, resume cleanly at the next keyframe
+            self._need_keyframe = True
+        self.keyframes_only = enabled
+
+    def set_standby(self, enabled):
+        self.standby = enabled
+
+    def _buffer_gop(self, packet):
+        if packet.is_keyframe:
+            self._gop = [packet]
+            self._gop_bytes = packet.size
+        elif self._gop and self._gop_bytes + packet.size <= self.max_gop_bytes:
+            self._gop.append(packet)
+            self._gop_bytes += packet.size
+        else:
+            # GOP too long to replay, leaving standby will wait for the next keyframe
+            self._gop = []
+            self._need_keyframe = True
+
+    def release(self):
+        if self._container is not None:
+            try:
+                self._container.close()
+            except Exception:
+                pass
+        self._container = None
+        self._stream = None
+        self._packets = None
+        self._pending = []
+        self._arrivals.clear()
+        self._gop = []
+        self._replay = []
+
+    def _decode(self, packet):
+        start = METRICS.now()
+        try:
+            return packet.decode()
+        except av.error.InvalidDataError:
+            # Corrupt packets are common on lossy RTSP links, skip them
+            METRICS.incr("corrupt_packets")
+            return []
+        finally:
+            METRICS.observe("decode", start)
+
+    def _to_bgr(self, frame):
+        start = METRICS.now()
+        if self.output_size:
+            width, height = self.output_size
+            image = frame.to_ndarray(width=width, height=height, format="bgr24")
+        else:
+            image = frame.to_ndarray(format="bgr24")
+        METRICS.observe("convert", start)
+        return image
+
+
+BACKENDS = {
+    OpenCVDecoder.name: OpenCVDecoder,
+    PyAVDecoder.name: PyAVDecoder,
+}
+
+
+def create_decoder(url, backend=None, **options):
+    """
+    Returns an unopened decoder for `url`. Falls back to OpenCV when PyAV
+    is not installed.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == PyAVDecoder.name and av is None:
+        print("Decoder: PyAV not installed, falling back to OpenCV.")
+        backend = OpenCVDecoder.name
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown decoder backend: {backend}")
+    return BACKENDS[backend](url, **options)
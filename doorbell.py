@@ -1,25 +1,91 @@
 import time
-import json
 import cv2
 from PIL import Image
-import RPi.GPIO as GPIO 
-import signal
-import requests
 import os
-import datetime
+import sys
 import threading
 from dotenv import load_dotenv
 
-# Luma Libraries
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None # Off-device (bench.py): buttons and device are replaced before run_doorbell()
+
+from lcd_sink import RGB565Display, NullSPI
+from overlay import OverlayCache, fill_rect, put_text
+from transform import TransformCache
+from standby import StandbyPool
+from buttons import GPIOButtonInput, ACTION_NEXT, ACTION_PREV, ACTION_SNAPSHOT, ACTION_MOSAIC, BUTTON_DEBOUNCE_TIME
+from metrics import METRICS, process_uptime
+from snapshots import SnapshotService, TelegramClient
+from motion import MotionDetector, motion_config
+from clips import ClipRecorder
+from mosaic import MosaicReader
+from health import STATE_UP, STATE_DOWN
+from idle import IDLE, STATE_ACTIVE, STATE_OFF
+import core
+from core import FrameRate
+
+# Luma Libraries (the device classes are imported by setup_hardware(), after the first connect has started)
 from luma.core.render import canvas
-from luma.core.interface.serial import spi
-from luma.lcd.device import st7735
 
 # --- CONFIGURATION ---
-FEEDS_FILE = "feeds.json"
+# Feeds file and decoder settings are shared with the web server (core.py)
+FEEDS_FILE = core.FEEDS_FILE
 LCD_WIDTH = 128
 LCD_HEIGHT = 128
 device = None
+buttons = None
+
+# Display: push BGR frames as RGB565 straight over SPI instead of PIL -> luma
+DISPLAY_FAST_PATH = True
+DISPLAY_DIRTY_ROWS = False # Only push rows that changed since the last frame
+
+DECODER_BACKEND = core.DECODER_BACKEND
+DECODER_OPTIONS = core.DECODER_OPTIONS
+# Frames pushed to the LCD per second at most (0 = every decoded frame). The decoder
+# is shared with the web server in videopi.py, which picks its own rate.
+LCD_MAX_FPS = 0
+
+# Warm standby: keep this many adjacent feeds connected (2 = next + prev), 0 disables
+STANDBY_BUDGET = 0
+
+# Start-up: the first feed connects while the LCD is set up, and the panel is taken over
+# from splash.py as it is (no reset pulse, init sequence or clear, so no blank flash)
+SPLASH_HANDOFF = True
+STARTUP_TARGET = 5.0 # Seconds from process start to the first LCD frame on the Zero 2W; see `bench.py startup`
+
+# Debug overlay: fps and per-stage timings on the LCD. Toggle at runtime with `kill -USR1 <pid>`
+DEBUG_OVERLAY = os.getenv("VIDEOPI_DEBUG_OVERLAY") == "1"
+DEBUG_STAGES = ["read", "decode", "resize", "draw_ui", "lcd_spi"]
+STALE_FRAME_AGE = 0.5 # Seconds; older frames reaching the LCD are counted as stale
+
+# Event clips: KEY3 and motion also send an MP4 of the seconds around the event.
+# The pre-event buffer keeps the camera's compressed packets (pyav) or small JPEGs
+# (opencv) and never uses more than CLIP_MEMORY_LIMIT bytes.
+CLIPS_ENABLED = True
+CLIP_PREROLL = 5.0
+CLIP_POSTROLL = 5.0
+CLIP_MEMORY_LIMIT = 8 * 1024 * 1024
+
+# Mosaic: every feed at once in a grid, toggled with the joystick press. One tile
+# decodes at full rate (recent motion first, else round-robin), the rest keyframes only.
+MOSAIC_GRID = (2, 2)
+MOSAIC_ON_START = False
+
+# Feed health: every feed is probed in the background (backoff after failures).
+# NEXT/PREV skip feeds found down; False lands on them and shows them as offline.
+HEALTH_SKIP_DOWN = True
+HEALTH_COLORS = {STATE_UP: (0, 200, 0), STATE_DOWN: (0, 0, 255)} # Anything else: grey
+
+# Idle: after IDLE_AFTER seconds without a button press, motion event or web viewer the
+# backlight goes off, nothing is pushed over SPI and the feed drops to keyframe-only
+# decode (motion detection keeps running on the keyframes). After IDLE_DISCONNECT_AFTER
+# seconds it disconnects as well (no motion alerts then). 0 disables either step.
+# The panel keeps its last frame, so waking up shows it at once while the stream resumes.
+IDLE_AFTER = 300
+IDLE_DISCONNECT_AFTER = 0
+IDLE_WAKE_PRESS_ONLY_WAKES = True # The press that wakes the LCD doesn't also switch feeds
 
 # Load Environment Variables
 if os.path.exists(',env'):
@@ -39,55 +105,106 @@ SPI_BL_PIN = 24
 KEY_NEXT_PIN = 21  # Key 1
 KEY_PREV_PIN = 20  # Key 2
 KEY_RELOAD_PIN = 16 # Key 3 (Now Snapshot)
+KEY_MOSAIC_PIN = 13 # Joystick press
 
 # --- GLOBAL STATE ---
 feeds = []
 current_feed_index = 0
-last_button_press_time = 0
-BUTTON_DEBOUNCE_TIME = 0.3 # Seconds
+switch_requested_at = None # Monotonic time of the last NEXT/PREV press, for switch latency
+active_reader = None # Reader the render loop is waiting on, woken by button events
+mosaic_mode = False
+health = None # HealthMonitor, created by run_doorbell()
+pending_feeds = None # Feed list from a feeds.json reload, applied by the render loop
+PENDING_FEEDS_LOCK = threading.Lock()
+preconnected = None # Tap on the first feed, opened by preconnect() before the display is ready
+STARTUP = {"imports": process_uptime()} # Process uptime at each start-up milestone
+FRAME_WAIT_TIMEOUT = 1.0 # Max wait for a new frame; button events wake the loop earlier
+SHUTDOWN = threading.Event() # Set to make run_doorbell() return
 
-# --- 1. GPIO SETUP (Manual & Clean) ---
-# We do this FIRST to clear any previous errors
-try:
-    GPIO.setmode(GPIO.BCM)
-    # Clean specific pins if they were left open, or just proceed
-except Exception:
-    pass
-
-# Setup Button Inputs
-GPIO.setup(KEY_NEXT_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(KEY_PREV_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(KEY_RELOAD_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-
-# --- 2. SETUP DISPLAY (Luma) ---
-# Luma will detect BCM is already set and use it
-serial_interface = spi(
-    port=0,          
-    device=0,        
-    gpio_DC=SPI_DC_PIN,
-    gpio_RST=SPI_RST_PIN,
-    gpio_backlight=SPI_BL_PIN 
-)
-
-device = st7735(
-    serial_interface,
-    rotate=0,
-    width=LCD_WIDTH,
-    height=LCD_HEIGHT,
-    h_offset=1,   
-    v_offset=2,   
-    bgr=True
-)
+def setup_hardware():
+    """
+    Claims the GPIO pins and initialises the LCD. Called from __main__, so
+    the module can be imported (and driven by bench.py) without a Pi.
+    """
+    global buttons, device
+    from luma.core.interface.serial import spi
+    from luma.lcd.device import st7735
+    import splash
+
+    # A running splash.py exits on request and leaves the panel initialised and lit
+    adopted = SPLASH_HANDOFF and splash.take_over()
+
+    # --- 1. GPIO SETUP (Manual & Clean) ---
+    # We do this FIRST to clear any previous errors
+    try:
+        GPIO.setmode(GPIO.BCM)
+        # Clean specific pins if they were left open, or just proceed
+    except Exception:
+        pass
+
+    # Setup Button Inputs (edge-detected, events are queued)
+    buttons = GPIOButtonInput({
+        KEY_NEXT_PIN: ACTION_NEXT,
+        KEY_PREV_PIN: ACTION_PREV,
+        KEY_RELOAD_PIN: ACTION_SNAPSHOT,
+        KEY_MOSAIC_PIN: ACTION_MOSAIC,
+    }, BUTTON_DEBOUNCE_TIME)
+
+    # --- 2. SETUP DISPLAY (Luma) ---
+    # Luma will detect BCM is already set and use it
+    serial_interface = spi(
+        port=0,          
+        device=0,        
+        gpio_DC=SPI_DC_PIN,
+        gpio_RST=None if adopted else SPI_RST_PIN, # No reset pulse when taking over
+        gpio_backlight=SPI_BL_PIN 
+    )
+
+    # When adopting, luma's init sequence and clear() go to a null interface instead of the panel
+    device = st7735(
+        NullSPI() if adopted else serial_interface,
+        rotate=0,
+        width=LCD_WIDTH,
+        height=LCD_HEIGHT,
+        h_offset=1,   
+        v_offset=2,   
+        bgr=True
+    )
+    if adopted:
+        device._serial_interface = serial_interface
+        print("Display taken over from the splash screen.")
+
+    if DISPLAY_FAST_PATH:
+        # Wraps the luma device; canvas() drawing keeps working through it
+        device = RGB565Display(device, dirty_rows=DISPLAY_DIRTY_ROWS)
+
+    startup_mark("display")
 
 # --- 3. HELPER FUNCTIONS ---
+def preconnect():
+    """
+    Loads the feeds and starts opening the first one, so the RTSP handshake
+    runs while setup_hardware() initialises the LCD. run_doorbell() gets the
+    same reader from the hub instead of connecting again.
+    """
+    global preconnected
+    load_feeds()
+    feed = feeds[current_feed_index]
+    if feed['url'] and not MOSAIC_ON_START:
+        preconnected = core.HUB.acquire(feed['url'], feed['name'], DECODER_BACKEND, DECODER_OPTIONS,
+                                        capture=feed.get('capture'))
+
+def startup_mark(stage):
+    """
+    Records the process uptime at a start-up milestone (once), as a gauge.
+    """
+    if stage not in STARTUP:
+        STARTUP[stage] = process_uptime()
+        METRICS.set(f"startup_{stage}_seconds", round(STARTUP[stage], 3))
+
 def load_feeds():
     global feeds, current_feed_index
-    try:
-        with open(FEEDS_FILE, 'r') as f:
-            feeds = json.load(f)
-    except Exception as e:
-        print(f"Error loading feeds: {e}")
-        feeds = []
+    feeds = core.load_feeds(FEEDS_FILE)
 
     if not feeds:
         feeds = [{"name": "No Config", "url": ""}]
@@ -98,161 +215,501 @@ def load_feeds():
     
     print(f"Loaded {len(feeds)} feeds.")
 
-def check_buttons():
+def on_feeds_changed(new_feeds):
     """
-    Checks if buttons are pressed. Returns 'next', 'prev', 'snapshot', or None.
-    Includes software debouncing.
+    Watcher listener (runs in the watcher thread): hands the new list to the render loop.
     """
-    global last_button_press_time, current_feed_index
-    
-    now = time.time()
-    if (now - last_button_press_time) < BUTTON_DEBOUNCE_TIME:
+    global pending_feeds
+    with PENDING_FEEDS_LOCK:
+        pending_feeds = new_feeds
+    wake_render_loop()
+
+def apply_feed_reload():
+    """
+    Takes a pending feeds.json reload, staying on the current feed if it is
+    still configured. Returns 'restart' when the stream on screen has to
+    reconnect, 'reload' when only its label or other feeds changed, else None.
+    """
+    global feeds, current_feed_index, pending_feeds
+    with PENDING_FEEDS_LOCK:
+        new_feeds, pending_feeds = pending_feeds, None
+    if new_feeds is None:
+        return None
+    current = feeds[current_feed_index]
+    current_feed_index = core.remap_index(feeds, new_feeds, current_feed_index)
+    feeds = new_feeds
+    print(f"Feeds reloaded, showing {feeds[current_feed_index]['name']}")
+    if not mosaic_mode and core.stream_config(feeds[current_feed_index]) != core.stream_config(current):
+        return 'restart'
+    return 'reload' # The mosaic reconnects its changed tiles itself
+
+def check_buttons(timeout=0):
+    """
+    Takes the next button event from the input queue, waiting up to `timeout`
+    seconds. Returns 'switch', 'snapshot', 'mosaic', 'wake' or None, or the
+    result of a pending feeds.json reload. Debouncing is done by the input.
+    """
+    global current_feed_index, switch_requested_at, mosaic_mode
+
+    reload_action = apply_feed_reload()
+    if reload_action is not None:
+        return reload_action
+
+    event = buttons.get(timeout)
+    if event is None:
         return None
 
+    if IDLE.activity("button") and IDLE_WAKE_PRESS_ONLY_WAKES:
+        print(">>> Button: wake")
+        return 'wake'
+
     action = None
-    
-    # Logic: GPIO.LOW means pressed (because of PUD_UP)
-    if GPIO.input(KEY_NEXT_PIN) == 0:
+
+    if event.action == ACTION_NEXT:
         print(">>> Button: NEXT")
-        current_feed_index = (current_feed_index + 1) % len(feeds)
+        current_feed_index = step_feed(1)
         action = 'switch'
-        last_button_press_time = now
         
-    elif GPIO.input(KEY_PREV_PIN) == 0:
+    elif event.action == ACTION_PREV:
         print(">>> Button: PREV")
-        current_feed_index = (current_feed_index - 1) % len(feeds)
+        current_feed_index = step_feed(-1)
         action = 'switch'
-        last_button_press_time = now
         
-    elif GPIO.input(KEY_RELOAD_PIN) == 0:
+    elif event.action == ACTION_SNAPSHOT:
         print(">>> Button: SNAPSHOT")
         action = 'snapshot'
-        last_button_press_time = now
+
+    elif event.action == ACTION_MOSAIC:
+        mosaic_mode = not mosaic_mode
+        print(f">>> Button: MOSAIC {'on' if mosaic_mode else 'off'}")
+        action = 'mosaic'
+
+    if action == 'switch':
+        switch_requested_at = event.timestamp
         
     return action
 
-def send_snapshot_thread(frame_bgr, feed_name):
+def step_feed(step):
     """
-    Background worker to save and send the snapshot.
+    Index of the next feed in direction `step`, skipping feeds that are down.
     """
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHATID:
-        print("Telegram Warning: Missing credentials, cannot send snapshot.")
-        return
+    if HEALTH_SKIP_DOWN and health is not None:
+        return health.next_index(feeds, current_feed_index, step)
+    return (current_feed_index + step) % len(feeds)
 
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    caption = f"Snapshot: {feed_name}\nTime: {timestamp}"
-    
-    filename = "/tmp/videopi_snapshot.jpg"
-    
-    try:
-        # Save full resolution frame
-        cv2.imwrite(filename, frame_bgr)
-        
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-        with open(filename, 'rb') as f:
-            files = {'photo': f}
-            data = {
-                "chat_id": TELEGRAM_CHATID,
-                "caption": caption
-            }
-            print(f"Sending snapshot to Telegram ({feed_name})...")
-            response = requests.post(url, data=data, files=files)
-            if response.status_code == 200:
-                print("Snapshot sent successfully.")
-            else:
-                print(f"Failed to send snapshot: {response.text}")
-                
-    except Exception as e:
-        print(f"Error sending snapshot: {e}")
+def wake_render_loop():
+    """
+    Button listener: interrupts the render loop's wait for the next frame.
+    """
+    reader = active_reader
+    if reader is not None:
+        reader.buffer.interrupt()
 
-def draw_ui(cv_frame, feed_name, status_text=None):
+def get_motion_detector(detectors, feed):
+    """
+    Returns the feed's motion detector (kept per URL, background reset), or
+    None when its "motion" block in feeds.json is missing or disabled.
+    """
+    config = motion_config(feed)
+    if not config["enabled"] or not feed['url']:
+        return None
+    detector = detectors.get(feed['url'])
+    if detector is None or detector.config != config:
+        detector = detectors[feed['url']] = MotionDetector(config)
+    detector.reset()
+    return detector
+
+def create_snapshot_service():
+    """
+    One worker with a bounded queue, keep-alive session and a disk spool for
+    retries; replaces the thread-per-press sender.
+    """
+    client = None
+    if TELEGRAM_BOT_TOKEN and TELEGRAM_CHATID:
+        client = TelegramClient(TELEGRAM_BOT_TOKEN, TELEGRAM_CHATID)
+    return SnapshotService(client).start()
+
+def create_mosaic(snapshots):
+    """
+    A grid of all feeds, starting on the page of the current one. Motion on a
+    tile with alerts enabled is sent like in single-feed mode.
+    """
+    def on_motion(feed, frame, event):
+        print(f">>> Motion on {feed['name']} ({event.fraction:.0%} of zone)")
+        IDLE.activity("motion")
+        snapshots.snapshot(frame, feed['name'], reason="Motion", snapshot_url=feed.get('snapshot_url'))
+
+    return MosaicReader(feeds, MOSAIC_GRID, (LCD_WIDTH, LCD_HEIGHT), letterbox=False,
+                        backend=DECODER_BACKEND, decoder_options=DECODER_OPTIONS,
+                        selected=current_feed_index, on_motion=on_motion, health=health)
+
+def set_power(state, reader, mosaic):
+    """
+    Applies an idle state to the LCD and to the stream on screen: dark and
+    keyframe-only while idle, lit and back to full rate (catching up from
+    the buffered GOP) when active. The mosaic's tiles are keyframe-only anyway.
+    """
+    active = state == STATE_ACTIVE
+    device.backlight(active)
+    if not mosaic:
+        if active:
+            reader.promote()
+        else:
+            reader.demote()
+    return state
+
+def sleep_until_woken():
+    """
+    The 'off' idle state: everything is disconnected and the dark panel
+    keeps its last frame; returns once a button, motion elsewhere (web) or
+    an HTTP request wakes it.
+    """
+    print("Idle: streams closed until woken")
+    while not SHUTDOWN.is_set() and not IDLE.wait_active(0):
+        check_buttons(timeout=0.1) # A press wakes; a feeds.json reload is taken meanwhile
+    device.backlight(True) # The panel still shows the last frame while the stream reconnects
+
+# Stretches frames to the panel into a reused buffer (geometry cached per source size)
+LCD_TRANSFORM = TransformCache((LCD_WIDTH, LCD_HEIGHT), letterbox=False)
+_lcd_rgb = None # Reused cvtColor output for the legacy display path
+
+def show_frame(frame_bgr):
+    """
+    Pushes a 128x128 BGR frame to the LCD.
+    """
+    global _lcd_rgb
+    start = METRICS.now()
+    if DISPLAY_FAST_PATH:
+        device.display_bgr(frame_bgr)
+    else:
+        if _lcd_rgb is None or _lcd_rgb.shape != frame_bgr.shape:
+            _lcd_rgb = frame_bgr.copy()
+        cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB, dst=_lcd_rgb)
+        device.display(Image.fromarray(_lcd_rgb))
+    METRICS.observe("display", start)
+    METRICS.tick("lcd")
+
+def render_ui(layer, feed_name, status_text, health_states=()):
+    """
+    Draws one overlay state; called once per (feed, status, health, size) by the overlay cache.
+    """
     # Black Bottom Bar
-    cv2.rectangle(cv_frame, (0, 115), (128, 128), (0, 0, 0), -1)
+    fill_rect(layer, (0, 115), (128, 128), (0, 0, 0))
+
+    # Feed health along the top edge of the bar, one mark per feed (green up, red down, grey not known yet)
+    if len(health_states) <= 20:
+        for i, state in enumerate(health_states):
+            x = 126 - 6 * (len(health_states) - i)
+            fill_rect(layer, (x + 1, 115), (x + 4, 116), HEALTH_COLORS.get(state, (128, 128, 128)))
     
     # Feed Name
     disp_name = (feed_name[:12] + '..') if len(feed_name) > 12 else feed_name
-    cv2.putText(cv_frame, disp_name, (2, 125), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 0), 1)
+    put_text(layer, disp_name, (2, 125), 0.35, (0, 255, 0))
     
     # Optional Status Text (e.g. "SNAP!")
     if status_text:
-         cv2.putText(cv_frame, status_text, (80, 125), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 255), 1)
+         put_text(layer, status_text, (80, 125), 0.35, (0, 255, 255))
 
-    return cv_frame
+UI_OVERLAYS = OverlayCache(render_ui)
+
+def draw_ui(cv_frame, feed_name, status_text=None):
+    health_states = health.states(feeds) if health is not None else ()
+    return UI_OVERLAYS.apply(cv_frame, (feed_name, status_text, health_states))
+
+def show_offline(name, note=None):
+    """
+    Shown while a feed is down; the retry is up to the health prober.
+    `note` flashes above it (e.g. a snapshot that had no picture to send).
+    """
+    retry = health.retry_in(feeds[current_feed_index]['url'])
+    with canvas(device) as draw:
+        draw.rectangle(device.bounding_box, outline="black", fill="black")
+        if note:
+            draw.text((10, 20), note, fill="yellow")
+        draw.text((10, 40), "OFFLINE", fill="red")
+        draw.text((10, 55), f"{name}", fill="green")
+        draw.text((10, 75), f"retry in {retry:.0f}s", fill="white")
+        draw.text((10, 90), "NEXT/PREV to skip", fill="white")
+
+def render_debug(layer, lines):
+    """
+    Draws the metrics summary in the top-left corner; cached per distinct text.
+    """
+    fill_rect(layer, (0, 0), (72, 4 + 9 * len(lines)), (0, 0, 0))
+    for i, line in enumerate(lines):
+        put_text(layer, line, (2, 10 + 9 * i), 0.28, (0, 255, 255))
+
+DEBUG_OVERLAYS = OverlayCache(render_debug, max_entries=4)
+
+def toggle_debug_overlay(signum, frame):
+    global DEBUG_OVERLAY
+    DEBUG_OVERLAY = not DEBUG_OVERLAY
+    print(f"Debug overlay {'on' if DEBUG_OVERLAY else 'off'}")
 
 # --- 4. MAIN LOOP ---
 def run_doorbell():
-    load_feeds()
+    global switch_requested_at, active_reader, mosaic_mode, health, preconnected
+    if not feeds:
+        load_feeds() # Unless preconnect() did
+    mosaic_mode = MOSAIC_ON_START
+    health = core.shared_health(feeds) # One prober per process, shared with the web server
+    watcher = core.shared_watcher(feeds, FEEDS_FILE) # Edits to feeds.json apply without a restart
+    watcher.add_listener(on_feeds_changed)
     device.backlight(True)
+    IDLE.start(IDLE_AFTER, IDLE_DISCONNECT_AFTER)
+    IDLE.add_listener(wake_render_loop)
+    buttons.add_listener(wake_render_loop)
+    buttons.start()
+    standby = StandbyPool(STANDBY_BUDGET, DECODER_BACKEND, **DECODER_OPTIONS)
+    snapshots = create_snapshot_service()
+    motion_detectors = {}
+    clips = ClipRecorder(snapshots.send_video, CLIP_PREROLL, CLIP_POSTROLL, CLIP_MEMORY_LIMIT) if CLIPS_ENABLED else None
+    resuming = False # Woken from 'off': the panel shows the last frame until the stream is back
     
-    while True:
+    while not SHUTDOWN.is_set():
         # --- CONNECT PHASE ---
-        current_feed = feeds[current_feed_index]
+        mosaic = mosaic_mode
+        current_feed = {"name": "Mosaic", "url": ""} if mosaic else feeds[current_feed_index]
         url = current_feed['url']
         name = current_feed['name']
         
         print(f"Connecting to: {name}")
         
-        # UI: Connecting...
-        with canvas(device) as draw:
-            draw.rectangle(device.bounding_box, outline="black", fill="black")
-            draw.text((10, 50), f"Loading...", fill="white")
-            draw.text((10, 65), f"{name}", fill="green")
+        if mosaic:
+            # The tiles hold their own keyframe-only connections; the grid shows while they open
+            standby.close()
+            warm = True
+            reader = create_mosaic(snapshots).start()
+        else:
+            # UI: Connecting... (a warm standby feed already has a frame to show)
+            warm = standby.is_warm(url)
+            if not warm and not resuming:
+                with canvas(device) as draw:
+                    draw.rectangle(device.bounding_box, outline="black", fill="black")
+                    draw.text((10, 50), f"Loading...", fill="white")
+                    draw.text((10, 65), f"{name}", fill="green")
 
-        cap = cv2.VideoCapture(url)
-        
-        if not cap.isOpened():
-             print("Connection failed. Waiting 2s before retry or button press...")
-             start_fail = time.time()
-             # While waiting, we must still poll buttons so user isn't stuck!
-             while (time.time() - start_fail) < 2.0:
-                 if check_buttons() == 'switch':
-                     break
-                 time.sleep(0.1)
-             if cap.isOpened(): cap.release()
-             continue # Loop back to start (picks up new index if button pressed)
+            reader = standby.acquire(url, name, current_feed.get('capture'))
+            standby.update(feeds, current_feed_index)
+            health.track(reader)
+        resuming = False
+
+        if preconnected is not None:
+            preconnected.stop() # The reader it started lives on in `reader` if it is the same feed
+            preconnected = None
+
+        # Wait for the reader to open the stream, still handling buttons so the user isn't stuck
+        switched = False
+        snapshot_pending = False
+        while not reader.opened.is_set() and not reader.failed:
+            btn_action = check_buttons(timeout=0.1)
+            if btn_action in ('switch', 'mosaic', 'restart'):
+                switched = True
+                break
+            elif btn_action == 'reload':
+                # Same stream, still opening: pick up the new name (motion settings follow below)
+                if mosaic:
+                    reader.set_feeds(feeds)
+                    reader.select(current_feed_index)
+                else:
+                    current_feed = feeds[current_feed_index]
+                    name = current_feed['name']
+                    standby.update(feeds, current_feed_index)
+            elif btn_action == 'snapshot':
+                snapshot_pending = True # Served with the first frame
+
+        if reader.opened.is_set():
+            startup_mark("opened")
+        if switched or not reader.opened.is_set():
+            reader.stop(timeout=0)
+            if not switched:
+                METRICS.incr("reconnects")
+                health.report_failure(url, "could not open", reader)
+                print(f"Connection failed. Retrying once {name} answers probes again (or on button press)...")
+                # The prober backs off in the background; buttons stay responsive meanwhile
+                shown = None
+                no_picture_until = 0
+                while not SHUTDOWN.is_set() and health.is_down(url):
+                    note = "NO PICTURE" if time.monotonic() < no_picture_until else None
+                    retry = int(health.retry_in(url))
+                    if (retry, note) != shown:
+                        show_offline(name, note)
+                        shown = (retry, note)
+                    btn_action = check_buttons(timeout=0.2)
+                    if btn_action in ('switch', 'mosaic', 'restart'):
+                        break
+                    elif btn_action == 'reload':
+                        name = feeds[current_feed_index]['name'] # Renamed, same stream
+                        shown = None
+                    elif btn_action == 'snapshot':
+                        print(f"Snapshot: {name} is offline, nothing to send")
+                        no_picture_until = time.monotonic() + 1.0
+            continue # Loop back to start (picks up new index if button pressed)
 
         # --- STREAM PHASE ---
         snapshot_feedback_timer = 0
-        
-        while True:
-            # 1. Check Buttons
+        motion_feedback_timer = 0
+        motion = None if mosaic else get_motion_detector(motion_detectors, current_feed)
+        if clips is not None and not mosaic:
+            clips.attach(reader)
+        last_seq = 0
+        lcd_rate = FrameRate(LCD_MAX_FPS)
+        active_reader = reader
+        debug_lines = None
+        debug_updated = 0
+        power = STATE_ACTIVE
+        going_off = False
+
+        while not SHUTDOWN.is_set():
+            # 1. Handle queued button events (no GPIO polling here)
             btn_action = check_buttons()
-            if btn_action == 'switch':
-                break # Break inner loop -> Re-connect to new feed
-            
-            # 2. Read Frame
-            ret, frame = cap.read()
-            
-            if not ret:
-                print("Stream ended or dropped.")
-                break 
-            
-            # Handle Snapshot
+            if btn_action == 'switch' and mosaic:
+                reader.select(current_feed_index) # Moves the highlight (or the page), no reconnect
+                switch_requested_at = None
+            elif btn_action in ('switch', 'mosaic', 'restart'):
+                break # Break inner loop -> Re-connect to new feed (or toggle the mosaic)
+            elif btn_action == 'reload':
+                # Same stream: keep the connection, pick up the new name and motion settings
+                if mosaic:
+                    reader.set_feeds(feeds)
+                    reader.select(current_feed_index)
+                else:
+                    current_feed = feeds[current_feed_index]
+                    name = current_feed['name']
+                    if (motion.config if motion else None) != motion_config(current_feed):
+                        motion = get_motion_detector(motion_detectors, current_feed)
+                    standby.update(feeds, current_feed_index)
             if btn_action == 'snapshot':
-                # Launch thread to avoid freezing the stream
-                t = threading.Thread(target=send_snapshot_thread, args=(frame.copy(), name))
-                t.start()
+                snapshot_pending = True # Served with the next frame
+
+            # Idle: dark and keyframe-only, or disconnected; any activity wakes it
+            state = IDLE.update()
+            if state == STATE_OFF:
+                going_off = True
+                break
+            if state != power:
+                power = set_power(state, reader, mosaic)
+
+            # 2. Take the newest frame (the reader thread keeps draining the stream)
+            seq, frame, frame_time = reader.buffer.get(last_seq, timeout=FRAME_WAIT_TIMEOUT)
+
+            if frame is None:
+                if reader.done:
+                    print("Stream ended or dropped.")
+                    METRICS.incr("stream_drops")
+                    break
+                continue # Woken by a button or timed out, handle events
+            last_seq = seq
+            if not lcd_rate.due(frame_time):
+                continue
+
+            frame_age = time.monotonic() - frame_time
+            METRICS.set("lcd_frame_age_seconds", round(frame_age, 4))
+            if frame_age > STALE_FRAME_AGE:
+                METRICS.incr("lcd_stale_frames")
+
+            if switch_requested_at is not None:
+                standby.record_switch(time.monotonic() - switch_requested_at, warm)
+                switch_requested_at = None
+
+            # In the mosaic the bottom bar and snapshots are about the highlighted feed
+            label = feeds[current_feed_index]['name'] if mosaic else name
+
+            # Handle Snapshot
+            if snapshot_pending:
+                snapshot_pending = False
+                # Queued for the snapshot worker (never blocks; bursts are coalesced)
+                print(f"Sending snapshot to Telegram ({label})...")
+                snapshot_frame = reader.feed_frame(current_feed_index) if mosaic else None
+                snapshots.snapshot(frame if snapshot_frame is None else snapshot_frame, label,
+                                   snapshot_url=feeds[current_feed_index].get('snapshot_url'))
+                if clips is not None and clips.trigger(f"Clip: {name}"):
+                    print(f"Recording clip ({CLIP_PREROLL:.0f}s before, {CLIP_POSTROLL:.0f}s after)")
                 snapshot_feedback_timer = time.time() # Start showing feedback
 
+            if clips is not None:
+                clips.offer_frame(frame) # Only buffers when the decoder has no packets to offer
+
+            # Motion detection on a tiny greyscale copy, a few times per second
+            if motion is not None and motion.due():
+                event = motion.update(frame)
+                if event is not None:
+                    print(f">>> Motion on {name} ({event.fraction:.0%} of zone)")
+                    IDLE.activity("motion")
+                    snapshots.snapshot(frame, name, reason="Motion",
+                                       snapshot_url=feeds[current_feed_index].get('snapshot_url'))
+                    if clips is not None:
+                        clips.trigger(f"Motion clip: {name}")
+                    motion_feedback_timer = time.time()
+
+            if power != STATE_ACTIVE:
+                continue # Dark: no resize, overlay or SPI push until woken
+
             # 3. Process & Display
-            frame_resized = cv2.resize(frame, (LCD_WIDTH, LCD_HEIGHT), interpolation=cv2.INTER_LINEAR)
-            
+            start = METRICS.now()
+            frame_resized = LCD_TRANSFORM(frame) # Reused buffer, drawn on and pushed below
+            METRICS.observe("resize", start)
+
             # Determine feedback text
             status = None
             if time.time() - snapshot_feedback_timer < 1.0: # Show for 1 second
                 status = "SNAP!"
-                
-            frame_resized = draw_ui(frame_resized, name, status)
-            frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-            device.display(Image.fromarray(frame_rgb))
-            
-        cap.release()
-        print(f"Released: {name}")
+            elif time.time() - motion_feedback_timer < 2.0:
+                status = "MOTION"
+
+            start = METRICS.now()
+            frame_resized = draw_ui(frame_resized, label, status)
+            METRICS.observe("draw_ui", start)
+
+            if DEBUG_OVERLAY:
+                # Text changes at most once a second, so the overlay cache is hit in between
+                if time.monotonic() - debug_updated >= 1.0:
+                    debug_lines = tuple(METRICS.summary("lcd", DEBUG_STAGES)) if METRICS.enabled else ("metrics off",)
+                    debug_updated = time.monotonic()
+                DEBUG_OVERLAYS.apply(frame_resized, (debug_lines,))
+
+            show_frame(frame_resized)
+            if "first_frame" not in STARTUP:
+                startup_mark("first_frame")
+                print("Startup: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in STARTUP.items())
+                      + f" (target {STARTUP_TARGET:.0f}s)")
+            # Decode-to-LCD latency, taken after the push has finished
+            METRICS.observe_value("lcd_latency", time.monotonic() - frame_time)
+
+        active_reader = None
+        if clips is not None:
+            clips.detach() # A clip in progress is sent with what it has
+        if mosaic or going_off:
+            reader.stop(timeout=0)
+        else:
+            standby.release(reader)
+        print(f"Released: {name} (frames: {reader.buffer.seq}, dropped: {reader.buffer.dropped})")
+
+        if going_off:
+            standby.close()
+            device.backlight(False)
+            sleep_until_woken()
+            resuming = True
+            continue
 
         # Show feedback while switching
-        with canvas(device) as draw:
-             draw.rectangle(device.bounding_box, outline="black", fill="black")
-             draw.text((30, 60), "Switching...", fill="yellow")
+        if not SHUTDOWN.is_set() and not standby.is_warm(feeds[current_feed_index]['url']):
+            with canvas(device) as draw:
+                 draw.rectangle(device.bounding_box, outline="black", fill="black")
+                 draw.text((30, 60), "Switching...", fill="yellow")
+
+    watcher.remove_listener(on_feeds_changed)
+    IDLE.remove_listener(wake_render_loop)
+    standby.close()
+    snapshots.stop()
+    buttons.stop()
+
+def stop_doorbell():
+    """
+    Makes run_doorbell() return after the current frame.
+    """
+    SHUTDOWN.set()
+    wake_render_loop()
 
 def cleanup_and_exit(signum, frame):
     """Signal handler function to gracefully shut down the display."""
@@ -279,14 +736,8 @@ def cleanup_and_exit(signum, frame):
     exit(0)
 
 if __name__ == "__main__":
-    print("--- Doorbell Started (Polling Mode) ---")
-    signal.signal(signal.SIGTERM, cleanup_and_exit)
-    signal.signal(signal.SIGINT, cleanup_and_exit)
-
-    try:
-        run_doorbell()
-    except KeyboardInterrupt:
-        pass
-    finally:
-        GPIO.cleanup()
-        print("GPIO Cleaned.")
+    # LCD only; `python videopi.py` runs the web server in the same process, sharing the decoders.
+    # videopi imports this module by name: hand it this one rather than setting up a second copy
+    sys.modules.setdefault("doorbell", sys.modules[__name__])
+    import videopi
+    videopi.main(["--no-web"])
@@ -0,0 +1,304 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+HEALTH_INTERVAL = 30.0       # Seconds between probes of a feed that is up
+HEALTH_RETRY_BASE = 2.0      # First re-probe after a failure; doubles with every further failure
+HEALTH_RETRY_MAX = 120.0
+HEALTH_PROBE_TIMEOUT = 2.0
+HEALTH_WORKERS = 2           # Probes in flight at once; a dead host holds a worker for the timeout
+HEALTH_TICK = 0.5            # Seconds between looks at the tracked readers and the probe schedule
+HEALTH_STALE = 15.0          # A tracked reader without a new frame for this long counts as down
+
+STATE_UNKNOWN = "unknown"
+STATE_UP = "up"
+STATE_DOWN = "down"
+
+
+# --- PROBES ---
+# Cheap reachability checks, keyed by URL scheme: nothing is decoded and no
+# RTSP session is set up. A probe returns normally when the feed looks
+# alive and raises (OSError or ValueError) when it does not.
+
+def probe_rtsp(url, timeout):
+    """
+    An OPTIONS request: needs no session, and any RTSP reply (even 401) means the server is up.
+    """
+    parts = urlsplit(url)
+    port = parts.port or (322 if parts.scheme == "rtsps" else 554)
+    with socket.create_connection((parts.hostname, port), timeout) as sock:
+        if parts.scheme == "rtsps":
+            return # A request would need the TLS handshake; accepting the connection is enough
+        sock.settimeout(timeout)
+        # Credentials stay out of the request line
+        target = f"rtsp://{parts.hostname}:{port}{parts.path or '/'}"
+        sock.sendall(f"OPTIONS {target} RTSP/1.0\r\nCSeq: 1\r\n\r\n".encode())
+        reply = sock.recv(64)
+    if not reply.startswith(b"RTSP/"):
+        raise ValueError(f"unexpected reply {reply[:16]!r}")
+
+def probe_tcp(url, timeout):
+    parts = urlsplit(url)
+    port = parts.port or {"http": 80, "https": 443, "rtmp": 1935}.get(parts.scheme)
+    socket.create_connection((parts.hostname, port), timeout).close()
+
+def probe_file(url, timeout):
+    path = urlsplit(url).path # Drops a "#n" suffix as used by bench.py
+    if not os.path.exists(path):
+        raise OSError(f"{path} not found")
+
+PROBES = {
+    "rtsp": probe_rtsp,
+    "rtsps": probe_rtsp,
+    "http": probe_tcp,
+    "https": probe_tcp,
+    "rtmp": probe_tcp,
+    "file": probe_file,
+    "": probe_file,
+}
+
+
+# --- HEALTH TABLE ---
+
+class FeedHealth:
+    """
+    What is known about one feed. Times are time.monotonic().
+    """
+
+    def __init__(self, url, name):
+        self.url = url
+        self.name = name
+        self.state = STATE_UNKNOWN
+        self.last_seen = None      # Newest frame from a tracked reader, or last successful probe
+        self.open_latency = None   # Seconds a reader took to open the stream
+        self.first_frame = None    # Seconds a reader took to its first frame
+        self.frame_latency = None  # Median decoder delay per frame (packet in, image out)
+        self.probe_latency = None  # Seconds the last successful probe took
+        self.failures = 0          # Failures since frames were last seen; drives the backoff
+        self.error = None
+        self.next_probe = 0.0
+        self.probing = False
+
+    def as_dict(self, now):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "last_seen_s": round(now - self.last_seen, 1) if self.last_seen is not None else None,
+            "open_ms": round(self.open_latency * 1000) if self.open_latency is not None else None,
+            "first_frame_ms": round(self.first_frame * 1000) if self.first_frame is not None else None,
+            "latency_ms": round(self.frame_latency * 1000, 1) if self.frame_latency is not None else None,
+            "probe_ms": round(self.probe_latency * 1000) if self.probe_latency is not None else None,
+            "failures": self.failures,
+            "error": self.error,
+            "next_probe_s": round(max(0.0, self.next_probe - now), 1),
+        }
+
+
+class HealthMonitor:
+    """
+    Keeps a health table for every configured feed, off the render path.
+
+    Readers handed to track() are watched passively (open latency, frames,
+    failures). Feeds nobody is reading are probed in the background every
+    `interval` seconds; after a failure the next probe waits `retry_base`
+    seconds, doubling per failure up to `retry_max`. The failure count is
+    only cleared by real frames, so a server that answers probes but whose
+    stream won't open still backs off.
+    """
+
+    def __init__(self, feeds=(), interval=HEALTH_INTERVAL, retry_base=HEALTH_RETRY_BASE,
+                 retry_max=HEALTH_RETRY_MAX, timeout=HEALTH_PROBE_TIMEOUT, workers=HEALTH_WORKERS):
+        self.interval = interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.timeout = timeout
+        self._entries = {} # url -> FeedHealth
+        self._readers = []
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="health-probe")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="health", daemon=True)
+        self.set_feeds(feeds)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    def set_feeds(self, feeds):
+        """
+        Replaces the feed list; feeds that stay keep what is known about them.
+        """
+        with self._cond:
+            entries = {}
+            for feed in feeds:
+                if feed['url']:
+                    entries[feed['url']] = self._entries.get(feed['url']) or FeedHealth(feed['url'], feed['name'])
+            self._entries = entries
+
+    def track(self, reader):
+        """
+        Watches a started reader until it is done.
+        """
+        with self._cond:
+            self._readers.append(reader)
+
+    def report_failure(self, url, error, reader=None):
+        """
+        Records a failure seen by a consumer right away; `reader` is no longer tracked.
+        """
+        with self._cond:
+            if reader in self._readers:
+                self._readers.remove(reader)
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._failed(entry, error, time.monotonic())
+
+    def wake(self, url):
+        """
+        Probes `url` on the next tick instead of waiting for its backoff.
+        """
+        with self._cond:
+            entry = self._entries.get(url)
+            if entry is not None:
+                entry.next_probe = 0.0
+
+    def state(self, url):
+        with self._cond:
+            entry = self._entries.get(url)
+            return entry.state if entry is not None else STATE_UNKNOWN
+
+    def is_down(self, url):
+        return self.state(url) == STATE_DOWN
+
+    def retry_in(self, url):
+        """
+        Seconds until `url` is probed again.
+        """
+        with self._cond:
+            entry = self._entries.get(url)
+            return max(0.0, entry.next_probe - time.monotonic()) if entry is not None else 0.0
+
+    def states(self, feeds):
+        with self._cond:
+            return tuple(self._entries[feed['url']].state if feed['url'] in self._entries else STATE_UNKNOWN
+                         for feed in feeds)
+
+    def next_index(self, feeds, index, step):
+        """
+        The next feed in direction `step` that is not known to be down. When
+        every other feed is down it just moves one step, so the user can still
+        look at a dead feed.
+        """
+        count = len(feeds)
+        for distance in range(1, count):
+            candidate = (index + step * distance) % count
+            if not self.is_down(feeds[candidate]['url']):
+                return candidate
+        return (index + step) % count
+
+    def wait(self, timeout):
+        """
+        Blocks until any feed changes state, or `timeout` seconds pass.
+        """
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def table(self):
+        """
+        The health table as JSON-ready dicts, in feed order.
+        """
+        now = time.monotonic()
+        with self._cond:
+            return [entry.as_dict(now) for entry in self._entries.values()]
+
+    # --- background thread ---
+
+    def _run(self):
+        while not self._stop.wait(HEALTH_TICK):
+            now = time.monotonic()
+            with self._cond:
+                self._inspect_readers(now)
+                due = [entry for entry in self._entries.values() if not entry.probing and now >= entry.next_probe]
+                for entry in due:
+                    if self._recently_seen(entry, now):
+                        entry.next_probe = now + self.interval # Frames are better evidence than a probe
+                    else:
+                        entry.probing = True
+                        self._pool.submit(self._probe, entry)
+                METRICS.set("feeds_up", sum(entry.state == STATE_UP for entry in self._entries.values()))
+
+    def _inspect_readers(self, now):
+        for reader in list(self._readers):
+            entry = self._entries.get(reader.url)
+            if entry is not None and reader.buffer.seq:
+                if reader.open_latency is not None:
+                    entry.open_latency = reader.open_latency
+                if reader.first_frame_latency is not None:
+                    entry.first_frame = reader.first_frame_latency
+                latency = reader.frame_latency
+                if latency is not None:
+                    entry.frame_latency = latency
+                if now - reader.buffer.timestamp <= HEALTH_STALE:
+                    entry.last_seen = max(entry.last_seen or 0.0, reader.buffer.timestamp)
+                    if not reader.done:
+                        entry.failures = 0
+                        self._set_state(entry, STATE_UP, None)
+                elif not reader.done and entry.state != STATE_DOWN:
+                    self._failed(entry, "no frames", now)
+            if reader.done:
+                self._readers.remove(reader)
+                if entry is not None and reader.failed:
+                    self._failed(entry, "stream dropped" if reader.buffer.seq else "could not open", now)
+
+    def _recently_seen(self, entry, now):
+        return entry.last_seen is not None and now - entry.last_seen < self.interval and entry.state == STATE_UP
+
+    def _probe(self, entry):
+        probe = PROBES.get(urlsplit(entry.url).scheme)
+        start = time.monotonic()
+        error = None
+        if probe is not None:
+            try:
+                probe(entry.url, self.timeout)
+            except (OSError, ValueError) as e:
+                error = str(e) or type(e).__name__
+        METRICS.incr("health_probes")
+        now = time.monotonic()
+        with self._cond:
+            entry.probing = False
+            if probe is None:
+                # Can't be probed cheaply: once the backoff is over, let the next reader find out
+                entry.next_probe = now + self.interval
+                if entry.state == STATE_DOWN:
+                    self._set_state(entry, STATE_UNKNOWN, None)
+            elif error is not None:
+                METRICS.incr("health_probe_failures")
+                self._failed(entry, error, now)
+            else:
+                entry.probe_latency = now - start
+                entry.last_seen = now
+                entry.next_probe = now + self.interval
+                self._set_state(entry, STATE_UP, None)
+
+    def _failed(self, entry, error, now):
+        entry.failures += 1
+        entry.next_probe = now + min(self.retry_max, self.retry_base * 2 ** (entry.failures - 1))
+        self._set_state(entry, STATE_DOWN, error)
+
+    def _set_state(self, entry, state, error):
+        entry.error = error
+        if entry.state != state:
+            detail = f" ({error}, next probe in {entry.next_probe - time.monotonic():.0f}s)" if error else ""
+            print(f"Health: {entry.name} is {state}{detail}")
+            entry.state = state
+            self._cond.notify_all()
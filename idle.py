@@ -0,0 +1,129 @@
+import threading
+import time
+
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+# Seconds without activity (button, motion, web viewer) before the LCD goes dark;
+# 0 never. The doorbell passes its own settings to IDLE.start().
+IDLE_AFTER = 300.0
+IDLE_DISCONNECT_AFTER = 0.0 # ... and before the streams are closed; 0 never (motion needs frames)
+
+STATE_ACTIVE = "active" # Backlight on, full-rate decode and SPI pushes
+STATE_IDLE = "idle"     # Backlight off, no SPI pushes, keyframe-only decode (motion keeps running)
+STATE_OFF = "off"       # Backlight off and disconnected
+STATES = (STATE_ACTIVE, STATE_IDLE, STATE_OFF)
+
+
+class IdleMonitor:
+    """
+    Process-wide idle state of the LCD loop. Any thread reports activity
+    with activity(source), which wakes an idle loop at once (listeners are
+    called, e.g. to interrupt the render loop's frame wait). The render loop
+    calls update() to fall asleep once the quiet time is up. The time spent
+    in each state is kept for /status and /metrics.
+    """
+
+    def __init__(self, idle_after=0.0, off_after=0.0):
+        self.idle_after = idle_after
+        self.off_after = off_after
+        self.state = STATE_ACTIVE
+        self.last_activity = time.monotonic()
+        self.wakes = {} # source -> wake-ups it caused
+        self._entered = self.last_activity
+        self._seconds = dict.fromkeys(STATES, 0.0)
+        self._listeners = []
+        self._cond = threading.Condition()
+
+    def start(self, idle_after=IDLE_AFTER, off_after=IDLE_DISCONNECT_AFTER):
+        """
+        Arms the timeouts, counting from now.
+        """
+        with self._cond:
+            self.idle_after = idle_after
+            self.off_after = off_after
+            self.last_activity = time.monotonic()
+        return self
+
+    def add_listener(self, listener):
+        """
+        `listener()` runs in the reporting thread after every wake-up.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def activity(self, source):
+        """
+        Records activity from `source` ("button", "motion", "http", ...).
+        Returns True if it woke the loop up.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self.last_activity = now
+            if self.state == STATE_ACTIVE:
+                return False
+            asleep = now - self._entered
+            self._enter(STATE_ACTIVE, now)
+            self.wakes[source] = self.wakes.get(source, 0) + 1
+        METRICS.incr("idle_wakes")
+        print(f"Idle: woken by {source} after {asleep:.0f}s")
+        for listener in list(self._listeners):
+            listener()
+        return True
+
+    def update(self):
+        """
+        Falls asleep once the time without activity is up; returns the state.
+        """
+        now = time.monotonic()
+        with self._cond:
+            quiet = now - self.last_activity
+            if self.off_after and quiet >= self.off_after:
+                if self.state != STATE_OFF:
+                    self._enter(STATE_OFF, now)
+            elif self.idle_after and quiet >= self.idle_after and self.state == STATE_ACTIVE:
+                self._enter(STATE_IDLE, now)
+            return self.state
+
+    def wait_active(self, timeout):
+        """
+        Waits up to `timeout` seconds for a wake-up; True once active.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.state == STATE_ACTIVE, timeout)
+
+    def seconds(self):
+        """
+        {state: seconds spent in it}, the current stretch included.
+        """
+        now = time.monotonic()
+        with self._cond:
+            seconds = dict(self._seconds)
+            seconds[self.state] += now - self._entered
+        return seconds
+
+    def stats(self):
+        seconds = self.seconds()
+        for state, total in seconds.items():
+            METRICS.set(f"idle_{state}_seconds", round(total, 1))
+        return {
+            "state": self.state,
+            "quiet_s": round(time.monotonic() - self.last_activity, 1),
+            "seconds": {state: round(total, 1) for state, total in seconds.items()},
+            "wakes": dict(self.wakes),
+        }
+
+    def _enter(self, state, now):
+        self._seconds[self.state] += now - self._entered
+        self._entered = now
+        self.state = state
+        METRICS.set("idle_state", STATES.index(state))
+        self._cond.notify_all()
+        if state != STATE_ACTIVE:
+            print(f"Idle: {state} after {now - self.last_activity:.0f}s without activity")
+
+
+IDLE = IdleMonitor()
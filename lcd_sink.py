@@ -0,0 +1,268 @@
+import time
+import numpy as np
+
+from metrics import METRICS
+
+# --- ST7735 COMMANDS ---
+CMD_CASET = 0x2A   # Column address set
+CMD_RASET = 0x2B   # Row address set
+CMD_RAMWR = 0x2C   # Memory write
+CMD_COLMOD = 0x3A  # Interface pixel format
+COLMOD_16BIT = 0x05
+COLMOD_18BIT = 0x06  # What luma.lcd configures
+
+SPI_CHUNK_SIZE = 4096  # spidev default bufsiz; raise together with spidev.bufsiz
+DIRTY_ROW_GAP = 4      # Merge changed row bands separated by fewer unchanged rows
+
+
+# --- NULL HARDWARE (benchmarking off-device) ---
+
+class NullSPI:
+    """
+    Stand-in for luma's spi interface. Discards all data but counts commands,
+    transfers and bytes. With `bus_speed_hz` set it also sleeps for the time
+    the transfer would take on the wire.
+    """
+
+    def __init__(self, bus_speed_hz=None):
+        self.bus_speed_hz = bus_speed_hz
+        self.commands = 0
+        self.transfers = 0
+        self.bytes_written = 0
+
+    def command(self, *cmd):
+        self.commands += 1
+
+    def data(self, data):
+        self.write_buffer(data)
+
+    def write_buffer(self, buf):
+        self.transfers += 1
+        self.bytes_written += len(buf)
+        if self.bus_speed_hz:
+            time.sleep(len(buf) * 8 / self.bus_speed_hz)
+
+
+class NullDevice:
+    """
+    Minimal luma-compatible 128x128 device backed by NullSPI.
+    display() mimics luma's st7735 path (one list of RGB bytes per frame).
+    """
+
+    def __init__(self, width=128, height=128, h_offset=1, v_offset=2, bus_speed_hz=None):
+        self.width = width
+        self.height = height
+        self.mode = "RGB"
+        self.size = (width, height)
+        self.bounding_box = (0, 0, width - 1, height - 1)
+        self.h_offset = h_offset
+        self.v_offset = v_offset
+        self.backlight_on = False
+        self._serial_interface = NullSPI(bus_speed_hz)
+
+    def apply_offsets(self, bbox):
+        left, top, right, bottom = bbox
+        return (left + self.h_offset, top + self.v_offset, right + self.h_offset, bottom + self.v_offset)
+
+    def backlight(self, value):
+        self.backlight_on = bool(value)
+
+    def display(self, image):
+        self._serial_interface.command(CMD_RAMWR)
+        self._serial_interface.data(list(image.tobytes()))
+
+
+# --- RGB565 SINK ---
+
+class RGB565Display:
+    """
+    Fast display sink for the ST7735. Packs BGR NumPy frames straight into
+    big-endian RGB565 in preallocated buffers and writes them over SPI in
+    large chunks, skipping PIL and luma's per-byte list conversion.
+
+    It also quacks like a luma device (mode, size, bounding_box, display,
+    backlight), so `canvas(sink)` keeps working for the text screens.
+
+    With dirty_rows=True only the row bands that changed since the previous
+    frame are pushed.
+    """
+
+    def __init__(self, device, dirty_rows=False, chunk_size=SPI_CHUNK_SIZE):
+        self.device = device
+        self.width = device.width
+        self.height = device.height
+        self.mode = "RGB"
+        self.size = (self.width, self.height)
+        self.bounding_box = (0, 0, self.width - 1, self.height - 1)
+        self.dirty_rows = dirty_rows
+        self.chunk_size = chunk_size
+
+        self.frames = 0
+        self.rows_pushed = 0
+        self.bytes_pushed = 0
+
+        shape = (self.height, self.width)
+        self._px = np.zeros(shape, dtype=np.uint16)
+        self._tmp = np.zeros(shape, dtype=np.uint16)
+        self._out = np.zeros(shape, dtype=">u2")
+        self._prev = np.zeros(shape, dtype=np.uint16)
+        self._changed = np.zeros(shape, dtype=bool)
+        self._full_refresh = True
+
+        self._serial = device._serial_interface
+        self._offset_x, self._offset_y = device.apply_offsets((0, 0, 0, 0))[:2]
+        self._command(CMD_COLMOD, COLMOD_16BIT)
+
+    # --- luma-compatible surface ---
+
+    def backlight(self, value):
+        self.device.backlight(value)
+
+    def display(self, image):
+        """
+        Accepts a BGR NumPy frame or a PIL RGB image (as produced by canvas()).
+        """
+        if isinstance(image, np.ndarray):
+            self.display_bgr(image)
+        else:
+            self._pack(np.asarray(image.convert("RGB")), red=0, blue=2)
+            self._push()
+
+    def display_bgr(self, frame):
+        start = METRICS.now()
+        self._pack(frame, red=2, blue=0)
+        METRICS.observe("lcd_pack", start)
+        start = METRICS.now()
+        self._push()
+        METRICS.observe("lcd_spi", start)
+
+    def invalidate(self):
+        """
+        Forces the next frame to be pushed in full (e.g. after something else drew on the panel).
+        """
+        self._full_refresh = True
+
+    def release(self):
+        """
+        Restores luma's 18-bit pixel format so the luma device can drive the panel again.
+        """
+        self._command(CMD_COLMOD, COLMOD_18BIT)
+
+    # --- internals ---
+
+    def _pack(self, frame, red, blue):
+        px, tmp = self._px, self._tmp
+        np.copyto(px, frame[:, :, red])
+        px &= 0xF8
+        px <<= 8
+        np.copyto(tmp, frame[:, :, 1])
+        tmp &= 0xFC
+        tmp <<= 3
+        px |= tmp
+        np.copyto(tmp, frame[:, :, blue])
+        tmp >>= 3
+        px |= tmp
+
+    def _push(self):
+        if self.dirty_rows and not self._full_refresh:
+            np.not_equal(self._px, self._prev, out=self._changed)
+            bands = _row_bands(self._changed.any(axis=1), DIRTY_ROW_GAP)
+        else:
+            bands = [(0, self.height)]
+        self._full_refresh = False
+
+        if self.dirty_rows:
+            np.copyto(self._prev, self._px)
+
+        for top, bottom in bands:
+            np.copyto(self._out[top:bottom], self._px[top:bottom])
+            self._set_window(top, bottom)
+            self._write(memoryview(self._out[top:bottom]).cast("B"))
+            self.rows_pushed += bottom - top
+        self.frames += 1
+
+    def _set_window(self, top, bottom):
+        left = self._offset_x
+        right = self._offset_x + self.width - 1
+        top += self._offset_y
+        bottom += self._offset_y - 1
+        self._command(CMD_CASET, left >> 8, left & 0xFF, right >> 8, right & 0xFF)
+        self._command(CMD_RASET, top >> 8, top & 0xFF, bottom >> 8, bottom & 0xFF)
+        self._command(CMD_RAMWR)
+
+    def _command(self, cmd, *args):
+        self._serial.command(cmd)
+        if args:
+            self._serial.data(list(args))
+
+    def _write(self, buf):
+        serial = self._serial
+        size = self.chunk_size
+        self.bytes_pushed += len(buf)
+
+        if hasattr(serial, "write_buffer"):
+            for i in range(0, len(buf), size):
+                serial.write_buffer(buf[i:i + size])
+            return
+
+        spidev = getattr(serial, "_spi", None)
+        if spidev is not None and hasattr(spidev, "writebytes2"):
+            # Raise D/C once, then stream the buffer without building Python lists
+            serial._gpio.output(serial._DC, serial._data_mode)
+            for i in range(0, len(buf), size):
+                spidev.writebytes2(buf[i:i + size])
+        else:
+            serial.data(buf.tolist())
+
+
+def _row_bands(rows, gap):
+    """
+    Turns a per-row "changed" mask into [top, bottom) bands, merging bands
+    separated by fewer than `gap` unchanged rows.
+    """
+    bands = []
+    for row in np.flatnonzero(rows):
+        row = int(row)
+        if bands and row - bands[-1][1] < gap:
+            bands[-1][1] = row + 1
+        else:
+            bands.append([row, row + 1])
+    return [tuple(band) for band in bands]
+
+
+# --- BENCHMARK ---
+
+if __name__ == "__main__":
+    import argparse
+    import cv2
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description="Benchmark the LCD push path against a null SPI bus.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--bus-hz", type=int, default=None, help="Simulate SPI wire time at this bus speed")
+    parser.add_argument("--image", default="testimage.jpeg")
+    args = parser.parse_args()
+
+    source = cv2.resize(cv2.imread(args.image), (128, 128))
+    frames = [np.roll(source, i, axis=1) for i in range(32)]
+    # Mostly static scene with a small moving region, the dirty-row case
+    still = [source.copy() for _ in range(32)]
+    for i, frame in enumerate(still):
+        cv2.rectangle(frame, (i * 3, 40), (i * 3 + 10, 50), (0, 0, 255), -1)
+
+    def run(label, push, clip):
+        start = time.perf_counter()
+        for i in range(args.frames):
+            push(clip[i % len(clip)])
+        elapsed = time.perf_counter() - start
+        print(f"{label:<28} {args.frames / elapsed:8.1f} fps  {elapsed / args.frames * 1000:6.2f} ms/frame")
+
+    legacy = NullDevice(bus_speed_hz=args.bus_hz)
+    run("PIL + luma (legacy)", lambda f: legacy.display(Image.fromarray(cv2.cvtColor(f, cv2.COLOR_BGR2RGB))), frames)
+
+    fast = RGB565Display(NullDevice(bus_speed_hz=args.bus_hz))
+    run("RGB565 full frame", fast.display_bgr, frames)
+
+    dirty = RGB565Display(NullDevice(bus_speed_hz=args.bus_hz), dirty_rows=True)
+    run("RGB565 dirty rows (static)", dirty.display_bgr, still)
+    print(f"dirty rows: {dirty.rows_pushed / dirty.frames:.1f} rows/frame pushed of {dirty.height}")
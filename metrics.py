@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# --- CONFIGURATION ---
+METRICS_ENABLED = os.getenv("VIDEOPI_METRICS", "1") != "0"
+
+# Histogram bucket bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+WINDOW = 256       # Recent samples kept per stage for rolling percentiles
+FPS_WINDOW = 2.0   # Seconds of frame ticks used for the fps gauges
+
+
+# --- PRIMITIVES ---
+
+class StageTimer:
+    """
+    Cumulative histogram (for Prometheus) plus a window of recent samples
+    (for percentiles on the LCD debug overlay).
+    """
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds):
+        index = bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def percentile(self, fraction):
+        samples = sorted(self.recent)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class Metrics:
+    """
+    Process-wide registry for hot-path instrumentation. Every method returns
+    immediately when disabled, so call sites don't need their own checks:
+
+        start = METRICS.now()
+        ...
+        METRICS.observe("resize", start)
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self._ticks = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Drops everything recorded so far (e.g. after a benchmark warm-up).
+        """
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+            self._ticks.clear()
+        self.gauges.clear()
+
+    def now(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe(self, stage, start):
+        """
+        Records the time since `start` (from now()) for `stage`.
+        """
+        if not self.enabled:
+            return
+        self.observe_value(stage, time.perf_counter() - start)
+
+    def observe_value(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            timer = self.stages.get(stage)
+            if timer is None:
+                timer = self.stages[stage] = StageTimer()
+            timer.observe(seconds)
+
+    def incr(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def tick(self, loop):
+        """
+        Counts one frame for `loop` (e.g. "lcd", "web"); fps() reads the rate.
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            ticks = self._ticks.get(loop)
+            if ticks is None:
+                ticks = self._ticks[loop] = deque()
+            ticks.append(now)
+            while ticks and now - ticks[0] > FPS_WINDOW:
+                ticks.popleft()
+
+    def fps(self, loop):
+        ticks = self._ticks.get(loop)
+        if not ticks or len(ticks) < 2:
+            return 0.0
+        span = ticks[-1] - ticks[0]
+        return (len(ticks) - 1) / span if span > 0 else 0.0
+
+    # --- EXPORT ---
+
+    def render_prometheus(self):
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            stages = {name: (list(t.buckets), t.count, t.total) for name, t in self.stages.items()}
+            counters = dict(self.counters)
+            loops = list(self._ticks)
+        gauges = dict(self.gauges)
+
+        if stages:
+            lines.append("# HELP videopi_stage_seconds Time spent per pipeline stage.")
+            lines.append("# TYPE videopi_stage_seconds histogram")
+        for name, (buckets, count, total) in sorted(stages.items()):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'videopi_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'videopi_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'videopi_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'videopi_stage_seconds_count{{stage="{name}"}} {count}')
+
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE videopi_{name}_total counter")
+            lines.append(f"videopi_{name}_total {value}")
+
+        if loops:
+            lines.append("# TYPE videopi_fps gauge")
+        for loop in sorted(loops):
+            lines.append(f'videopi_fps{{loop="{loop}"}} {self.fps(loop):.2f}')
+
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE videopi_{name} gauge")
+            lines.append(f"videopi_{name} {value}")
+
+        lines.append(f"videopi_metrics_enabled {int(self.enabled)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, loop, stages):
+        """
+        Short text lines (fps, then median ms per stage) for the LCD debug overlay.
+        """
+        lines = [f"{loop} {self.fps(loop):4.1f}fps"]
+        with self._lock:
+            timers = {name: self.stages.get(name) for name in stages}
+        for name, timer in timers.items():
+            median = timer.percentile(0.5) if timer else None
+            lines.append(f"{name[:8]:<8}{median * 1000:5.1f}ms" if median is not None else f"{name[:8]:<8}   --")
+        return lines
+
+
+METRICS = Metrics()
+
+_imported_at = time.monotonic()
+
+def process_uptime():
+    """
+    Seconds since this process started, interpreter start-up and imports
+    included (from /proc). Elsewhere: seconds since this module was imported.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split() # The name in (...) may contain spaces
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK") # starttime, in ticks after boot
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - _imported_at
@@ -0,0 +1,422 @@
+import threading
+import time
+import numpy as np
+
+from capture import LatestFrame
+from core import HUB, stream_config
+from decoder import BACKENDS, DEFAULT_BACKEND
+from metrics import METRICS
+from motion import MotionDetector, motion_config
+from overlay import OverlayCache, fill_rect, put_text
+from transform import FrameTransform
+
+# --- CONFIGURATION ---
+MOSAIC_GRID = (2, 2)           # (columns, rows)
+MOSAIC_FPS = 10                # Composition rate; tiles only change when their feed delivers a frame
+# Decode budget: this many tiles decode every frame, the others keyframes only (~1 fps, no P-frames)
+MOSAIC_FULL_RATE_TILES = 1
+MOSAIC_ROTATE_INTERVAL = 5.0   # Seconds each tile holds a full-rate slot in the round-robin
+MOSAIC_MOTION_HOLD = 10.0      # Seconds a tile keeps its slot after its last motion
+MOSAIC_RETRY_DELAY = 5.0       # Seconds before an offline tile is reconnected
+
+TILE_CONNECTING = "connecting"
+TILE_LIVE = "live"
+TILE_OFFLINE = "offline"
+
+
+def grid_cells(size, grid):
+    """
+    (x, y, w, h) of each cell, row by row. Leftover pixels stay black.
+    """
+    width, height = size
+    cols, rows = grid
+    cell_w, cell_h = width // cols, height // rows
+    return [(col * cell_w, row * cell_h, cell_w, cell_h) for row in range(rows) for col in range(cols)]
+
+
+# --- TILE ---
+
+class MosaicTile:
+    """
+    One feed in one cell: a reader that idles in keyframe-only standby unless
+    the scheduler gives it a full-rate slot, and a motion detector used to
+    pick the tile worth watching.
+    """
+
+    def __init__(self, feed, index, cell, canvas, letterbox):
+        self.url = feed['url']
+        self.letterbox = letterbox
+        self.reader = None
+        self.frame = None # Newest full-size frame, for snapshots
+        self.full_rate = False
+        self.retry_at = 0.0
+        self.motion_at = None
+        self.motion = None
+        self.move(cell, canvas)
+        self.relabel(feed, index)
+
+    def move(self, cell, canvas):
+        """
+        Draws into `cell` from now on; the newest frame is redrawn there on the next take_frame().
+        """
+        x, y, w, h = cell
+        self.cell = cell
+        self.view = canvas[y:y + h, x:x + w]
+        self.transform = None
+        self.source_size = None
+        self.last_seq = 0
+
+    def relabel(self, feed, index):
+        """
+        Takes a reloaded feed entry with the same stream: name, position and motion settings.
+        """
+        self.feed = feed
+        self.index = index
+        self.name = feed['name']
+        config = motion_config(feed)
+        self.alerts = config["enabled"]
+        if self.motion is None or self.motion.config != config:
+            # Feeds without a "motion" block still get a detector, it only steers the scheduler
+            self.motion = MotionDetector(config)
+
+    @property
+    def state(self):
+        if self.reader is None or self.reader.done:
+            return TILE_OFFLINE
+        return TILE_LIVE if self.reader.buffer.seq else TILE_CONNECTING
+
+    def connect(self, backend, decoder_options):
+        self.reader = HUB.acquire(self.url, self.name, backend, decoder_options, standby=True,
+                                  capture=self.feed.get('capture'))
+        self.last_seq = 0
+        self.full_rate = False
+        self.motion.reset()
+
+    def set_full_rate(self, enabled):
+        if enabled == self.full_rate or self.reader is None:
+            return
+        self.full_rate = enabled
+        if enabled:
+            self.reader.promote() # Replays the buffered GOP, so the tile catches up at once
+            METRICS.incr("mosaic_promotions")
+        else:
+            self.reader.demote()
+
+    def take_frame(self):
+        """
+        Draws the tile's newest frame into its cell. Returns the frame, or None if there was none.
+        """
+        seq, frame, _ = self.reader.buffer.get(self.last_seq, timeout=0)
+        if frame is None:
+            return None
+        self.last_seq = seq
+        self.frame = frame
+        source_size = (frame.shape[1], frame.shape[0])
+        if source_size != self.source_size:
+            self.transform = FrameTransform(source_size, self.cell[2:], self.letterbox, output=self.view)
+            self.source_size = source_size
+        self.transform.apply(frame)
+        return frame
+
+    def stop(self):
+        if self.reader is not None:
+            self.reader.stop(timeout=0)
+            self.reader = None
+        self.frame = None
+        self.view.fill(0)
+
+
+def render_tiles(layer, grid, labels, states, full_rate, selected, font_scale):
+    """
+    Feed names, offline markers, the full-rate dot and the selection frame;
+    cached per combination, which only changes when the schedule does.
+    """
+    width, height = layer.image.shape[1], layer.image.shape[0]
+    line = max(8, int(26 * font_scale))
+    for i, (x, y, w, h) in enumerate(grid_cells((width, height), grid)[:len(labels)]):
+        fill_rect(layer, (x, y), (x + w - 1, y + line), (0, 0, 0))
+        put_text(layer, labels[i], (x + 2, y + line - 2), font_scale, (0, 255, 0))
+        if full_rate[i]:
+            fill_rect(layer, (x + w - line + 2, y + 2), (x + w - 3, y + line - 3), (0, 0, 255))
+        if states[i] != TILE_LIVE:
+            text = "OFFLINE" if states[i] == TILE_OFFLINE else "..."
+            put_text(layer, text, (x + 4, y + h // 2 + line // 2), font_scale, (0, 255, 255))
+        if i == selected:
+            for pt1, pt2 in (((x, y), (x + w - 1, y)), ((x, y + h - 1), (x + w - 1, y + h - 1)),
+                             ((x, y), (x, y + h - 1)), ((x + w - 1, y), (x + w - 1, y + h - 1))):
+                fill_rect(layer, pt1, pt2, (0, 255, 255))
+
+TILE_OVERLAYS = OverlayCache(render_tiles, max_entries=8)
+
+
+# --- MOSAIC READER ---
+
+class MosaicReader:
+    """
+    Composes one page of feeds into an NxM grid, in a thread of its own.
+    Behaves like a FeedReader (`buffer`, `opened`, `done`, `stop()`), so the
+    LCD loop and the web broadcaster consume it unchanged.
+
+    Decode time is shared out by a scheduler: every tile idles in keyframe-
+    only standby, and MOSAIC_FULL_RATE_TILES slots go to the tiles with the
+    most recent motion, then round-robin to the others.
+    `on_motion(feed, frame, event)` is called for feeds with motion alerts.
+    With a HealthMonitor, offline tiles reconnect once their feed is no
+    longer down instead of after a fixed delay. With selected=None the grid
+    stays on `page` (0-based), as in the web mosaic.
+    """
+    decoder = None # No packets to tap; clips are recorded from single feeds only
+
+    def __init__(self, feeds, grid=MOSAIC_GRID, size=(128, 128), letterbox=False, backend=None,
+                 decoder_options=None, selected=0, fps=MOSAIC_FPS, full_rate_tiles=MOSAIC_FULL_RATE_TILES,
+                 on_motion=None, font_scale=0.3, health=None, page=0):
+        self.feeds = list(feeds)
+        self.grid = tuple(grid)
+        self.size = tuple(size)
+        self.letterbox = letterbox
+        self.backend = backend or DEFAULT_BACKEND
+        self.decoder_options = decoder_options # None: the core defaults
+        self.fps = fps
+        self.full_rate_tiles = full_rate_tiles
+        self.on_motion = on_motion
+        self.health = health
+        self.font_scale = font_scale
+        self.url = f"mosaic:{self.grid[0]}x{self.grid[1]}"
+        self.name = "Mosaic"
+        self.buffer = LatestFrame()
+        self.opened = threading.Event()
+        self.failed = False
+        self.tiles = []
+        self.selected = selected
+        self.page = page # Shown while nothing is selected
+        self._page = None
+        self._turn = 0
+        self._rotate_at = 0.0
+        self._last_key = None
+        self._pending_feeds = None
+        self._canvas = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._cells = grid_cells(self.size, self.grid)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mosaic", daemon=True)
+
+        if not BACKENDS[self.backend].supports_standby:
+            print(f"Mosaic: the {self.backend} backend cannot decode keyframes only, every tile runs at full rate.")
+            self.full_rate_tiles = len(self._cells)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    @property
+    def done(self):
+        return self.buffer.closed
+
+    def wait_opened(self, timeout):
+        return self.opened.wait(timeout)
+
+    def select(self, feed_index):
+        """
+        Highlights a feed (None: no highlight), turning the page if it is on
+        another one. Returns at once.
+        """
+        self.selected = feed_index
+
+    def set_feeds(self, feeds):
+        """
+        Replaces the feed list (feeds.json was reloaded). Applied by the mosaic
+        thread: tiles whose stream is unchanged keep their connection.
+        """
+        self._pending_feeds = list(feeds)
+
+    @property
+    def page_size(self):
+        return len(self._cells)
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self.feeds) // self.page_size))
+
+    def feed_frame(self, feed_index):
+        """
+        The newest full-size frame of a feed on the current page, or None.
+        """
+        for tile in self.tiles:
+            if tile.index == feed_index:
+                return tile.frame
+        return None
+
+    def tile_states(self):
+        return {tile.name: tile.state for tile in self.tiles}
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        next_frame = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                self._apply_feeds()
+                self._set_page(self._page_of(self.selected))
+                self._reconnect(now)
+                self._schedule(now)
+                frame = self._compose(now)
+                if frame is not None:
+                    self.buffer.publish(frame)
+                    self.opened.set()
+
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay <= 0:
+                    next_frame = time.monotonic() # Behind, don't burst to catch up
+                self._stop.wait(max(0.0, delay))
+        finally:
+            for tile in self.tiles:
+                tile.stop()
+            self.buffer.close()
+
+    def _page_of(self, feed_index):
+        if not self.feeds or feed_index is None:
+            return min(self.page if self._page is None else self._page, self.pages - 1)
+        return (feed_index % len(self.feeds)) // self.page_size
+
+    def _set_page(self, page):
+        if page == self._page:
+            return
+        for tile in self.tiles:
+            tile.stop()
+        first = page * self.page_size
+        feeds = self.feeds[first:first + self.page_size]
+        self.tiles = [MosaicTile(feed, first + i, self._cells[i], self._canvas, self.letterbox)
+                      for i, feed in enumerate(feeds)]
+        self._page = page
+        self._turn = 0
+        self._rotate_at = 0.0
+        self._last_key = None
+        print(f"Mosaic: showing {', '.join(tile.name for tile in self.tiles) or 'no feeds'}")
+
+    def _apply_feeds(self):
+        feeds, self._pending_feeds = self._pending_feeds, None
+        if feeds is None:
+            return
+        self.feeds = feeds
+        page = self._page_of(self.selected)
+        first = page * self.page_size
+        page_feeds = feeds[first:first + self.page_size]
+        # Tiles whose stream is still on the page keep their reader, even if they move to another cell
+        kept = {}
+        unused = list(self.tiles)
+        for i, feed in enumerate(page_feeds):
+            for tile in unused:
+                if stream_config(tile.feed) == stream_config(feed):
+                    kept[i] = tile
+                    unused.remove(tile)
+                    break
+        for tile in unused:
+            tile.stop()
+        tiles = []
+        for i, feed in enumerate(page_feeds):
+            tile = kept.get(i)
+            if tile is None:
+                tile = MosaicTile(feed, first + i, self._cells[i], self._canvas, self.letterbox)
+            else:
+                if tile.cell != self._cells[i]:
+                    tile.view.fill(0)
+                    tile.move(self._cells[i], self._canvas)
+                tile.relabel(feed, first + i)
+            tiles.append(tile)
+        self.tiles = tiles
+        self._page = page
+        self._last_key = None
+
+    def _reconnect(self, now):
+        """
+        (Re)starts offline tiles; opening happens in the readers' own threads.
+        """
+        for tile in self.tiles:
+            if not tile.url or (tile.reader is not None and not tile.reader.done):
+                continue
+            if tile.reader is not None:
+                if self.health is not None and tile.reader.failed:
+                    error = "stream dropped" if tile.reader.buffer.seq else "could not open"
+                    self.health.report_failure(tile.url, error, tile.reader)
+                tile.stop()
+                tile.retry_at = now + MOSAIC_RETRY_DELAY
+                METRICS.incr("reconnects")
+            if self.health is not None:
+                if not self.health.is_down(tile.url):
+                    tile.connect(self.backend, self.decoder_options)
+                    self.health.track(tile.reader)
+            elif now >= tile.retry_at:
+                tile.connect(self.backend, self.decoder_options)
+
+    def _schedule(self, now):
+        """
+        Hands out the full-rate slots: most recent motion first, the rest round-robin.
+        """
+        live = [tile for tile in self.tiles if tile.state == TILE_LIVE]
+        if not live:
+            return
+        if now >= self._rotate_at:
+            self._turn = (self._turn + 1) % len(live)
+            self._rotate_at = now + MOSAIC_ROTATE_INTERVAL
+
+        recent = [tile for tile in live if tile.motion_at is not None and now - tile.motion_at < MOSAIC_MOTION_HOLD]
+        # A tile keeps its slot while its motion lasts, so two busy cameras don't take turns every frame
+        chosen = [tile for tile in recent if tile.full_rate]
+        chosen += sorted((tile for tile in recent if not tile.full_rate), key=lambda tile: tile.motion_at, reverse=True)
+        chosen = chosen[:self.full_rate_tiles]
+        for i in range(len(live)):
+            if len(chosen) >= self.full_rate_tiles:
+                break
+            tile = live[(self._turn + i) % len(live)]
+            if tile not in chosen:
+                chosen.append(tile)
+        for tile in self.tiles:
+            tile.set_full_rate(tile in chosen)
+        METRICS.set("mosaic_full_rate_tiles", len(chosen))
+
+    def _compose(self, now):
+        """
+        Returns a new frame if a tile or the overlay changed since the last one, else None.
+        """
+        start = METRICS.now()
+        changed = False
+        for tile in self.tiles:
+            if tile.reader is None:
+                continue
+            frame = tile.take_frame()
+            if frame is None:
+                continue
+            changed = True
+            if tile.motion.due(now):
+                event = tile.motion.update(frame, now)
+                if tile.motion.moving:
+                    tile.motion_at = now
+                if event is not None and tile.alerts and self.on_motion is not None:
+                    self.on_motion(tile.feed, frame, event)
+
+        selected = -1
+        if self.feeds and self.selected is not None:
+            selected = self.selected % len(self.feeds) - self._page * self.page_size
+        key = (self.grid,
+               tuple(tile.name[:12] for tile in self.tiles),
+               tuple(tile.state for tile in self.tiles),
+               tuple(tile.full_rate for tile in self.tiles),
+               selected, self.font_scale)
+        if not changed and key == self._last_key:
+            return None
+        self._last_key = key
+
+        # Tiles are drawn into the clean canvas; the overlay goes on the copy that is handed out
+        for tile in self.tiles:
+            if tile.state != TILE_LIVE:
+                tile.view.fill(0)
+        frame = self._canvas.copy()
+        TILE_OVERLAYS.apply(frame, key)
+        METRICS.observe("mosaic_compose", start)
+        METRICS.tick("mosaic")
+        return frame
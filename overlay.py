@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# --- CONFIGURATION ---
+OVERLAY_CACHE_SIZE = 16
+
+
+# --- LAYER DRAWING HELPERS ---
+# Each helper draws the same primitive into the colour image and the mask,
+# so whatever a render function draws becomes opaque in the overlay.
+
+class Layer:
+    def __init__(self, width, height):
+        self.image = np.zeros((height, width, 3), dtype=np.uint8)
+        self.mask = np.zeros((height, width), dtype=np.uint8)
+
+def fill_rect(layer, pt1, pt2, color):
+    cv2.rectangle(layer.image, pt1, pt2, color, -1)
+    cv2.rectangle(layer.mask, pt1, pt2, 255, -1)
+
+def fill_poly(layer, pts, color):
+    cv2.fillPoly(layer.image, [pts], color)
+    cv2.fillPoly(layer.mask, [pts], 255)
+
+def put_text(layer, text, org, font_scale, color, thickness=1, font=cv2.FONT_HERSHEY_SIMPLEX):
+    cv2.putText(layer.image, text, org, font, font_scale, color, thickness)
+    cv2.putText(layer.mask, text, org, font, font_scale, 255, thickness)
+
+
+# --- PRE-RENDERED OVERLAY ---
+
+class Overlay:
+    """
+    An overlay rendered once: the BGR pixels and a boolean mask, both cropped
+    to the bounding box of what was drawn.
+    """
+
+    def __init__(self, layer):
+        ys, xs = np.nonzero(layer.mask)
+        if len(ys) == 0:
+            self.roi = None
+            return
+        y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+        self.roi = (slice(y0, y1), slice(x0, x1))
+        self.image = np.ascontiguousarray(layer.image[self.roi])
+        self.mask = np.ascontiguousarray(layer.mask[self.roi][:, :, None] > 0)
+
+    def apply(self, frame):
+        """
+        Composites the overlay onto `frame` in place with one masked copy.
+        """
+        if self.roi is not None:
+            np.copyto(frame[self.roi], self.image, where=self.mask)
+        return frame
+
+
+class OverlayCache:
+    """
+    LRU cache of pre-rendered overlays. `render(layer, *key)` draws one
+    overlay state; it is only called the first time a (key, size) is seen.
+    """
+
+    def __init__(self, render, max_entries=OVERLAY_CACHE_SIZE):
+        self.render = render
+        self.max_entries = max_entries
+        self.renders = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, width, height):
+        cache_key = (key, width, height)
+        with self._lock:
+            overlay = self._entries.get(cache_key)
+            if overlay is not None:
+                self._entries.move_to_end(cache_key)
+                return overlay
+
+            layer = Layer(width, height)
+            self.render(layer, *key)
+            overlay = Overlay(layer)
+            self.renders += 1
+
+            self._entries[cache_key] = overlay
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return overlay
+
+    def apply(self, frame, key):
+        height, width = frame.shape[:2]
+        return self.get(key, width, height).apply(frame)
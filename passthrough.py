@@ -0,0 +1,273 @@
+import queue
+import struct
+import threading
+import time
+from collections import deque
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# --- CONFIGURATION ---
+PASSTHROUGH_CODECS = {"h264"}   # What browsers can play from MSE; H.265 falls back to MJPEG
+FRAGMENT_QUEUE_SIZE = 60        # Fragments (one per frame) buffered per client
+PASSTHROUGH_GRACE_PERIOD = 5.0
+INIT_TIMEOUT = 10.0             # How long a new client waits for the stream header
+
+# One fragment per frame keeps latency at a frame; new clients join on a keyframe
+MOVFLAGS = "empty_moov+default_base_moof+frag_every_frame"
+
+
+# --- FRAGMENTED MP4 PARSING ---
+
+class FragmentWriter:
+    """
+    File-like target for the mp4 muxer. Splits the output into the init
+    segment (ftyp + moov) and one media fragment (moof + mdat) per packet.
+    """
+
+    def __init__(self, on_init, on_fragment):
+        self.on_init = on_init
+        self.on_fragment = on_fragment
+        self._buffer = bytearray()
+        self._init = bytearray()
+        self._moof = None
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= 8:
+            size, box_type = struct.unpack(">I4s", self._buffer[:8])
+            if len(self._buffer) < size:
+                break
+            box = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._box(box_type, box)
+        return len(data)
+
+    def _box(self, box_type, box):
+        if box_type in (b"ftyp", b"moov"):
+            self._init += box
+            if box_type == b"moov":
+                self.on_init(bytes(self._init))
+        elif box_type == b"moof":
+            self._moof = box
+        elif box_type == b"mdat" and self._moof is not None:
+            self.on_fragment(self._moof + box)
+            self._moof = None
+
+
+def mime_codec(init_segment):
+    """
+    Builds the MSE type ('video/mp4; codecs="avc1.PPCCLL"') from the avcC box.
+    """
+    index = init_segment.find(b"avcC")
+    if index < 0:
+        return None
+    profile, compat, level = init_segment[index + 5:index + 8]
+    return f'video/mp4; codecs="avc1.{profile:02X}{compat:02X}{level:02X}"'
+
+
+# --- CLIENT ---
+
+class FragmentSubscriber:
+    """
+    One MSE client. Starts on a keyframe; a client that falls FRAGMENT_QUEUE_SIZE
+    fragments behind is dropped back to the next keyframe instead of getting
+    a corrupt stream.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(FRAGMENT_QUEUE_SIZE)
+        self.synced = False
+        self.resyncs = 0
+        self.closed = False
+        self.stream = None
+
+    def offer(self, fragment, keyframe):
+        if not self.synced:
+            if not keyframe:
+                return
+            self.synced = True
+        try:
+            self._queue.put_nowait(fragment)
+        except queue.Full:
+            self.synced = False
+            self.resyncs += 1
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+# --- REMUXER ---
+
+class PassthroughStream:
+    """
+    Remuxes one feed's compressed packets into fragmented MP4 without decoding.
+    """
+
+    def __init__(self, hub, url, name):
+        self.hub = hub
+        self.url = url
+        self.name = name
+        self.subscribers = []
+        self.idle_since = None
+        self.init_segment = None
+        self.mime = None
+        self.codec = None
+        self.fragments = 0
+        self.ready = threading.Event() # Set once the init segment exists or the stream failed
+        self._keyframes = deque()
+        self._thread = threading.Thread(target=self._run, name=f"passthrough-{name}", daemon=True)
+
+    @property
+    def supported(self):
+        return self.init_segment is not None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _on_init(self, init_segment):
+        self.init_segment = init_segment
+        self.mime = mime_codec(init_segment)
+        self.ready.set()
+
+    def _on_fragment(self, fragment):
+        # The muxer flushes a packet's fragment when the next packet arrives, in order
+        keyframe = self._keyframes.popleft() if self._keyframes else False
+        self.fragments += 1
+        with self.hub.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(fragment, keyframe)
+
+    def _run(self):
+        container = None
+        output = None
+        try:
+            container = av.open(self.url, options=self.hub.options, timeout=self.hub.timeout)
+            stream = container.streams.video[0]
+            self.codec = stream.codec_context.name
+            if self.codec not in PASSTHROUGH_CODECS:
+                print(f"Passthrough: {self.name} is {self.codec}, use the MJPEG stream instead")
+                return
+
+            writer = FragmentWriter(self._on_init, self._on_fragment)
+            output = av.open(writer, "w", format="mp4", options={"movflags": MOVFLAGS})
+            if hasattr(output, "add_stream_from_template"):
+                out_stream = output.add_stream_from_template(stream)
+            else:
+                out_stream = output.add_stream(template=stream)
+
+            started = False
+            for packet in container.demux(stream):
+                if self.hub.retire_if_idle(self):
+                    break
+                if packet.dts is None or not packet.size:
+                    continue
+                if not started and not packet.is_keyframe:
+                    continue
+                started = True
+                self._keyframes.append(packet.is_keyframe)
+                packet.stream = out_stream
+                output.mux(packet)
+        except Exception as e:
+            print(f"Passthrough: {self.name} failed: {e}")
+        finally:
+            for closable in (output, container):
+                if closable is not None:
+                    try:
+                        closable.close()
+                    except Exception:
+                        pass
+            self.ready.set()
+            self.hub.retire(self)
+            print(f"Passthrough: released {self.name}")
+
+
+class PassthroughHub:
+    """
+    At most one remuxer per feed URL, started by the first client and stopped
+    PASSTHROUGH_GRACE_PERIOD seconds after the last one leaves.
+    """
+
+    def __init__(self, options=None, timeout=(10.0, 5.0), grace_period=PASSTHROUGH_GRACE_PERIOD):
+        self.options = dict(options or {})
+        self.timeout = timeout
+        self.grace_period = grace_period
+        self.lock = threading.Lock()
+        self.streams = {}
+
+    def subscribe(self, url, name):
+        """
+        Returns a subscriber once the stream header is known. Check
+        subscriber.stream.supported before serving it.
+        """
+        subscriber = FragmentSubscriber()
+        with self.lock:
+            stream = self.streams.get(url)
+            new = stream is None
+            if new:
+                stream = PassthroughStream(self, url, name)
+                self.streams[url] = stream
+            stream.subscribers.append(subscriber)
+            stream.idle_since = None
+            subscriber.stream = stream
+        if new:
+            stream.start()
+        stream.ready.wait(INIT_TIMEOUT)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        stream = subscriber.stream
+        with self.lock:
+            if subscriber in stream.subscribers:
+                stream.subscribers.remove(subscriber)
+            if not stream.subscribers:
+                stream.idle_since = time.monotonic()
+
+    def retire_if_idle(self, stream):
+        with self.lock:
+            if stream.subscribers or stream.idle_since is None:
+                return False
+            if time.monotonic() - stream.idle_since < self.grace_period:
+                return False
+            self._remove(stream)
+            return True
+
+    def retire(self, stream):
+        with self.lock:
+            self._remove(stream)
+            subscribers = list(stream.subscribers)
+            stream.subscribers.clear()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def _remove(self, stream):
+        if self.streams.get(stream.url) is stream:
+            del self.streams[stream.url]
+
+
+def generate_fragments(subscriber):
+    """
+    Yields the init segment followed by the client's fragments (for a streaming HTTP response).
+    """
+    yield subscriber.stream.init_segment
+    while True:
+        fragment = subscriber.get(timeout=1.0)
+        if fragment is None:
+            if subscriber.closed:
+                return
+            continue
+        yield fragment
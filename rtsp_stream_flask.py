@@ -1,15 +1,49 @@
 import cv2
+import socket
+import sys
 import time
-import json
 import numpy as np
 import threading 
-from flask import Flask, Response, redirect, url_for, make_response
+import weakref
+from flask import Flask, Response, redirect, url_for, make_response, request, jsonify
+
+from adaptive import SEND_BUFFER, AdaptiveRate, StreamProfile, Variant, unsent_bytes
+from broadcaster import Broadcaster, Subscriber
+from passthrough import PassthroughHub, generate_fragments
+from overlay import OverlayCache, fill_poly, put_text
+from transform import TransformCache, letterbox_geometry
+from metrics import METRICS
+from mosaic import MosaicReader
+from idle import IDLE
+import core
 
 # --- CONFIGURATION ---
 DISPLAY_WIDTH = 320
 DISPLAY_HEIGHT = 240
-FEEDS_FILE = "feeds.json"
-WAIT_TIME_ON_CYCLE = 1  # CRITICAL: Pause in seconds after feed switch
+FEEDS_FILE = core.FEEDS_FILE # Shared with the LCD (core.py)
+LIVE_CHANNEL = "live"  # All viewers watch the current feed through one long-lived pipeline
+MOSAIC_CHANNEL = "mosaic" # First page; later ones are "mosaic:<page>"
+MOSAIC_URL = "mosaic:"    # Followed by the 0-based page
+MOSAIC_NAME = "Mosaic"
+MOSAIC_GRID = (2, 2)   # One tile decodes at full rate (motion first, else round-robin), the rest keyframes only
+
+DECODER_BACKEND = core.DECODER_BACKEND
+DECODER_OPTIONS = core.DECODER_OPTIONS
+# JPEG-encoded frames per second at most; the decoder may run faster for the LCD (videopi.py)
+WEB_MAX_FPS = 15
+WEB_JPEG_QUALITY = 80
+# Viewers may ask for /video_feed?size=WxH&quality=Q&fps=N; sizes are limited to these
+STREAM_SIZES = ((160, 120), (320, 240), (640, 480), (1280, 720))
+# Each viewer's quality and fps are lowered while its link can't keep up (adaptive.py);
+# False: viewers keep what they asked for and a slow link only skips frames
+WEB_ADAPTIVE = True
+
+# NEXT/PREV skip feeds the background prober found down; False lands on them
+HEALTH_SKIP_DOWN = True
+
+# Requests to any other path count as somebody watching and wake an idle LCD (videopi.py);
+# these are polled by pages and scrapers
+QUIET_PATHS = ("/status", "/health", "/metrics")
 
 # Arrow Button Configuration
 BUTTON_COLOR = (255, 255, 255)
@@ -20,52 +54,40 @@ app = Flask(__name__)
 
 # --- GLOBAL STATE MANAGEMENT ---
 CURRENT_FEED_INDEX = 0 
-STREAM_VERSION = 0 
 FEED_LOCK = threading.Lock() 
 
-# --- Load Feeds from JSON (Same as before) ---
-try:
-    with open(FEEDS_FILE, 'r') as f:
-        STREAM_FEEDS = json.load(f)
-except FileNotFoundError:
-    print(f"FATAL: The configuration file '{FEEDS_FILE}' was not found.")
-    STREAM_FEEDS = []
-except json.JSONDecodeError:
-    print(f"FATAL: Error decoding JSON from '{FEEDS_FILE}'. Check file format.")
-    STREAM_FEEDS = []
+# --- Load Feeds from JSON ---
+# feeds.json is watched while running (see reload_feeds); an invalid edit keeps the last good list
+STREAM_FEEDS = core.load_feeds(FEEDS_FILE)
+WATCHER = core.shared_watcher(STREAM_FEEDS, FEEDS_FILE)
 
+if not STREAM_FEEDS:
+    print("No valid feeds loaded. Waiting for feeds.json to be fixed.")
+    STREAM_FEEDS = [{"name": "No Config", "url": ""}]
 NUM_FEEDS = len(STREAM_FEEDS)
-if NUM_FEEDS == 0:
-    print("FATAL: No valid feeds loaded. Exiting.")
-    exit(1)
 
-# --- Helper Functions (Letterbox and Draw Arrow - Same as before) ---
+# Probes every feed in the background (shared with the LCD in videopi.py); see /health
+HEALTH = core.shared_health(STREAM_FEEDS)
+
+# --- Helper Functions (Letterbox and Overlay) ---
+
+# Geometry is cached per source size and the canvas is reused, see transform.py
+LETTERBOX = TransformCache((DISPLAY_WIDTH, DISPLAY_HEIGHT))
+LETTERBOXES = {(DISPLAY_WIDTH, DISPLAY_HEIGHT): LETTERBOX} # One per STREAM_SIZES entry in use
+DEFAULT_VARIANT = Variant(DISPLAY_WIDTH, DISPLAY_HEIGHT, WEB_JPEG_QUALITY)
 
 def letterbox_frame(frame, target_width, target_height):
-    source_h, source_w = frame.shape[:2]
-    target_aspect = target_width / target_height
-    source_aspect = source_w / source_h
-    
-    if source_aspect > target_aspect:
-        scale_factor = target_width / source_w
-        new_w = target_width
-        new_h = int(source_h * scale_factor)
-        padding_v = (target_height - new_h) // 2
-        padding_h = 0
-    else:
-        scale_factor = target_height / source_h
-        new_h = target_height
-        new_w = int(source_w * scale_factor)
-        padding_h = (target_width - new_w) // 2
-        padding_v = 0
-        
-    resized_image = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    """
+    Letterboxes into a freshly allocated canvas. The streaming path uses
+    LETTERBOX instead, which reuses its buffers.
+    """
+    new_w, new_h, padding_h, padding_v = letterbox_geometry((frame.shape[1], frame.shape[0]), (target_width, target_height))
     canvas = np.zeros((target_height, target_width, 3), dtype=np.uint8)
-    canvas[padding_v:padding_v + new_h, padding_h:padding_h + new_w] = resized_image
-    
+    cv2.resize(frame, (new_w, new_h), dst=canvas[padding_v:padding_v + new_h, padding_h:padding_h + new_w],
+               interpolation=cv2.INTER_LINEAR)
     return canvas, padding_v, padding_h
 
-def draw_arrow(img, center_x, center_y, size, direction, color):
+def draw_arrow(layer, center_x, center_y, size, direction, color):
     pts = []
     if direction == "left":
         pts = np.array([
@@ -80,117 +102,244 @@ def draw_arrow(img, center_x, center_y, size, direction, color):
             (center_x - size//2, center_y + size//2)
         ], np.int32)
 
-    cv2.fillPoly(img, [pts], color)
+    fill_poly(layer, pts, color)
+
+def render_stream_overlay(layer, feed_name, current_time, arrows=True):
+    """
+    Draws the navigation arrows and status line; cached per (feed, second, size).
+    """
+    width, height = layer.image.shape[1], layer.image.shape[0]
+    if arrows:
+        center_y = height // 2
+        left_center_x = BUTTON_MARGIN + BUTTON_SIZE // 2
+        draw_arrow(layer, left_center_x, center_y, BUTTON_SIZE, "left", BUTTON_COLOR)
+        right_center_x = width - BUTTON_MARGIN - BUTTON_SIZE // 2
+        draw_arrow(layer, right_center_x, center_y, BUTTON_SIZE, "right", BUTTON_COLOR)
+
+    put_text(layer, f"{feed_name} | {current_time}", (5, height - 10), 0.5, (0, 255, 0))
+
+STREAM_OVERLAYS = OverlayCache(render_stream_overlay, max_entries=4)
 
 # --- Video Stream Generation ---
 
 def get_current_feed_info():
     with FEED_LOCK:
         feed = STREAM_FEEDS[CURRENT_FEED_INDEX]
-        return feed['url'], feed['name'], STREAM_VERSION
+        return feed['url'], feed['name']
 
-def generate_frames():
-    
-    rtsp_url, feed_name, expected_version = get_current_feed_info()
+def process_frame(frame, feed_name, variant=None):
+    """
+    Letterbox, overlay and JPEG-encode one frame at `variant` (default
+    DEFAULT_VARIANT). Runs once per frame and variant in the shared
+    pipeline, no matter how many viewers are connected.
+    """
+    width, height, quality = variant or DEFAULT_VARIANT
+    letterbox = LETTERBOXES.get((width, height))
+    if letterbox is None:
+        letterbox = LETTERBOXES.setdefault((width, height), TransformCache((width, height)))
+
+    start = METRICS.now()
+    display_frame = letterbox(frame) # Reused buffer, only valid until the next frame
+    METRICS.observe("letterbox", start)
     
-    cap = cv2.VideoCapture(rtsp_url)
+    # Overlay Visual Buttons and Status Text (pre-rendered, re-drawn once per second)
+    start = METRICS.now()
+    current_time = time.strftime("%H:%M:%S")
+    STREAM_OVERLAYS.apply(display_frame, (feed_name, current_time, feed_name != MOSAIC_NAME))
+    METRICS.observe("overlay", start)
+
+    # Encode
+    start = METRICS.now()
+    (flag, encodedImage) = cv2.imencode(".jpg", display_frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    METRICS.observe("encode", start)
     
-    # NEW: Try to connect up to 3 times before giving up
-    for attempt in range(3):
-        print(f"Attempt {attempt+1}: Opening stream {feed_name} (Version: {expected_version})")
-        
-        # Give a moment for connection initialization
-        time.sleep(1) 
-        
-        if cap.isOpened():
-            break
-        
-        # If not opened, try releasing and reconnecting (crucial for resource-constrained systems)
-        if attempt < 2:
-            cap.release()
-            cap = cv2.VideoCapture(rtsp_url)
-        
-    if not cap.isOpened():
-        print(f"FATAL: Could not open video source after 3 attempts: {rtsp_url}")
-        return
-
-    while True:
-        
-        # Check if the global state has been updated
-        with FEED_LOCK:
-            if expected_version != STREAM_VERSION:
-                print(f"Version mismatch detected for {feed_name}. Terminating thread.")
-                break
-        
-        success, frame = cap.read()
-
-        if not success:
-            print(f"Failed to read frame from {feed_name}. Attempting to reconnect...")
-            cap.release()
-            cap = cv2.VideoCapture(rtsp_url)
-            time.sleep(1) 
-            continue 
-
-        # ... (Frame processing and overlay logic remains the same) ...
-        display_frame, _, _ = letterbox_frame(frame, DISPLAY_WIDTH, DISPLAY_HEIGHT)
-        
-        # Overlay Visual Buttons
-        center_y = DISPLAY_HEIGHT // 2
-        left_center_x = BUTTON_MARGIN + BUTTON_SIZE // 2
-        draw_arrow(display_frame, left_center_x, center_y, BUTTON_SIZE, "left", BUTTON_COLOR)
-        right_center_x = DISPLAY_WIDTH - BUTTON_MARGIN - BUTTON_SIZE // 2
-        draw_arrow(display_frame, right_center_x, center_y, BUTTON_SIZE, "right", BUTTON_COLOR)
-        
-        # Add Status Text
-        current_time = time.strftime("%H:%M:%S")
-        cv2.putText(
-            img=display_frame,
-            text=f"{feed_name} | {current_time}",
-            org=(5, DISPLAY_HEIGHT - 10),
-            fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-            fontScale=0.5,
-            color=(0, 255, 0),
-            thickness=1
-        )
-
-        # Encode and Yield
-        (flag, encodedImage) = cv2.imencode(".jpg", display_frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-        
-        if not flag:
-            continue
-
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + bytearray(encodedImage) + b'\r\n')
-
-    # CRITICAL: Release the capture object when the loop is broken
-    cap.release()
-    print(f"Stream resources released for: {feed_name}")
-
-# --- Flask Navigation Routes (Modified) ---
+    if not flag:
+        return None
+    METRICS.tick("web")
+    return encodedImage.tobytes()
 
-def cycle_feed(direction):
+MOSAIC_READERS = weakref.WeakSet() # Running mosaic sources, told about feeds.json reloads
+
+def open_mosaic(url, name):
+    """
+    Source for a mosaic channel: one page of feeds letterboxed into a grid at the stream size.
     """
-    Handles the cycling logic: updates index, increments version, and WAITS.
+    reader = MosaicReader(STREAM_FEEDS, MOSAIC_GRID, (DISPLAY_WIDTH, DISPLAY_HEIGHT), letterbox=True,
+                          backend=DECODER_BACKEND, decoder_options=DECODER_OPTIONS, selected=None,
+                          font_scale=0.4, health=HEALTH, page=int(url[len(MOSAIC_URL):] or 0))
+    MOSAIC_READERS.add(reader)
+    return reader.start()
+
+BROADCASTER = Broadcaster(process_frame, DECODER_BACKEND, DECODER_OPTIONS,
+                          sources={MOSAIC_URL: open_mosaic}, health=HEALTH, max_fps=WEB_MAX_FPS)
+PASSTHROUGH = PassthroughHub()
+
+def reload_feeds(feeds):
+    """
+    Watcher listener: swaps in the new feed list, staying on the current feed
+    if it is still configured. The live channel only reconnects when its
+    stream changed; the mosaic reconnects only the tiles that did.
+    """
+    global STREAM_FEEDS, NUM_FEEDS, CURRENT_FEED_INDEX
+
+    with FEED_LOCK:
+        current = STREAM_FEEDS[CURRENT_FEED_INDEX]
+        CURRENT_FEED_INDEX = core.remap_index(STREAM_FEEDS, feeds, CURRENT_FEED_INDEX)
+        STREAM_FEEDS, NUM_FEEDS = feeds, len(feeds)
+        feed = STREAM_FEEDS[CURRENT_FEED_INDEX]
+
+    BROADCASTER.switch(LIVE_CHANNEL, feed['url'], feed['name'],
+                       restart=core.stream_config(feed) != core.stream_config(current), capture=feed.get('capture'))
+    for reader in list(MOSAIC_READERS):
+        reader.set_feeds(feeds)
+
+WATCHER.add_listener(reload_feeds)
+
+MJPEG_MIMETYPE = "multipart/x-mixed-replace; boundary=frame"
+
+def mjpeg_part(encoded):
+    """
+    One part of the multipart MJPEG response for an EncodedFrame.
+    """
+    # X-Timestamp (monotonic decode time) lets a client on the same host measure latency
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            b'Content-Length: %d\r\n'
+            b'X-Timestamp: %.6f\r\n\r\n' % (len(encoded.data), encoded.timestamp) + encoded.data + b'\r\n')
+
+def channel_source(channel):
     """
-    global CURRENT_FEED_INDEX, STREAM_VERSION
+    (url, name, capture settings) a channel's pipeline starts on.
+    """
+    if channel == MOSAIC_CHANNEL or channel.startswith(MOSAIC_CHANNEL + ":"):
+        page = channel[len(MOSAIC_CHANNEL) + 1:] or "0"
+        return MOSAIC_URL + page, MOSAIC_NAME, None
+    with FEED_LOCK:
+        feed = STREAM_FEEDS[CURRENT_FEED_INDEX]
+        return feed['url'], feed['name'], feed.get('capture')
+
+def mosaic_pages():
+    """
+    (page count, feeds per page) of the web mosaic.
+    """
+    per_page = MOSAIC_GRID[0] * MOSAIC_GRID[1]
+    return max(1, -(-NUM_FEEDS // per_page)), per_page
+
+def mosaic_page(args):
+    """
+    The 0-based mosaic page a viewer asked for with ?page= (1-based, default 1).
+    Raises ValueError with a readable reason.
+    """
+    pages = mosaic_pages()[0]
+    page = int(args.get("page", 1))
+    if not 1 <= page <= pages:
+        raise ValueError(f"page must be between 1 and {pages}")
+    return page - 1
+
+def mosaic_channel(page):
+    return MOSAIC_CHANNEL if page == 0 else f"{MOSAIC_CHANNEL}:{page}"
+
+def stream_profile(args):
+    """
+    The StreamProfile a viewer asked for with ?size=WxH, ?quality= and ?fps=
+    (each optional). Raises ValueError with a readable reason.
+    """
+    (width, height, quality), fps = DEFAULT_VARIANT, BROADCASTER.max_fps
+    if "size" in args:
+        sizes = {f"{w}x{h}": (w, h) for w, h in STREAM_SIZES}
+        if args["size"].lower() not in sizes:
+            raise ValueError("size must be one of " + ", ".join(sizes))
+        width, height = sizes[args["size"].lower()]
+    if "quality" in args:
+        quality = int(args["quality"])
+        if not 10 <= quality <= 95:
+            raise ValueError("quality must be between 10 and 95")
+        quality -= quality % 5 # Steps of 5, so more viewers share an encode
+    if "fps" in args:
+        requested = float(args["fps"])
+        if not 0 < requested <= (fps or requested):
+            raise ValueError(f"fps must be above 0 and at most {fps:g}")
+        fps = requested
+    return StreamProfile(Variant(width, height, quality), fps)
+
+def generate_frames(channel=LIVE_CHANNEL, profile=None, sock=None):
+    """
+    One viewer's MJPEG parts at `profile` (default: stream_profile({})),
+    adapted to how fast the viewer's socket `sock` takes them.
+    """
+    rtsp_url, feed_name, capture = channel_source(channel)
+    pacer = AdaptiveRate(profile or stream_profile({}), WEB_ADAPTIVE)
+    if sock is not None:
+        # A small kernel buffer makes a slow link block the send, which the pacer measures
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+
+    # Join (or start) the channel's pipeline; feed switches happen inside it, the connection stays open
+    subscriber = BROADCASTER.subscribe(channel, rtsp_url, feed_name, Subscriber(*pacer.profile), capture)
+    print(f"Viewer joined ({feed_name})")
+
+    dropped = 0
+    try:
+        while True:
+            encoded = subscriber.get(timeout=1.0)
+            if encoded is None:
+                if subscriber.closed:
+                    break # Pipeline could not open or was shut down
+                continue
+
+            # The server writes the part before asking for the next one, so this times the send
+            start = time.monotonic()
+            yield mjpeg_part(encoded)
+            now = time.monotonic()
+            skipped, dropped = subscriber.dropped - dropped, subscriber.dropped
+            if pacer.sent(len(encoded.data), now - start, now - encoded.timestamp, skipped, unsent_bytes(sock)):
+                subscriber.set_profile(*pacer.profile)
+    finally:
+        # CRITICAL: Leave the pipeline; it is released once the last viewer is gone
+        BROADCASTER.unsubscribe(subscriber)
+        print(f"Viewer left (dropped {subscriber.dropped} frames)")
+
+# --- Flask Navigation Routes ---
+
+def get_status():
+    with FEED_LOCK:
+        index, feed, count = CURRENT_FEED_INDEX, STREAM_FEEDS[CURRENT_FEED_INDEX], NUM_FEEDS
+    with BROADCASTER.lock:
+        pipeline = BROADCASTER.pipelines.get(LIVE_CHANNEL)
+    latency = pipeline.last_switch_latency if pipeline else None
+    return {
+        "index": index,
+        "name": feed['name'],
+        "state": HEALTH.state(feed['url']),
+        "count": count,
+        "showing": pipeline.name if pipeline else None,
+        "switch_latency_ms": round(latency * 1000) if latency is not None else None,
+        "idle": IDLE.stats(),
+    }
+
+def switch_feed(direction):
+    """
+    Handles the cycling logic: updates the index and tells the live pipeline to
+    switch source. Returns immediately; viewers keep their connection.
+    """
+    global CURRENT_FEED_INDEX
     
-    # 1. Update state and signal termination
     with FEED_LOCK:
-        if direction == 'next':
-            CURRENT_FEED_INDEX = (CURRENT_FEED_INDEX + 1) % NUM_FEEDS
-        elif direction == 'prev':
-            CURRENT_FEED_INDEX = (CURRENT_FEED_INDEX - 1) % NUM_FEEDS
-        
-        STREAM_VERSION += 1
+        step = 1 if direction == 'next' else -1
+        if HEALTH_SKIP_DOWN:
+            CURRENT_FEED_INDEX = HEALTH.next_index(STREAM_FEEDS, CURRENT_FEED_INDEX, step)
+        else:
+            CURRENT_FEED_INDEX = (CURRENT_FEED_INDEX + step) % NUM_FEEDS
+        feed = STREAM_FEEDS[CURRENT_FEED_INDEX]
     
     print(f"Switched to {direction.upper()} feed. New index: {CURRENT_FEED_INDEX}")
+    BROADCASTER.switch(LIVE_CHANNEL, feed['url'], feed['name'], capture=feed.get('capture'))
 
-    # 2. CRITICAL FIX: Pause the current thread to give the old streaming thread 
-    # time to see the version change, break its loop, and call cap.release().
-    print(f"Pausing for {WAIT_TIME_ON_CYCLE}s for graceful cleanup...")
-    time.sleep(WAIT_TIME_ON_CYCLE) 
-    
-    # 3. Redirect to force the browser to establish a new connection
+def cycle_feed(direction):
+    switch_feed(direction)
+
+    # The page switches via fetch(); plain links still get a redirect (no reconnect needed either way)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(get_status())
     return redirect(url_for('index'))
 
 @app.route("/prev")
@@ -201,57 +350,316 @@ def prev_feed():
 def next_feed():
     return cycle_feed('next')
 
-@app.route("/video_feed")
-def video_feed():
-    return Response(generate_frames(),
-                    mimetype = "multipart/x-mixed-replace; boundary=frame")
+def mjpeg_response(channel):
+    try:
+        profile = stream_profile(request.args)
+    except ValueError as e:
+        return make_response(f"Bad stream parameters: {e}", 400)
+    response = Response(generate_frames(channel, profile, request.environ.get("werkzeug.socket")),
+                        mimetype=MJPEG_MIMETYPE)
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
+    return response
 
-@app.route("/")
-def index():
+@app.route("/video_feed")
+def video_feed():
+    return mjpeg_response(LIVE_CHANNEL)
+
+@app.route("/mosaic_feed")
+def mosaic_feed():
+    try:
+        page = mosaic_page(request.args)
+    except ValueError as e:
+        return make_response(f"Bad page: {e}", 400)
+    return mjpeg_response(mosaic_channel(page))
+
+@app.route("/stream.mp4")
+def passthrough_stream():
+    """
+    The current feed's H.264 packets remuxed into fragmented MP4 for MSE,
+    without decoding. 415 tells the /live page to fall back to MJPEG.
+    """
+    rtsp_url, feed_name = get_current_feed_info()
+    subscriber = PASSTHROUGH.subscribe(rtsp_url, feed_name)
+    stream = subscriber.stream
+
+    if not stream.supported or not stream.mime:
+        PASSTHROUGH.unsubscribe(subscriber)
+        return make_response(f"{feed_name} ({stream.codec or 'unavailable'}) cannot be passed through", 415)
+
+    def generate():
+        try:
+            yield from generate_fragments(subscriber)
+        finally:
+            PASSTHROUGH.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype="video/mp4")
+    response.headers['X-Mime-Type'] = stream.mime
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    return response
+
+@app.before_request
+def note_activity():
+    if request.path not in QUIET_PATHS:
+        IDLE.activity("http")
+
+@app.route("/status")
+def status():
+    return jsonify(get_status())
+
+@app.route("/wake")
+def wake():
+    """
+    Wakes an idle LCD (any non-polling request does); returns the idle state and time per state.
+    """
+    return jsonify(IDLE.stats())
+
+@app.route("/health")
+def health():
+    """
+    The feed health table: state, seconds since last seen, open and probe latency, backoff.
+    """
+    return jsonify({"feeds": HEALTH.table()})
+
+def render_metrics():
+    with BROADCASTER.lock:
+        viewers = sum(len(p.subscribers) for p in BROADCASTER.pipelines.values())
+    METRICS.set("web_viewers", viewers)
+    IDLE.stats() # Refreshes the per-state seconds
+    return METRICS.render_prometheus()
+
+@app.route("/metrics")
+def metrics():
+    """
+    Per-stage timings, fps, drops and reconnects in Prometheus text format.
+    """
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+def index_html(passthrough=True):
     """
     A simple HTML page to embed the video feed and the navigation links.
-    Now includes anti-caching headers.
+    Switching uses fetch() so the video connection is never reloaded.
     """
-    _, feed_name, current_version = get_current_feed_info()
+    with FEED_LOCK:
+        feed_name, index, count = STREAM_FEEDS[CURRENT_FEED_INDEX]['name'], CURRENT_FEED_INDEX, NUM_FEEDS
     
     navigation_links = """
         <div style="margin-top: 15px;">
-            <a href="/prev" style="margin-right: 50px; font-size: 1.2em;">&lt;&lt; PREV</a>
-            <a href="/next" style="font-size: 1.2em;">NEXT &gt;&gt;</a>
+            <a href="/prev" onclick="return cycle('/prev')" style="margin-right: 50px; font-size: 1.2em;">&lt;&lt; PREV</a>
+            <a href="/next" onclick="return cycle('/next')" style="font-size: 1.2em;">NEXT &gt;&gt;</a>
         </div>
     """
+
+    script = """
+        <script>
+        function show(status) {
+            document.getElementById('title').textContent =
+                `Live Feed: ${status.name} (Index: ${status.index}/${status.count - 1})` +
+                (status.state === 'down' ? ' [OFFLINE]' : '');
+            if (status.switch_latency_ms !== null) {
+                document.getElementById('latency').textContent = `Last switch: ${status.switch_latency_ms} ms`;
+            }
+        }
+        function cycle(path) {
+            fetch(path, {headers: {'Accept': 'application/json'}}).then(r => r.json()).then(show);
+            // Latency is known once the new feed's first frame is out
+            setTimeout(() => fetch('/status').then(r => r.json()).then(show), 1500);
+            return false;
+        }
+        </script>
+    """
     
     html_content = f"""
     <html>
       <head>
         <title>RPI Doorbell - Stream Navigation PoC</title>
         <style>body {{ background-color: #333; color: white; text-align: center; }}</style>
+        {script}
       </head>
       <body>
-        <h1>Live Feed: {feed_name} (Index: {CURRENT_FEED_INDEX}/{NUM_FEEDS - 1})</h1>
+        <h1 id="title">Live Feed: {feed_name} (Index: {index}/{count - 1})</h1>
         <div style="border: 2px solid red; display: inline-block;">
             <img src="/video_feed" width="{DISPLAY_WIDTH}" height="{DISPLAY_HEIGHT}">
         </div>
         {navigation_links}
-        <p style="margin-top: 20px;">Stream Version: {current_version}</p>
+        <p id="latency" style="margin-top: 20px;"></p>
+        {'<p><a href="/live" style="color: #8cf;">H.264 passthrough view</a></p>' if passthrough else ''}
+        <p><a href="/mosaic" style="color: #8cf;">All cameras</a></p>
       </body>
     </html>
     """
-    
+    return html_content
+
+@app.route("/")
+def index():
+    """
+    The index page, with anti-caching headers.
+    """
     # CRITICAL FIX: Create a response object for the main route and add anti-caching headers
-    response = make_response(html_content)
+    response = make_response(index_html())
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     
     return response
 
+def mosaic_html(page=0):
+    """
+    One page of feeds at once, with links to the others. The red dot marks
+    the tile that currently decodes at full rate; the others update on keyframes.
+    """
+    pages, per_page = mosaic_pages()
+    with FEED_LOCK:
+        shown = [feed['name'] for feed in STREAM_FEEDS[page * per_page:(page + 1) * per_page]]
+    first = page * per_page + 1
+    heading = f"Cameras {first}-{first + len(shown) - 1} of {NUM_FEEDS}" if pages > 1 else f"All cameras ({NUM_FEEDS})"
+    links = " ".join(f'<a href="/mosaic?page={p + 1}" style="color: #8cf;">{p + 1}</a>' if p != page else f"<b>{p + 1}</b>"
+                     for p in range(pages))
+    pager = f"<p>Page {links}</p>" if pages > 1 else ""
+    return f"""
+    <html>
+      <head>
+        <title>RPI Doorbell - {heading}</title>
+        <style>body {{ background-color: #333; color: white; text-align: center; }}</style>
+      </head>
+      <body>
+        <h1>{heading}</h1>
+        <p>{", ".join(shown)}</p>
+        <div style="border: 2px solid red; display: inline-block;">
+            <img src="/mosaic_feed?page={page + 1}" width="{DISPLAY_WIDTH * 2}" height="{DISPLAY_HEIGHT * 2}">
+        </div>
+        {pager}
+        <p><a href="/" style="color: #8cf;">Single camera view</a></p>
+      </body>
+    </html>
+    """
+
+@app.route("/mosaic")
+def mosaic():
+    try:
+        page = mosaic_page(request.args)
+    except ValueError as e:
+        return make_response(f"Bad page: {e}", 400)
+    response = make_response(mosaic_html(page))
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response.headers['Pragma'] = 'no-cache'
+    response.headers['Expires'] = '0'
+    return response
+
+@app.route("/live")
+def live():
+    """
+    Passthrough player: plays /stream.mp4 through Media Source Extensions.
+    The feed name, clock and arrows are drawn by the page instead of on the Pi.
+    Falls back to the MJPEG page when the codec or browser can't do it.
+    """
+    html_content = f"""
+    <html>
+      <head>
+        <title>RPI Doorbell - Live (passthrough)</title>
+        <style>
+          body {{ background-color: #333; color: white; text-align: center; }}
+          #view {{ position: relative; display: inline-block; border: 2px solid red; }}
+          #view video {{ display: block; background: black; }}
+          .arrow {{ position: absolute; top: 50%; transform: translateY(-50%); font-size: 2em;
+                    color: white; text-decoration: none; padding: 0 {BUTTON_MARGIN}px; }}
+          #label {{ position: absolute; left: 5px; bottom: 5px; color: #0f0; font-family: sans-serif; }}
+        </style>
+      </head>
+      <body>
+        <h1 id="title">Live Feed</h1>
+        <div id="view">
+          <video id="video" width="{DISPLAY_WIDTH * 2}" height="{DISPLAY_HEIGHT * 2}" muted autoplay playsinline></video>
+          <a class="arrow" style="left: 0;" href="#" onclick="return cycle('/prev')">&#9664;</a>
+          <a class="arrow" style="right: 0;" href="#" onclick="return cycle('/next')">&#9654;</a>
+          <span id="label"></span>
+        </div>
+        <p><a href="/" style="color: #8cf;">MJPEG view</a></p>
+        <script>
+        const MAX_LAG = 1.0;   // seconds behind the live edge before we jump forward
+        const KEEP = 10;       // seconds of buffer to keep
+        let feedName = '';
+        let controller = null;
+
+        setInterval(() => {{
+            document.getElementById('label').textContent = `${{feedName}} | ${{new Date().toLocaleTimeString()}}`;
+        }}, 250);
+
+        function showStatus(status) {{
+            feedName = status.name;
+            document.getElementById('title').textContent =
+                `Live Feed: ${{status.name}} (Index: ${{status.index}}/${{status.count - 1}})`;
+        }}
+
+        function cycle(path) {{
+            fetch(path, {{headers: {{'Accept': 'application/json'}}}}).then(r => r.json()).then(s => {{ showStatus(s); play(); }});
+            return false;
+        }}
+
+        async function play() {{
+            if (controller) controller.abort();
+            controller = new AbortController();
+            const video = document.getElementById('video');
+            const response = await fetch('/stream.mp4', {{signal: controller.signal}});
+            const mime = response.headers.get('X-Mime-Type');
+            if (!response.ok || !window.MediaSource || !MediaSource.isTypeSupported(mime)) {{
+                window.location = '/';
+                return;
+            }}
+
+            const source = new MediaSource();
+            video.src = URL.createObjectURL(source);
+            await new Promise(resolve => source.addEventListener('sourceopen', resolve, {{once: true}}));
+            const buffer = source.addSourceBuffer(mime);
+            const pending = [];
+            const pump = () => {{
+                if (buffer.updating) return;
+                const ranges = buffer.buffered;
+                if (ranges.length) {{
+                    const end = ranges.end(ranges.length - 1);
+                    if (end - video.currentTime > MAX_LAG || video.currentTime < ranges.start(0)) {{
+                        video.currentTime = Math.max(ranges.start(ranges.length - 1), end - 0.1);
+                    }}
+                    if (end - ranges.start(0) > 2 * KEEP) {{
+                        buffer.remove(0, end - KEEP);
+                        return;
+                    }}
+                }}
+                if (pending.length) buffer.appendBuffer(pending.shift());
+            }};
+            buffer.addEventListener('updateend', pump);
+
+            const reader = response.body.getReader();
+            video.play().catch(() => {{}});
+            while (true) {{
+                const {{value, done}} = await reader.read();
+                if (done) break;
+                pending.push(value);
+                pump();
+            }}
+        }}
+
+        fetch('/status').then(r => r.json()).then(showStatus);
+        play();
+        </script>
+      </body>
+    </html>
+    """
+
+    response = make_response(html_content)
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response.headers['Pragma'] = 'no-cache'
+    response.headers['Expires'] = '0'
+    return response
+
 if __name__ == '__main__':
     print(f"--- Loaded {NUM_FEEDS} streams from {FEEDS_FILE} ---")
     print(f"Starting at Stream: {STREAM_FEEDS[CURRENT_FEED_INDEX]['name']}")
     print("Access the video stream at: http://<your-pi-ip>:8080/")
-    
-    app.run(host='0.0.0.0', port='8080', debug=False, threaded=True)
\ No newline at end of file
+
+    # Web only; `python videopi.py` also drives the LCD from the same decoders. videopi
+    # imports this module by name: hand it this one rather than a second copy with its own hub
+    sys.modules.setdefault("rtsp_stream_flask", sys.modules[__name__])
+    import videopi
+    videopi.main(["--no-lcd"])
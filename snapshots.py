@@ -0,0 +1,920 @@
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from urllib.parse import unquote, urlsplit, urlunsplit
+
+import cv2
+
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org") # Point at a stand-in server to test
+SNAPSHOT_QUEUE_SIZE = 4       # Jobs waiting for the worker; more are dropped
+COALESCE_WINDOW = 3.0         # Presses for the same feed within this many seconds become one snapshot
+SNAPSHOT_JPEG_QUALITY = 90
+REQUEST_TIMEOUT = (5.0, 30.0) # (connect, read) seconds
+UPLOAD_CHUNK = 64 * 1024      # Bytes of a clip read from disk at a time while uploading
+SPOOL_DIR = os.getenv("VIDEOPI_SPOOL", "/var/tmp/videopi-spool") # Survives reboots, unlike /tmp
+SPOOL_LIMIT = 50              # Oldest spooled snapshots are discarded beyond this
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 600.0
+
+# Full-resolution snapshots from a feed's "snapshot_url" (HTTP JPEG endpoint or main RTSP stream)
+SNAPSHOT_FETCH_TIMEOUT = 4.0  # Hard limit per fetch; after it the display frame is sent instead
+SNAPSHOT_MAX_BYTES = 8 * 1024 * 1024
+SNAPSHOT_READ_SIZE = 16 * 1024 # Bytes per read; the deadline is checked before each one
+SNAPSHOT_STREAM_LINGER = 30.0 # Seconds a snapshot stream stays open (keyframes only) for the next one
+
+# Job results
+SENT = "sent"
+SPOOLED = "spooled"   # Network down, kept on disk and retried with backoff
+FAILED = "failed"     # Rejected by the API (bad token, chat id, ...) or no credentials
+DROPPED = "dropped"   # Queue full
+COALESCED = "coalesced"
+
+
+class RetryableError(Exception):
+    """
+    The request may succeed later (connection error, timeout, 5xx, 429).
+    """
+
+
+class SnapshotSourceError(Exception):
+    """
+    A snapshot_url gave no usable image in time.
+    """
+
+
+# --- TELEGRAM CLIENT ---
+
+class TelegramClient:
+    """
+    Minimal Bot API client on a persistent requests.Session, so repeated
+    sends reuse one keep-alive TLS connection. requests is only imported
+    with the first send, which keeps it off the start-up path.
+    """
+
+    def __init__(self, token, chat_id, api_url=TELEGRAM_API_URL, timeout=REQUEST_TIMEOUT):
+        self.token = token
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    @classmethod
+    def from_env(cls, api_url=None):
+        """
+        Returns a client for TELEGRAM_BOT_TOKEN / TELEGRAM_CHATID, or None if either is missing.
+        """
+        token = os.getenv("TELEGRAM_BOT_TOKEN")
+        chat_id = os.getenv("TELEGRAM_CHATID")
+        if not token or not chat_id:
+            return None
+        return cls(token, chat_id, api_url or os.getenv("TELEGRAM_API_URL", TELEGRAM_API_URL))
+
+    def send_photo(self, jpeg, caption):
+        self._post("sendPhoto", data={"chat_id": self.chat_id, "caption": caption},
+                   files={"photo": ("snapshot.jpg", jpeg, "image/jpeg")})
+
+    def send_video(self, path, caption):
+        """
+        Uploads the MP4 file at `path`, read from disk as it goes out.
+        """
+        body = MultipartFile({"chat_id": self.chat_id, "caption": caption, "supports_streaming": "true"},
+                             "video", "clip.mp4", path, "video/mp4")
+        try:
+            self._post("sendVideo", data=body, headers={"Content-Type": body.content_type})
+        finally:
+            body.close()
+
+    def send_message(self, text):
+        self._post("sendMessage", data={"chat_id": self.chat_id, "text": text})
+
+    def _post(self, method, **kwargs):
+        import requests
+
+        url = f"{self.api_url}/bot{self.token}/{method}"
+        try:
+            response = self.session.post(url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise RetryableError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(f"HTTP {response.status_code}: {response.text[:200]}")
+        # Other errors (401, 400 bad chat id, ...) won't fix themselves, raise_for_status reports them
+        response.raise_for_status()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class MultipartFile:
+    """
+    A multipart/form-data body of `fields` plus the file at `path`, which is
+    read in chunks while requests sends it instead of being loaded whole.
+    """
+
+    def __init__(self, fields, name, filename, path, content_type):
+        boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = "".join(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+                       for key, value in fields.items())
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f"Content-Type: {content_type}\r\n\r\n")
+        self._head = head.encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._file = open(path, "rb")
+        self._length = len(self._head) + os.fstat(self._file.fileno()).st_size + len(self._tail)
+        self._parts = [self._head, self._file, self._tail]
+
+    def __len__(self):
+        return self._length # Lets requests send a Content-Length instead of chunking
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(UPLOAD_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        while self._parts:
+            part = self._parts[0]
+            if isinstance(part, bytes):
+                chunk = part if size < 0 else part[:size]
+                rest = part[len(chunk):]
+                if rest:
+                    self._parts[0] = rest
+                else:
+                    self._parts.pop(0)
+            else:
+                chunk = part.read(size)
+                if not chunk:
+                    self._parts.pop(0)
+                    continue
+            return chunk
+        return b""
+
+    def close(self):
+        self._file.close()
+
+
+# --- SNAPSHOT SOURCES ---
+
+class SnapshotSource:
+    """
+    Fetches one full-resolution JPEG from a feed's snapshot_url, within
+    `timeout` seconds in total. Called from the snapshot worker only.
+
+    * http(s):// - GET on a keep-alive session (one pooled connection per
+      camera); credentials in the URL are sent as basic auth, or as digest
+      auth once the camera asks for it. The body is read one socket read at
+      a time with the time left as its timeout, so a camera trickling bytes
+      can't hold the worker past the deadline.
+    * anything else (the camera's main RTSP stream) - opened through the
+      shared hub; it then stays open for `linger` seconds, keyframes only,
+      so a burst of motion snapshots doesn't reconnect every time.
+    """
+
+    def __init__(self, timeout=SNAPSHOT_FETCH_TIMEOUT, linger=SNAPSHOT_STREAM_LINGER):
+        self.timeout = timeout
+        self.linger = linger
+        self._session = None
+        self._auth = {} # host -> HTTPDigestAuth, which keeps the camera's nonce between snapshots
+        self._streams = {} # url -> (tap, timer)
+        self._lock = threading.Lock()
+
+    def fetch(self, url):
+        start = METRICS.now()
+        try:
+            if urlsplit(url).scheme in ("http", "https"):
+                return self._fetch_http(url)
+            return self._fetch_stream(url)
+        finally:
+            METRICS.observe("snapshot_fetch", start)
+
+    def close(self):
+        with self._lock:
+            streams, self._streams = self._streams, {}
+        for tap, timer in streams.values():
+            timer.cancel()
+            tap.stop()
+        if self._session is not None:
+            self._session.close()
+
+    # --- http ---
+
+    def _fetch_http(self, url):
+        import requests
+        from requests.auth import HTTPBasicAuth, HTTPDigestAuth
+
+        if self._session is None:
+            self._session = requests.Session()
+        parts = urlsplit(url)
+        auth = None
+        if parts.username is not None:
+            user, password = unquote(parts.username), unquote(parts.password or "")
+            auth = self._auth.get(parts.hostname) or HTTPBasicAuth(user, password)
+            url = urlunsplit(parts._replace(netloc=parts.netloc.rsplit("@", 1)[1]))
+
+        deadline = time.monotonic() + self.timeout
+        try:
+            response = self._get(url, auth, deadline)
+            if response.status_code == 401 and isinstance(auth, HTTPBasicAuth) \
+                    and "digest" in response.headers.get("WWW-Authenticate", "").lower():
+                response.close()
+                auth = self._auth[parts.hostname] = HTTPDigestAuth(auth.username, auth.password)
+                response = self._get(url, auth, deadline)
+            with response:
+                if response.status_code != 200:
+                    raise SnapshotSourceError(f"HTTP {response.status_code}")
+                data = self._read(response, deadline)
+        except SnapshotSourceError:
+            raise
+        except Exception as e: # requests, urllib3 and socket errors alike: the display frame goes instead
+            if time.monotonic() >= deadline:
+                raise SnapshotSourceError(f"no complete image within {self.timeout:g}s") from e
+            raise SnapshotSourceError(str(e) or type(e).__name__) from e
+        if not data.startswith(b"\xff\xd8"):
+            raise SnapshotSourceError("not a JPEG")
+        return bytes(data)
+
+    def _get(self, url, auth, deadline):
+        remaining = self._remaining(deadline)
+        # (connect, read) timeouts for getting the headers; the body is read against the deadline
+        return self._session.get(url, auth=auth, stream=True, timeout=(remaining, remaining))
+
+    def _read(self, response, deadline):
+        """
+        The body of a streamed response, or SnapshotSourceError at the deadline.
+        """
+        raw = response.raw
+        read = getattr(raw, "read1", raw.read) # One socket read per call where urllib3 has read1
+        data = bytearray()
+        while True:
+            remaining = self._remaining(deadline)
+            sock = _socket_of(response) # Gone once http.client has read to the end
+            if sock is not None:
+                sock.settimeout(remaining)
+            chunk = read(SNAPSHOT_READ_SIZE, decode_content=True)
+            if not chunk:
+                return data
+            data += chunk
+            if len(data) > SNAPSHOT_MAX_BYTES:
+                raise SnapshotSourceError("image too large")
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise SnapshotSourceError(f"no complete image within {self.timeout:g}s")
+        return remaining
+
+    # --- stream ---
+
+    def _fetch_stream(self, url):
+        from core import HUB
+
+        with self._lock:
+            tap, timer = self._streams.pop(url, (None, None))
+        if timer is not None:
+            timer.cancel()
+        if tap is None or tap.done:
+            tap = HUB.acquire(url, "snapshot")
+            last_seq = 0
+        else:
+            last_seq = tap.buffer.seq
+            tap.promote() # Catches up from the buffered GOP, so a fresh frame follows quickly
+        try:
+            _, frame, _ = tap.buffer.get(last_seq, timeout=self.timeout)
+            if frame is None:
+                raise SnapshotSourceError("stream gave no frame in time" if not tap.done else "stream failed")
+            ok, encoded = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), SNAPSHOT_JPEG_QUALITY])
+            if not ok:
+                raise SnapshotSourceError("could not encode frame")
+            return encoded.tobytes()
+        finally:
+            self._linger(url, tap)
+
+    def _linger(self, url, tap):
+        if tap.done or not self.linger:
+            tap.stop()
+            return
+        tap.demote()
+        timer = threading.Timer(self.linger, self._expire, (url, tap))
+        timer.daemon = True
+        with self._lock:
+            self._streams[url] = (tap, timer)
+        timer.start()
+
+    def _expire(self, url, tap):
+        with self._lock:
+            if self._streams.get(url, (None,))[0] is tap:
+                del self._streams[url]
+        tap.stop()
+
+
+def _socket_of(response):
+    """
+    The socket a streamed requests response reads from, or None where
+    urllib3 doesn't expose it (the session's read timeout then applies).
+    Taken from the response, not the connection: http.client drops the
+    connection's socket for HTTP/1.0 and "Connection: close" replies.
+    """
+    try:
+        return response.raw._fp.fp.raw._sock
+    except AttributeError:
+        return None
+
+
+# --- JOBS ---
+
+class SnapshotJob:
+    """
+    One photo, video clip or message. `done` is set once it was sent, spooled, dropped or failed.
+    `video` is the path of an MP4 file the job owns: it is deleted once the
+    job is over, or moved into the spool.
+    """
+
+    def __init__(self, caption, frame=None, jpeg=None, video=None, key=None, source_url=None):
+        self.caption = caption
+        self.frame = frame
+        self.source_url = source_url # Full-resolution image to fetch; `frame` is the fallback
+        self.jpeg = jpeg
+        self.video = video
+        self.key = key
+        self.created = time.time()
+        self.result = None
+        self.done = threading.Event()
+
+    def finish(self, result):
+        self.result = result
+        self.frame = None
+        self.done.set()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.result
+
+
+# --- SERVICE ---
+
+class SnapshotService:
+    """
+    Sends snapshots from one worker thread with a bounded queue.
+
+    * Frames are JPEG-encoded in memory on the worker, not in the caller.
+    * A snapshot with a `snapshot_url` sends the image fetched from there by
+      `source` (a SnapshotSource), or the frame if that fails in time.
+    * Presses for the same key (feed) within `coalesce_window` are merged:
+      a queued job takes the newest frame, a job already sent absorbs them.
+    * When the network is down, jobs are spooled to `spool_dir` and retried
+      with exponential backoff, also across restarts.
+    """
+
+    def __init__(self, client, queue_size=SNAPSHOT_QUEUE_SIZE, coalesce_window=COALESCE_WINDOW,
+                 spool_dir=SPOOL_DIR, retry_base=RETRY_BASE_DELAY, retry_max=RETRY_MAX_DELAY, source=None):
+        self.client = client
+        self.source = source or SnapshotSource()
+        self.queue_size = queue_size
+        self.coalesce_window = coalesce_window
+        self.spool_dir = spool_dir
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.stats = {SENT: 0, SPOOLED: 0, FAILED: 0, DROPPED: 0, COALESCED: 0, "retried": 0,
+                      "full_resolution": 0, "fallback": 0}
+
+        self._jobs = deque()
+        self._last_by_key = {}
+        self._busy = False
+        self._retry_delay = retry_base
+        self._retry_at = 0.0
+        self._spool_seq = 0
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="snapshots", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self.source.close()
+        if self.client is not None:
+            self.client.close()
+
+    # --- submitting ---
+
+    def snapshot(self, frame, feed_name, reason="Snapshot", snapshot_url=None):
+        """
+        Queues a snapshot of `frame` (BGR) for `feed_name`. Never blocks.
+        `reason` heads the caption; bursts are coalesced per (reason, feed).
+        With `snapshot_url` the worker sends a full-resolution image from
+        there instead, and `frame` only if that fails.
+        """
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        caption = f"{reason}: {feed_name}\nTime: {timestamp}"
+        return self.submit(SnapshotJob(caption, frame=frame, key=(reason, feed_name), source_url=snapshot_url))
+
+    def send_photo(self, jpeg, caption):
+        return self.submit(SnapshotJob(caption, jpeg=jpeg))
+
+    def send_video(self, path, caption):
+        """
+        Queues the MP4 file at `path`, which the service deletes once it is done with it.
+        """
+        return self.submit(SnapshotJob(caption, video=path))
+
+    def send_message(self, text):
+        return self.submit(SnapshotJob(text))
+
+    def submit(self, job):
+        if self.client is None:
+            print("Telegram Warning: Missing credentials, cannot send snapshot.")
+            return self._finish(job, FAILED)
+
+        now = time.monotonic()
+        with self._cond:
+            if job.key is not None:
+                for queued in self._jobs:
+                    if queued.key == job.key:
+                        # Still waiting: send the newest frame instead, once
+                        if job.frame is not None:
+                            queued.frame = job.frame.copy()
+                        return self._finish(job, COALESCED)
+                last = self._last_by_key.get(job.key)
+                if last is not None and now - last < self.coalesce_window:
+                    return self._finish(job, COALESCED)
+                self._last_by_key[job.key] = now
+
+            if len(self._jobs) >= self.queue_size:
+                return self._finish(job, DROPPED)
+            if job.frame is not None:
+                job.frame = job.frame.copy() # The caller keeps drawing on its buffers
+            self._jobs.append(job)
+            self._cond.notify_all()
+        return job
+
+    def flush(self, timeout=None):
+        """
+        Waits until the queue is empty and nothing is being sent. Spooled jobs don't count.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _finish(self, job, result):
+        self.stats[result] += 1
+        METRICS.incr(f"snapshots_{result}")
+        if job.video is not None and result != SPOOLED:
+            _remove(job.video)
+        job.finish(result)
+        return job
+
+    # --- worker ---
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._stop:
+                    if self._spooled() and time.monotonic() >= self._retry_at:
+                        break
+                    self._cond.wait(self._wait_time())
+                if self._stop:
+                    return
+                job = self._jobs.popleft() if self._jobs else None
+                self._busy = job is not None
+
+            if job is not None:
+                self._send_job(job)
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+            else:
+                self._retry_spool()
+
+    def _wait_time(self):
+        if not self._spooled():
+            return None
+        return max(0.05, self._retry_at - time.monotonic())
+
+    def _send_job(self, job):
+        start = METRICS.now()
+        try:
+            if job.source_url:
+                job.jpeg = self._fetch_full(job.source_url)
+            if job.jpeg is None and job.frame is not None:
+                ok, encoded = cv2.imencode(".jpg", job.frame, [int(cv2.IMWRITE_JPEG_QUALITY), SNAPSHOT_JPEG_QUALITY])
+                if not ok:
+                    print("Snapshot: could not encode frame")
+                    self._finish(job, FAILED)
+                    return
+                job.jpeg = encoded.tobytes()
+                job.frame = None
+
+            self._deliver(job.caption, job.jpeg, job.video)
+            print("Message sent successfully." if job.jpeg is None and job.video is None else "Snapshot sent successfully.")
+            self._finish(job, SENT)
+            # The link works, send anything spooled right away
+            self._retry_delay = self.retry_base
+            self._retry_at = 0.0
+        except RetryableError as e:
+            print(f"Snapshot: network problem ({e}), spooling for retry in {self._retry_delay:.1f}s")
+            self._spool(job)
+            self._finish(job, SPOOLED)
+            self._schedule_retry()
+        except Exception as e:
+            print(f"Failed to send snapshot: {e}")
+            self._finish(job, FAILED)
+        finally:
+            METRICS.observe("snapshot_send", start)
+
+    def _fetch_full(self, url):
+        """
+        The full-resolution JPEG from `url`, or None to fall back to the display frame.
+        """
+        try:
+            jpeg = self.source.fetch(url)
+        except Exception as e: # Whatever went wrong, the display frame still goes out
+            print(f"Snapshot: full-resolution image unavailable ({e}), sending the display frame")
+            self.stats["fallback"] += 1
+            METRICS.incr("snapshots_fallback")
+            return None
+        self.stats["full_resolution"] += 1
+        METRICS.incr("snapshots_full_resolution")
+        return jpeg
+
+    def _deliver(self, caption, jpeg=None, video=None):
+        if video is not None:
+            self.client.send_video(video, caption)
+        elif jpeg is not None:
+            self.client.send_photo(jpeg, caption)
+        else:
+            self.client.send_message(caption)
+
+    def _schedule_retry(self):
+        self._retry_at = time.monotonic() + self._retry_delay
+        self._retry_delay = min(self.retry_max, self._retry_delay * 2)
+
+    # --- disk spool ---
+
+    def _spooled(self):
+        """
+        Returns the spooled job files, oldest first.
+        """
+        try:
+            return sorted(name for name in os.listdir(self.spool_dir) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def _spool(self, job):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._spool_seq += 1
+        base = os.path.join(self.spool_dir, f"{job.created:.3f}-{os.getpid()}-{self._spool_seq:04d}")
+        if job.jpeg is not None:
+            with open(base + ".jpg", "wb") as f:
+                f.write(job.jpeg)
+        if job.video is not None:
+            shutil.move(job.video, base + ".mp4") # A rename unless the clip dir is another file system
+        # The .json is written last (atomically), so a half-written spool entry is never picked up
+        with open(base + ".tmp", "w") as f:
+            json.dump({"caption": job.caption, "photo": job.jpeg is not None, "video": job.video is not None}, f)
+        os.replace(base + ".tmp", base + ".json")
+
+        spooled = self._spooled()
+        for name in spooled[:max(0, len(spooled) - SPOOL_LIMIT)]:
+            print(f"Snapshot: spool full, discarding {name}")
+            self._unspool(os.path.join(self.spool_dir, name[:-len(".json")]))
+
+    def _unspool(self, base):
+        for suffix in (".json", ".jpg", ".mp4"):
+            _remove(base + suffix)
+
+    def _retry_spool(self):
+        """
+        Sends spooled jobs oldest first until one fails, then backs off.
+        """
+        for name in self._spooled():
+            with self._cond:
+                if self._jobs or self._stop:
+                    return # Fresh presses go first; they will queue behind the spool if it's still down
+            base = os.path.join(self.spool_dir, name[:-len(".json")])
+            try:
+                with open(base + ".json") as f:
+                    meta = json.load(f)
+                photo = None
+                if meta.get("photo"):
+                    with open(base + ".jpg", "rb") as f:
+                        photo = f.read()
+                self._deliver(meta["caption"], photo, base + ".mp4" if meta.get("video") else None)
+            except RetryableError as e:
+                print(f"Snapshot: retry failed ({e}), next attempt in {self._retry_delay:.1f}s")
+                self._schedule_retry()
+                return
+            except Exception as e:
+                print(f"Snapshot: dropping spooled {name}: {e}")
+                self._unspool(base)
+                continue
+            print(f"Snapshot: delivered spooled {name}")
+            self.stats["retried"] += 1
+            METRICS.incr("snapshots_retried")
+            self._unspool(base)
+        self._retry_delay = self.retry_base
+        self._retry_at = 0.0
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# --- LOCAL STAND-IN ---
+
+class StandInTelegram:
+    """
+    Tiny local HTTP server that answers like the Bot API, for testing without
+    the network. `fail_next` makes the next N requests fail with 503.
+    """
+
+    def __init__(self, port=0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stand_in = self
+        self.requests = []
+        self.fail_next = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if stand_in.fail_next > 0:
+                    stand_in.fail_next -= 1
+                    self._reply(503, {"ok": False, "description": "stand-in outage"})
+                    return
+                stand_in.requests.append((self.path.rsplit("/", 1)[-1], len(body), self.client_address[1]))
+                self._reply(200, {"ok": True, "result": {}})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, name="telegram-stand-in", daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StandInCamera:
+    """
+    Local HTTP server with a camera's snapshot endpoint (GET any path returns
+    `jpeg`). `delay` stalls every reply by that many seconds, `fail_next`
+    makes the next N requests fail with 500, `trickle` sends the body 100
+    bytes at a time with that many seconds in between, `digest` =
+    (user, password) requires digest auth, and `http10` answers like an
+    HTTP/1.0 camera that closes the connection after every reply.
+    """
+
+    def __init__(self, jpeg, port=0):
+        import hashlib
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from requests.utils import parse_dict_header
+
+        stand_in = self
+        self.jpeg = jpeg
+        self.delay = 0.0
+        self.fail_next = 0
+        self.trickle = 0.0
+        self.digest = None
+        self.http10 = False
+        self.requests = [] # Client port of every request
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stand_in.requests.append(self.client_address[1])
+                time.sleep(stand_in.delay)
+                status, body = 200, stand_in.jpeg
+                if stand_in.fail_next > 0:
+                    stand_in.fail_next -= 1
+                    status, body = 500, b"stand-in failure"
+                elif stand_in.digest is not None and not self._authorized():
+                    status, body = 401, b"unauthorized"
+                if stand_in.http10:
+                    self.protocol_version = "HTTP/1.0"
+                    self.close_connection = True
+                self.send_response(status)
+                self.send_header("Content-Type", "image/jpeg" if status == 200 else "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 401:
+                    self.send_header("WWW-Authenticate", 'Digest realm="stand-in", qop="auth", nonce="%s"' % NONCE)
+                self.end_headers()
+                try:
+                    if status == 200 and stand_in.trickle:
+                        for i in range(0, len(body), 100):
+                            self.wfile.write(body[i:i + 100])
+                            self.wfile.flush()
+                            time.sleep(stand_in.trickle)
+                    else:
+                        self.wfile.write(body)
+                except (ConnectionError, OSError):
+                    self.close_connection = True # Client gave up (timeout)
+
+            def _authorized(self):
+                header = self.headers.get("Authorization", "")
+                if not header.startswith("Digest "):
+                    return False
+                fields = parse_dict_header(header[len("Digest "):])
+                user, password = stand_in.digest
+                ha1 = hashlib.md5(f"{user}:stand-in:{password}".encode()).hexdigest()
+                ha2 = hashlib.md5(f"GET:{fields.get('uri')}".encode()).hexdigest()
+                expected = hashlib.md5(f"{ha1}:{NONCE}:{fields.get('nc')}:{fields.get('cnonce')}:auth:{ha2}".encode())
+                return fields.get("username") == user and fields.get("response") == expected.hexdigest()
+
+            def log_message(self, *args):
+                pass
+
+        NONCE = os.urandom(8).hex()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/snapshot.jpg"
+        threading.Thread(target=self.server.serve_forever, name="camera-stand-in", daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Exercise the snapshot service against a local stand-in Bot API.")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="Only run the stand-in (use with TELEGRAM_API_URL=http://127.0.0.1:PORT)")
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        stand_in = StandInTelegram(args.serve)
+        print(f"Stand-in Bot API on {stand_in.url}, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+                for request in stand_in.requests:
+                    print(f"  {request[0]}: {request[1]} bytes (client port {request[2]})")
+                stand_in.requests.clear()
+        except KeyboardInterrupt:
+            stand_in.close()
+        raise SystemExit
+
+    stand_in = StandInTelegram()
+    spool = tempfile.mkdtemp(prefix="videopi-spool-")
+    service = SnapshotService(TelegramClient("TOKEN", "42", stand_in.url), spool_dir=spool,
+                              coalesce_window=1.0, retry_base=0.2, retry_max=1.0).start()
+    frame = np.zeros((720, 1280, 3), np.uint8)
+
+    # A burst of presses on one feed is one snapshot
+    jobs = [service.snapshot(frame, "Front") for _ in range(5)]
+    service.flush(5)
+    print("burst:", [job.result for job in jobs])
+
+    # Outage: the snapshot is spooled and retried with backoff until the stand-in recovers
+    stand_in.fail_next = 3
+    job = service.snapshot(frame, "Back")
+    service.flush(5)
+    print("during outage:", job.result, "spooled:", len(service._spooled()))
+    deadline = time.monotonic() + 10
+    while service._spooled() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    print("after recovery: spooled:", len(service._spooled()), "stats:", service.stats)
+
+    ports = {request[2] for request in stand_in.requests}
+    print(f"requests: {len(stand_in.requests)} over {len(ports)} connection(s)")
+
+    # A clip is uploaded from its file and deleted after; during an outage the file moves into the spool
+    clip_dir = tempfile.mkdtemp(prefix="videopi-clips-")
+    for fail in (0, 2):
+        path = os.path.join(clip_dir, f"clip-{fail}.mp4")
+        with open(path, "wb") as f:
+            f.write(os.urandom(300 * 1024))
+        stand_in.fail_next = fail
+        job = service.send_video(path, "Clip")
+        service.flush(5)
+        deadline = time.monotonic() + 10
+        while service._spooled() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        print(f"clip after {fail} failure(s): {job.result}, uploaded {stand_in.requests[-1][1]} bytes, "
+              f"files left: {os.listdir(clip_dir) + os.listdir(spool)}")
+
+    # Full resolution from a snapshot_url: the camera's 1920x1080 JPEG, not the 320x240 display frame
+    display = np.zeros((240, 320, 3), np.uint8)
+    full = np.random.default_rng(0).integers(0, 255, (1080, 1920, 3), np.uint8)
+    camera = StandInCamera(cv2.imencode(".jpg", full)[1].tobytes())
+    service.source.timeout = 1.0
+    sizes = lambda: [request[1] for request in stand_in.requests[-1:]]
+    for reason in ("Snapshot", "Motion", "Doorbell"):
+        service.snapshot(display, "Front", reason, snapshot_url=camera.url)
+        service.flush(5)
+    print(f"full resolution: sent {sizes()} bytes, camera connections: {len(set(camera.requests))} "
+          f"for {len(camera.requests)} requests")
+
+    # Camera too slow or failing: the display frame goes out instead, after at most the timeout
+    for delay, fail, label in ((2.0, 0, "slow camera"), (0.0, 1, "camera error")):
+        camera.delay, camera.fail_next = delay, fail
+        start = time.monotonic()
+        service.snapshot(display, "Side", label, snapshot_url=camera.url)
+        service.flush(5)
+        print(f"{label}: sent {sizes()} bytes after {time.monotonic() - start:.1f}s")
+    camera.delay = 0.0
+
+    # A camera trickling 100 bytes every 0.25 s: the fetch still gives up at its deadline
+    camera.trickle = 0.25
+    start = time.monotonic()
+    try:
+        service.source.fetch(camera.url)
+        trickled = "image"
+    except SnapshotSourceError as e:
+        trickled = str(e)
+    elapsed = time.monotonic() - start
+    print(f"trickling camera: {trickled} after {elapsed:.2f}s")
+    if elapsed > service.source.timeout + 0.5:
+        raise SystemExit(f"FAIL: fetch took {elapsed:.2f}s with a {service.source.timeout:g}s timeout")
+    camera.trickle = 0.0
+
+    # Digest auth: the first request learns the challenge, later ones answer it right away
+    camera.digest = ("admin", "secret")
+    url = camera.url.replace("http://", "http://admin:secret@")
+    before = len(camera.requests)
+    for name in ("Front", "Back"):
+        service.snapshot(display, name, "Digest", snapshot_url=url)
+        service.flush(5)
+    print(f"digest auth: sent {sizes()} bytes, {len(camera.requests) - before} requests for 2 snapshots")
+    camera.digest = None
+
+    # An HTTP/1.0 camera closing the connection after each reply: still the full-resolution image
+    camera.http10 = True
+    before = service.stats["full_resolution"]
+    for name in ("Front", "Back"):
+        job = service.snapshot(display, name, "HTTP/1.0", snapshot_url=camera.url)
+        service.flush(5)
+    print(f"HTTP/1.0 camera: {job.result}, sent {sizes()} bytes")
+    if service.stats["full_resolution"] - before != 2:
+        raise SystemExit("FAIL: the HTTP/1.0 camera's image was not sent")
+    camera.trickle = 0.25
+    start = time.monotonic()
+    try:
+        service.source.fetch(camera.url)
+    except SnapshotSourceError as e:
+        print(f"HTTP/1.0 camera trickling: {e} after {time.monotonic() - start:.2f}s")
+    if time.monotonic() - start > service.source.timeout + 0.5:
+        raise SystemExit("FAIL: the HTTP/1.0 fetch overran its timeout")
+    camera.http10, camera.trickle = False, 0.0
+
+    # A stream URL (here a local clip standing in for the camera's main RTSP stream)
+    clip = os.path.join(spool, "main.mp4")
+    writer = cv2.VideoWriter(clip, cv2.VideoWriter_fourcc(*"mp4v"), 25, (1280, 720))
+    for i in range(50):
+        writer.write(np.full((720, 1280, 3), i * 5, np.uint8))
+    writer.release()
+    for label in ("stream", "stream again"):
+        start = time.monotonic()
+        service.snapshot(display, "Garage", label, snapshot_url=clip)
+        service.flush(5)
+        print(f"{label}: sent {sizes()} bytes after {time.monotonic() - start:.2f}s")
+    print("stats:", service.stats)
+
+    service.stop()
+    camera.close()
+    stand_in.close()
@@ -1,10 +1,12 @@
-import RPi.GPIO as GPIO
+import os
 import time
-from luma.core.interface.serial import spi
-from luma.core.render import canvas
-from luma.lcd.device import st7735
 import signal
 
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None # Imported off-device for take_over(), which only needs the pid file
+
 # --- CONFIGURATION (Must match doorbell_buttons.py) ---
 SPI_DC_PIN = 25
 SPI_RST_PIN = 27
@@ -13,13 +15,19 @@ SPI_BL_PIN = 24
 LCD_WIDTH = 128
 LCD_HEIGHT = 128
 
-device = None
+# Hand-off to the doorbell: it sends HANDOFF_SIGNAL to the pid in SPLASH_PID_FILE and
+# the splash exits leaving the panel initialised, lit and showing the splash.
+SPLASH_PID_FILE = os.getenv("VIDEOPI_SPLASH_PID", "/tmp/videopi-splash.pid")
+HANDOFF_SIGNAL = signal.SIGUSR1
+HANDOFF_TIMEOUT = 2.0 # Seconds the doorbell waits for the splash to exit
 
-# Suppress warnings that might appear before main script runs
-GPIO.setwarnings(False) 
+device = None
 
 # --- 1. SETUP DISPLAY (Minimal) ---
 def setup_display():
+    from luma.core.interface.serial import spi
+    from luma.lcd.device import st7735
+
     try:
         # Luma initializes BCM mode and GPIO setup
         serial_interface = spi(
@@ -52,6 +60,8 @@ def draw_splash(device):
     if not device:
         return
 
+    from luma.core.render import canvas
+
     print("Displaying splash screen...")
     with canvas(device) as draw:
         draw.rectangle(device.bounding_box, outline="black", fill="black")
@@ -61,11 +71,53 @@ def draw_splash(device):
         draw.text((10, 50), "Loading...", fill="white")
         draw.text((10, 90), "Wait for feed...", fill="gray")
 
+# --- 3. HAND-OFF ---
+def take_over(timeout=HANDOFF_TIMEOUT):
+    """
+    Called by the doorbell before it sets up the display: asks a running
+    splash to exit without blanking the panel and waits for it. Returns True
+    if the panel was handed over (initialised, lit, showing the splash), so
+    the caller can skip the reset and init sequence.
+    """
+    try:
+        with open(SPLASH_PID_FILE) as f:
+            pid = int(f.read())
+        os.kill(pid, HANDOFF_SIGNAL)
+    except (OSError, ValueError):
+        return False # No splash running (or not ours to signal)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.01)
+    print("Splash did not exit in time, resetting the display.")
+    return False
+
+def hand_off(signum, frame):
+    """HANDOFF_SIGNAL handler: exit and leave the splash on screen for the doorbell."""
+    if device:
+        device.persist = True # luma's exit hook would otherwise switch the panel off and clear it
+    remove_pid_file()
+    print("Splash handed the display over.")
+    exit(0)
+
+def remove_pid_file():
+    try:
+        os.remove(SPLASH_PID_FILE)
+    except OSError:
+        pass
+
 # --- SIGNAL HANDLER ---
 def cleanup_and_exit(signum, frame):
     """Signal handler function to gracefully shut down the splash screen."""
+    from luma.core.render import canvas
+
     global device
     print(f"\n--- SIGTERM detected in splash.py. Stopping display... ---")
+    remove_pid_file()
     
     if device:
         # 1. Blank the display immediately
@@ -85,11 +137,17 @@ def cleanup_and_exit(signum, frame):
     # Exit the application cleanly
     exit(0)
 
-# --- 3. MAIN EXECUTION ---
+# --- 4. MAIN EXECUTION ---
 if __name__ == "__main__":
+    # Suppress warnings that might appear before main script runs
+    GPIO.setwarnings(False) 
     signal.signal(signal.SIGTERM, cleanup_and_exit)
+    signal.signal(HANDOFF_SIGNAL, hand_off)
     device = setup_display()
     draw_splash(device)
+    if device:
+        with open(SPLASH_PID_FILE, "w") as f:
+            f.write(str(os.getpid()))
 
     # Keep the script running forever so systemd doesn't stop the screen
     try:
@@ -0,0 +1,130 @@
+import threading
+from collections import deque
+
+from core import HUB
+from decoder import BACKENDS, DEFAULT_BACKEND
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+# Each standby connection costs one RTSP session, one decoder context and up to
+# STANDBY_GOP_BYTES of packets. Two (next + prev) fit comfortably on the Zero 2W.
+STANDBY_BUDGET = 2
+SWITCH_HISTORY = 32
+
+
+def neighbour_indexes(index, count, budget):
+    """
+    Feed indexes to keep warm around `index`: next, prev, next+1, prev-1, ...
+    """
+    wanted = []
+    step = 1
+    while len(wanted) < budget and step <= count // 2 + 1:
+        for candidate in ((index + step) % count, (index - step) % count):
+            if candidate != index and candidate not in wanted and len(wanted) < budget:
+                wanted.append(candidate)
+        step += 1
+    return wanted
+
+
+class StandbyPool:
+    """
+    Keeps warm-standby readers for the feeds adjacent to the current one so
+    a switch can show a frame immediately instead of waiting for the RTSP
+    handshake, probing and the first keyframe.
+    """
+
+    def __init__(self, budget=STANDBY_BUDGET, backend=None, **decoder_options):
+        backend = backend or DEFAULT_BACKEND
+        if budget and not BACKENDS[backend].supports_standby:
+            print(f"Standby: the {backend} backend cannot idle cheaply, standby disabled.")
+            budget = 0
+        self.budget = budget
+        self.backend = backend
+        self.decoder_options = decoder_options
+        self.hits = 0
+        self.misses = 0
+        self.switch_latencies = deque(maxlen=SWITCH_HISTORY)
+        self._readers = {}
+        self._lock = threading.Lock()
+
+    def is_warm(self, url):
+        with self._lock:
+            reader = self._readers.get(url)
+            return reader is not None and reader.buffer.seq > 0 and not reader.done
+
+    def acquire(self, url, name, capture=None):
+        """
+        Returns a started, full-rate reader for `url` with the feed's `capture`
+        settings, promoting a standby one when available.
+        """
+        with self._lock:
+            reader = self._readers.pop(url, None)
+        if reader is not None and not reader.done and reader.capture == capture:
+            reader.promote()
+            self.hits += 1
+            return reader
+        if reader is not None:
+            reader.stop(timeout=0)
+        self.misses += 1
+        return HUB.acquire(url, name, self.backend, self.decoder_options, capture=capture)
+
+    def release(self, reader):
+        """
+        Hands a reader back; it stays warm if the next update() still wants it.
+        """
+        if self.budget == 0 or reader.done:
+            reader.stop(timeout=0)
+            return
+        reader.demote()
+        with self._lock:
+            previous = self._readers.get(reader.url)
+            self._readers[reader.url] = reader
+        if previous is not None and previous is not reader:
+            previous.stop(timeout=0)
+
+    def update(self, feeds, current_index):
+        """
+        Keeps standby readers for the neighbours of `current_index` (within the
+        budget) and stops all others.
+        """
+        wanted = {}
+        for index in neighbour_indexes(current_index, len(feeds), self.budget):
+            feed = feeds[index]
+            if feed['url'] and feed['url'] != feeds[current_index]['url']:
+                wanted.setdefault(feed['url'], feed)
+
+        with self._lock:
+            stale = [reader for url, reader in self._readers.items()
+                     if url not in wanted or reader.done or reader.capture != wanted[url].get('capture')]
+            for reader in stale:
+                del self._readers[reader.url]
+            missing = [feed for url, feed in wanted.items() if url not in self._readers]
+            for feed in missing:
+                self._readers[feed['url']] = HUB.acquire(feed['url'], feed['name'], self.backend, self.decoder_options,
+                                                         standby=True, capture=feed.get('capture'))
+
+        for reader in stale:
+            reader.stop(timeout=0)
+
+    def record_switch(self, seconds, warm):
+        self.switch_latencies.append(seconds)
+        METRICS.observe_value("switch", seconds)
+        METRICS.incr("switches_warm" if warm else "switches_cold")
+        print(f"Switch latency: {seconds * 1000:.0f} ms ({'warm' if warm else 'cold'})")
+
+    def stats(self):
+        latencies = sorted(self.switch_latencies)
+        return {
+            "standby": len(self._readers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "switch_ms_last": round(self.switch_latencies[-1] * 1000) if latencies else None,
+            "switch_ms_median": round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+        }
+
+    def close(self):
+        with self._lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for reader in readers:
+            reader.stop(timeout=0)
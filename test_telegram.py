@@ -1,18 +1,22 @@
 import os
 import sys
-import requests
 from dotenv import load_dotenv
 
+from snapshots import SnapshotService, TelegramClient, SENT, SPOOLED
+
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHATID = os.getenv("TELEGRAM_CHATID")
+SEND_TIMEOUT = 60 # Seconds to wait for the send before giving up
 
 
 def send_telegram_message(message, image_path=None):
     """
     Sends a message to the configured Telegram chat. 
     If image_path is provided, sends the image with the message as a caption.
+    Goes through the same snapshot service as the doorbell, so setting
+    TELEGRAM_API_URL to a local stand-in (python snapshots.py --serve 8081) tests it offline.
     """
     if not TELEGRAM_BOT_TOKEN:
         print("Error: TELEGRAM_BOT_TOKEN not found in environment variables.")
@@ -21,36 +25,27 @@ def send_telegram_message(message, image_path=None):
         print("Error: TELEGRAM_CHATID not found in environment variables.")
         return
 
-    if image_path:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-        try:
-            with open(image_path, 'rb') as f:
-                files = {'photo': f}
-                data = {
-                    "chat_id": TELEGRAM_CHATID,
-                    "caption": message
-                }
-                response = requests.post(url, data=data, files=files)
-        except FileNotFoundError:
-            print(f"Error: File not found at {image_path}")
-            return
-    else:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {
-            "chat_id": TELEGRAM_CHATID,
-            "text": message
-        }
-        response = requests.post(url, json=payload)
-
+    service = SnapshotService(TelegramClient.from_env()).start()
     try:
-        response.raise_for_status()
-        print(f"Message{' (with image)' if image_path else ''} sent successfully to chat ID {TELEGRAM_CHATID}")
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send message: {e}")
-        try:
-            print(f"Response: {response.text}")
-        except:
-            pass
+        if image_path:
+            try:
+                with open(image_path, 'rb') as f:
+                    job = service.send_photo(f.read(), message)
+            except FileNotFoundError:
+                print(f"Error: File not found at {image_path}")
+                return
+        else:
+            job = service.send_message(message)
+
+        result = job.wait(SEND_TIMEOUT)
+        if result == SENT:
+            print(f"Message{' (with image)' if image_path else ''} sent successfully to chat ID {TELEGRAM_CHATID}")
+        elif result == SPOOLED:
+            print(f"Network unavailable, message spooled in {service.spool_dir}; the doorbell will retry it")
+        else:
+            print(f"Failed to send message ({result or 'timed out'})")
+    finally:
+        service.stop()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
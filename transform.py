@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+TRANSFORM_CACHE_SIZE = 4 # Source sizes kept per thread (feeds rarely change resolution)
+
+
+# --- GEOMETRY ---
+
+def letterbox_geometry(source_size, target_size):
+    """
+    Returns (new_w, new_h, padding_h, padding_v): the size the source is
+    scaled to and its offset inside the target, keeping the aspect ratio.
+    """
+    source_w, source_h = source_size
+    target_width, target_height = target_size
+    target_aspect = target_width / target_height
+    source_aspect = source_w / source_h
+
+    if source_aspect > target_aspect:
+        new_w = target_width
+        new_h = int(source_h * target_width / source_w)
+        return new_w, new_h, 0, (target_height - new_h) // 2
+    new_h = target_height
+    new_w = int(source_w * target_height / source_h)
+    return new_w, new_h, (target_width - new_w) // 2, 0
+
+
+# --- TRANSFORMS ---
+
+class FrameTransform:
+    """
+    Scales frames of one source size to the target size, letterboxed or
+    stretched. The geometry is worked out once and frames are resized
+    straight into a view of a preallocated output buffer, which is reused:
+    the result is only valid until the next apply().
+
+    `output` may be a caller-owned (h, w, 3) view, e.g. one cell of a mosaic.
+    """
+
+    def __init__(self, source_size, target_size, letterbox=True, interpolation=cv2.INTER_LINEAR, output=None):
+        width, height = target_size
+        if letterbox:
+            self.new_w, self.new_h, self.padding_h, self.padding_v = letterbox_geometry(source_size, target_size)
+        else:
+            self.new_w, self.new_h, self.padding_h, self.padding_v = width, height, 0, 0
+        self.interpolation = interpolation
+        self.output = np.zeros((height, width, 3), dtype=np.uint8) if output is None else output
+
+        top, left = self.padding_v, self.padding_h
+        self.roi = self.output[top:top + self.new_h, left:left + self.new_w]
+        # Overlays may draw on the padding, so it is cleared on every frame
+        self.borders = [band for band in (
+            self.output[:top], self.output[top + self.new_h:],
+            self.output[top:top + self.new_h, :left], self.output[top:top + self.new_h, left + self.new_w:],
+        ) if band.size]
+
+    def apply(self, frame):
+        cv2.resize(frame, (self.new_w, self.new_h), dst=self.roi, interpolation=self.interpolation)
+        for band in self.borders:
+            band.fill(0)
+        return self.output
+
+
+class TransformCache:
+    """
+    FrameTransforms for one target size, keyed by source size. Each thread
+    gets its own so pipelines running in parallel never share an output
+    buffer. `allocations` counts output buffers created; it stays flat once
+    every source size has been seen.
+    """
+
+    def __init__(self, target_size, letterbox=True, interpolation=cv2.INTER_LINEAR, max_entries=TRANSFORM_CACHE_SIZE):
+        self.target_size = tuple(target_size)
+        self.letterbox = letterbox
+        self.interpolation = interpolation
+        self.max_entries = max_entries
+        self.allocations = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self, source_size):
+        transforms = getattr(self._local, "transforms", None)
+        if transforms is None:
+            transforms = self._local.transforms = OrderedDict()
+
+        transform = transforms.get(source_size)
+        if transform is not None:
+            transforms.move_to_end(source_size)
+            return transform
+
+        transform = FrameTransform(source_size, self.target_size, self.letterbox, self.interpolation)
+        transforms[source_size] = transform
+        if len(transforms) > self.max_entries:
+            transforms.popitem(last=False)
+        with self._lock:
+            self.allocations += 1
+        METRICS.incr("transform_allocations")
+        return transform
+
+    def __call__(self, frame):
+        """
+        Returns the transformed frame in a reused buffer.
+        """
+        return self.get((frame.shape[1], frame.shape[0])).apply(frame)
+
+
+# --- BENCHMARK ---
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description="Compare per-frame letterboxing with and without buffer reuse.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--source", default="1280x720")
+    parser.add_argument("--target", default="320x240")
+    parser.add_argument("--image", default="testimage.jpeg")
+    args = parser.parse_args()
+
+    source_size = tuple(int(v) for v in args.source.split("x"))
+    target_size = tuple(int(v) for v in args.target.split("x"))
+    image = cv2.imread(args.image)
+    if image is None:
+        image = np.full((source_size[1], source_size[0], 3), 96, np.uint8)
+    source = cv2.resize(image, source_size)
+
+    def legacy(frame):
+        new_w, new_h, padding_h, padding_v = letterbox_geometry((frame.shape[1], frame.shape[0]), target_size)
+        resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        canvas = np.zeros((target_size[1], target_size[0], 3), dtype=np.uint8)
+        canvas[padding_v:padding_v + new_h, padding_h:padding_h + new_w] = resized
+        return canvas
+
+    cache = TransformCache(target_size)
+
+    def run(label, transform):
+        transform(source) # Warm-up: first frame sets up the cached buffers
+        tracemalloc.start()
+        allocated = 0
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            transform(source)
+            allocated += tracemalloc.get_traced_memory()[1] - baseline
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+        print(f"{label:<22} {elapsed / args.frames * 1000:6.3f} ms/frame  {allocated / args.frames / 1024:8.1f} KiB allocated/frame")
+
+    run("letterbox (legacy)", legacy)
+    run("letterbox (reused)", cache)
+    print(f"output buffers allocated: {cache.allocations}")
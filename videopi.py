@@ -0,0 +1,84 @@
+"""
+Runs the LCD doorbell and the web server in one process. Both sinks take
+their frames from the shared hub in core.py, so every feed is pulled and
+decoded once, and each sink scales and rate-limits it for itself
+(128x128 for the LCD, 320x240 letterboxed at WEB_MAX_FPS for the web).
+
+    python videopi.py               # LCD + web on port 8080
+    python videopi.py --no-lcd      # web only (same as rtsp_stream_flask.py)
+    python videopi.py --async-web   # web views from one asyncio loop (async_server.py), no /live
+
+Start-up is ordered for time to the first LCD frame: the first feed starts
+connecting, then the LCD is taken over from splash.py, and the web server
+(Flask is a slow import) comes up in the background.
+"""
+import argparse
+import signal
+import threading
+
+# --- CONFIGURATION ---
+WEB_HOST = "0.0.0.0"
+WEB_PORT = 8080
+
+
+def start_flask_web(host=WEB_HOST, port=WEB_PORT):
+    """
+    Serves the Flask app from a background thread.
+    """
+    from werkzeug.serving import make_server
+    import rtsp_stream_flask
+
+    server = make_server(host, port, rtsp_stream_flask.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="web", daemon=True).start()
+    print(f"Web server on http://{host}:{port}/")
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LCD doorbell and web server sharing one decoder per feed.")
+    parser.add_argument("--no-lcd", action="store_true", help="Run only the web server")
+    parser.add_argument("--no-web", action="store_true", help="Run only the LCD doorbell")
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--async-web", action="store_true",
+                        help="Serve the MJPEG views from one event loop instead of a thread per viewer")
+    args = parser.parse_args(argv)
+    if args.async_web:
+        from async_server import start_async_web as start_web
+    else:
+        start_web = start_flask_web
+
+    if args.no_lcd:
+        if not args.no_web:
+            server = start_web(port=args.port)
+            try:
+                threading.Event().wait() # The web thread does the work
+            except KeyboardInterrupt:
+                server.shutdown()
+        return
+
+    import doorbell
+
+    print("--- Doorbell Started ---")
+    signal.signal(signal.SIGTERM, doorbell.cleanup_and_exit)
+    signal.signal(signal.SIGINT, doorbell.cleanup_and_exit)
+    signal.signal(signal.SIGUSR1, doorbell.toggle_debug_overlay)
+
+    doorbell.preconnect() # The first feed opens in its reader thread while the LCD is set up
+    doorbell.setup_hardware()
+    servers = []
+    if not args.no_web:
+        threading.Thread(target=lambda: servers.append(start_web(port=args.port)), name="web-start", daemon=True).start()
+    try:
+        doorbell.run_doorbell()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+        if doorbell.GPIO is not None:
+            doorbell.GPIO.cleanup()
+            print("GPIO Cleaned.")
+
+
+if __name__ == "__main__":
+    main()